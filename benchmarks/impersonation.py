@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the per-call overhead of the impersonation layer.
+
+Compares the ``unittest.mock.patch(wraps=...)`` proxies formerly used to impersonate a system
+against the plain substitutions from :py:mod:`pip_tools_compile.patching`.
+
+    python benchmarks/impersonation.py [--number 100000]
+"""
+import argparse
+import functools
+import timeit
+from unittest import mock
+
+from pip._vendor.packaging import markers
+from pip._vendor.packaging import tags
+
+from pip_tools_compile.__main__ import ImpersonateLinux
+from pip_tools_compile.__main__ import tweak_packaging_markers
+from pip_tools_compile.patching import constant
+from pip_tools_compile.patching import Substitution
+
+MARKER = markers.Marker('sys_platform == "linux" and python_version >= "3.6"')
+
+
+def _evaluate_marker():
+    MARKER.evaluate()
+
+
+def _platform_tags():
+    tags._platform_tags()
+
+
+def _mock_patches(impersonation):
+    return [
+        mock.patch(
+            "pip._vendor.packaging.markers.default_environment",
+            wraps=functools.partial(tweak_packaging_markers, impersonation),
+        ),
+        mock.patch("pip._vendor.packaging.tags._platform_tags", return_value=["linux_x86_64"]),
+    ]
+
+
+def _substitutions(impersonation):
+    environment = tweak_packaging_markers(impersonation)
+    return [
+        Substitution(
+            "pip._vendor.packaging.markers.default_environment",
+            functools.partial(dict, environment),
+        ),
+        Substitution("pip._vendor.packaging.tags._platform_tags", constant(["linux_x86_64"])),
+    ]
+
+
+def _measure(patches, number):
+    for patch in patches:
+        patch.start()
+    try:
+        return {
+            "marker evaluation": timeit.timeit(_evaluate_marker, number=number),
+            "platform tags": timeit.timeit(_platform_tags, number=number),
+        }
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=100000, help="Calls per measurement")
+    options = parser.parse_args()
+    impersonation = ImpersonateLinux("3.7", "linux")
+    results = {
+        "mock.patch": _measure(_mock_patches(impersonation), options.number),
+        "substitution": _measure(_substitutions(impersonation), options.number),
+    }
+    print("{:<20} {:>16} {:>16} {:>8}".format("", "mock.patch", "substitution", "ratio"))
+    for name in results["mock.patch"]:
+        mocked = results["mock.patch"][name] / options.number * 1000000
+        substituted = results["substitution"][name] / options.number * 1000000
+        print(
+            "{:<20} {:>13.2f} us {:>13.2f} us {:>7.1f}x".format(
+                name, mocked, substituted, mocked / substituted
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
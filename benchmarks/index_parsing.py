@@ -0,0 +1,92 @@
+"""
+Benchmark of the parsing of a project index page.
+
+Compares pip's ``html5lib`` based parsing, followed by the evaluation of every link, against the
+streaming parser from :py:mod:`pip_tools_compile.indexparser`, for the time taken and the peak
+memory allocated.
+
+    python benchmarks/index_parsing.py [--project botocore] [--py-version 3.7] [--platform linux]
+"""
+import argparse
+import time
+import tracemalloc
+
+from pip._internal.index.collector import HTMLPage
+from pip._internal.index.collector import parse_links
+from pip._internal.index.package_finder import LinkEvaluator
+from pip._internal.network.session import PipSession
+
+from pip_tools_compile import indexparser
+from pip_tools_compile.__main__ import IMPERSONATIONS
+from pip_tools_compile.__main__ import TargetPython
+
+
+def _measure(func, rounds):
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = func()
+        duration = (time.perf_counter() - start) / rounds
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return duration, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--project", default="botocore")
+    parser.add_argument("--py-version", default="3.7")
+    parser.add_argument("--platform", default="linux", choices=sorted(IMPERSONATIONS))
+    parser.add_argument("--index-url", default="https://pypi.org/simple")
+    parser.add_argument("--rounds", type=int, default=3)
+    options = parser.parse_args()
+
+    url = "{}/{}/".format(options.index_url.rstrip("/"), options.project)
+    response = PipSession().get(url, headers={"Accept": "text/html"})
+    response.raise_for_status()
+    page = HTMLPage(response.content, "utf-8", url, cache_link_parsing=False)
+
+    with IMPERSONATIONS[options.platform](options.py_version, options.platform) as impersonation:
+        version_info = impersonation._python_version_info[:3]
+        link_evaluator = LinkEvaluator(
+            project_name=options.project,
+            canonical_name=options.project,
+            formats=frozenset(["binary", "source"]),
+            target_python=TargetPython(version_info, impersonation._platform),
+            allow_yanked=True,
+        )
+
+        def pip_parse():
+            return [
+                link for link in parse_links(page) if link_evaluator.evaluate_link(link)[0] is True
+            ]
+
+        def streaming_parse():
+            link_filter = indexparser.LinkFilter(link_evaluator)
+            return [
+                link
+                for link in indexparser.iter_links(page, link_filter)
+                if link_evaluator.evaluate_link(link)[0] is True
+            ]
+
+        pip_duration, pip_peak, pip_links = _measure(pip_parse, options.rounds)
+        streaming_duration, streaming_peak, streaming_links = _measure(
+            streaming_parse, options.rounds
+        )
+
+    assert [link.url for link in pip_links] == [link.url for link in streaming_links]
+    print(
+        "{}: {} KiB page, {} candidate links".format(url, len(page.content) // 1024, len(pip_links))
+    )
+    print("{:<12} {:>12} {:>14}".format("", "time", "peak memory"))
+    for name, duration, peak in (
+        ("pip", pip_duration, pip_peak),
+        ("streaming", streaming_duration, streaming_peak),
+    ):
+        print("{:<12} {:>9.1f} ms {:>10.1f} MiB".format(name, duration * 1000, peak / 1024**2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark of the resolver engines on requirements files.
+
+Compiles each requirements file with pip-tools' round based resolver and with the backtracking
+one from :py:mod:`pip_tools_compile.backtracking`, each compile in its own process, and compares
+the resolver rounds, the wall time and the peak memory of the process. A first compile warms the
+HTTP cache up, the measured ones start from an empty dependency cache.
+
+A round of pip-tools' resolver looks up every known requirement, a round of the backtracking one
+pins a single project.
+
+    python benchmarks/resolver_engines.py [--py-version 3.7] [--platform linux] FILE.in...
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pip_tools_compile.__main__ import IMPERSONATIONS
+from pip_tools_compile.backtracking import ENGINES
+from pip_tools_compile.equivalence import strip_header
+
+
+def _compile(source, engine, options, output_dir, prefix, clean_cache=True):
+    events_path = os.path.join(output_dir, "events.ndjson")
+    cmd = [
+        sys.executable,
+        "-m",
+        "pip_tools_compile",
+        "--py-version={}".format(options.py_version),
+        "--platform={}".format(options.platform),
+        "--resolver={}".format(engine),
+        "--output-dir={}".format(output_dir),
+        "--out-prefix={}".format(prefix),
+        "--events={}".format(events_path),
+        source,
+    ]
+    if clean_cache:
+        cmd.append("--clean-cache")
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    duration = time.perf_counter() - start
+    exitcode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    rounds = None
+    with open(events_path) as rfh:
+        for line in rfh:
+            event = json.loads(line)
+            if event["event"] == "target_finished" and rounds is None:
+                rounds = event["rounds"]
+            elif event["event"] == "backtracking":
+                rounds = event["rounds"]
+    # Kilobytes on Linux, bytes on macOS
+    peak = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    output_path = os.path.join(
+        output_dir, "{}-{}".format(prefix, os.path.basename(source).replace(".in", ".txt"))
+    )
+    return exitcode, rounds, duration, peak, output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--py-version", default="3.7")
+    parser.add_argument("--platform", default="linux", choices=sorted(IMPERSONATIONS))
+    parser.add_argument("files", nargs="+")
+    options = parser.parse_args()
+
+    print("{:<40} {:<14} {:>8} {:>10} {:>12}".format("", "engine", "rounds", "time", "peak memory"))
+    for source in options.files:
+        with tempfile.TemporaryDirectory() as output_dir:
+            _compile(source, ENGINES[0], options, output_dir, "warmup", clean_cache=False)
+            outputs = {}
+            for engine in ENGINES:
+                exitcode, rounds, duration, peak, output_path = _compile(
+                    source, engine, options, output_dir, engine
+                )
+                if exitcode == 0:
+                    with open(output_path) as rfh:
+                        # The header holds the output path
+                        outputs[engine] = strip_header(rfh.read())
+                print(
+                    "{:<40} {:<14} {:>8} {:>7.1f} s {:>8.1f} MiB{}".format(
+                        source,
+                        engine,
+                        rounds if rounds is not None else "-",
+                        duration,
+                        peak / 1024**2,
+                        "" if exitcode == 0 else "  (failed)",
+                    )
+                )
+            if len(set(outputs.values())) > 1:
+                print("{:<40} the engines pinned different versions".format(source))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,13 @@ pip-tools-compile
 Wrapper around pip-tools to "impersonate" different distributions when compiling requirements
 """
 import argparse
-import atexit
+import collections
+import contextlib
+import contextvars
 import functools
+import glob
 import io
+import json
 import logging
 import os
 import platform
@@ -15,32 +19,109 @@ import re
 import shutil
 import sys
 import textwrap
+import threading
+import time
 import traceback
 from collections import namedtuple
-from unittest import mock
 
-from pip_tools_compile import __version__
+from pip_tools_compile import backtracking
+from pip_tools_compile import checkpoint
+from pip_tools_compile import costledger
+from pip_tools_compile import equivalence
+from pip_tools_compile import eventstream
+from pip_tools_compile import httparchive
+from pip_tools_compile import indexparser
+from pip_tools_compile import inputcheck
+from pip_tools_compile import localproxy
+from pip_tools_compile import lockgraph
+from pip_tools_compile import multiindex
+from pip_tools_compile import negativecache
+from pip_tools_compile import offline
+from pip_tools_compile import prefetch
+from pip_tools_compile import resolvertrace
+from pip_tools_compile import resultcache
+from pip_tools_compile import seeding
+from pip_tools_compile import sessionpool
+from pip_tools_compile import sharding
+from pip_tools_compile import variants
+from pip_tools_compile.patching import constant
+from pip_tools_compile.patching import Substitution
 
 SYSTEM = platform.system().lower()
 CAPTURE_OUTPUT = os.environ.get("CAPTURE_OUTPUT", "1") == "1"
 VERBOSE_COMPILE = os.environ.get("VERBOSE_COMPILE", "0") == "1"
+# Bumped when the contents of the depcache files written by older releases can't be reused
+DEPCACHE_SCHEMA = 1
+# The machines which can be impersonated, by lowercase name
+MACHINES = {"arm64": "arm64", "amd64": "AMD64", "x86_64": "x86_64"}
 
-LOG_STREAM = io.StringIO()
-logging.basicConfig(
-    level=logging.DEBUG,
-    stream=LOG_STREAM,
-    datefmt="%H:%M:%S",
-    format="%(asctime)s,%(msecs)03.0f [%(name)-5s:%(lineno)-4d][%(levelname)-8s] %(message)s",
-)
+LOG_DATEFMT = "%H:%M:%S"
+LOG_FORMAT = "%(asctime)s,%(msecs)03.0f [%(name)-5s:%(lineno)-4d][%(levelname)-8s] %(message)s"
+
+import click
 
 # Keep a reference to the original DependencyCache class
 from piptools.cache import DependencyCache
+from piptools.exceptions import NoCandidateFound
 from piptools.repositories import PyPIRepository as _PyPIRepository
+from piptools.utils import as_tuple
+from piptools.utils import make_install_requirement
+from piptools.writer import OutputWriter as _OutputWriter
+from pip._internal.build_env import BuildEnvironment
+from pip._internal.index.collector import parse_links
 from pip._internal.models.target_python import TargetPython as _TargetPython
+from pip._internal.req.req_tracker import RequirementTracker
+from pip._internal.utils.temp_dir import TempDirectory
 from pip._vendor.packaging.markers import default_environment
+from pip._vendor.packaging.version import parse as parse_version
 
 DEFAULT_ENVIRONMENT = default_environment()
 
+# Compiles resolving in other threads can fetch, or build, the same distribution
+_DEPENDENCY_LOCKS = collections.defaultdict(threading.Lock)
+_DEPENDENCY_LOCKS_LOCK = threading.Lock()
+
+# Input files are rewritten in place while compiling, see _compile_requirement_file
+_INPUT_LOCKS = collections.defaultdict(threading.RLock)
+_INPUT_LOCKS_LOCK = threading.Lock()
+
+# Isolated builds change os.environ, one at a time
+_BUILD_ENV_LOCK = threading.RLock()
+_build_env_enter = BuildEnvironment.__enter__
+_build_env_exit = BuildEnvironment.__exit__
+
+CacheSettings = namedtuple("CacheSettings", ["static_requirements", "clean"])
+CacheSettings.__doc__ = """
+How the caches of the compile are named and kept.
+
+``static_requirements`` selects the depcache of the static requirements, ``clean`` discards the
+dependency, negative and absence caches before using them.
+"""
+
+_CURRENT_CACHE_SETTINGS = contextvars.ContextVar(
+    "pip_tools_compile_cache_settings",
+    default=CacheSettings(static_requirements=False, clean=False),
+)
+
+
+def get_current_cache_settings():
+    """
+    Return the :py:class:`CacheSettings` in effect.
+    """
+    return _CURRENT_CACHE_SETTINGS.get()
+
+
+@contextlib.contextmanager
+def activate_cache_settings(settings):
+    """
+    Use the caches according to ``settings`` within this context.
+    """
+    token = _CURRENT_CACHE_SETTINGS.set(settings)
+    try:
+        yield settings
+    finally:
+        _CURRENT_CACHE_SETTINGS.reset(token)
+
 
 class PyPIRepository(_PyPIRepository):
     def __init__(self, mocked_python_version, mocked_platform, pip_args, cache_dir):
@@ -48,6 +129,13 @@ class PyPIRepository(_PyPIRepository):
         pip_args.append("--python-version={}.{}".format(*mocked_python_version))
         pip_args.append("--platform={}".format(mocked_platform))
         super().__init__(pip_args, cache_dir)
+        self._session_pool = sessionpool.get_current_pool()
+        if self._session_pool is not None:
+            # Keep-alive connections from the previous compiles, before any adapter is wrapped
+            self._session_pool.attach(self.session, self.options)
+        if httparchive.get_current_archive() is not None:
+            # Every request must go through the archive
+            self._session_pool = None
         # We re-initialize self.finder because we want to pass the target_python
         # which avoids a lot of sys,version_info patching
         self.finder = self.command._build_package_finder(
@@ -57,16 +145,367 @@ class PyPIRepository(_PyPIRepository):
         )
         self._mocked_python_version = mocked_python_version
         self._mocked_platform = mocked_platform
+        self.seed_pins = seeding.get_current_seeds()
+        offline_misses = offline.get_current_misses()
+        if offline_misses is not None:
+            offline.install(self.session, offline_misses)
+        proxy_url = localproxy.get_current_proxy()
+        if proxy_url is not None:
+            localproxy.install(self.session, proxy_url)
+        http_archive = httparchive.get_current_archive()
+        if http_archive is not None:
+            http_archive.install(self.session)
+        event_stream = eventstream.get_current_stream()
+        if event_stream is not None:
+            event_stream.install(self.session)
+        self._cost_ledger = costledger.get_current_ledger()
+        if self._cost_ledger is not None:
+            self._cost_ledger.install(self.session)
         # piptools does not pass py_version_info when creating the resolver.
         # Let's force it to do that
         self._original_make_resolver = self.command.make_resolver
         self.command.make_resolver = self._make_resolver
+        self._negative_cache = negativecache.NegativeCache(
+            os.path.join(
+                self._cache_dir,
+                "negcache-{}-mocked-py{}.{}.json".format(mocked_platform, *mocked_python_version),
+            )
+        )
+        if get_current_cache_settings().clean:
+            self._negative_cache.clear()
+        self._index_validators = negativecache.ValidatorRecorder(self.finder.index_urls)
+        self._index_validators.install(self.session)
+        self._prefetcher = None
+        prefetch_settings = prefetch.get_current_settings()
+        if prefetch_settings is not None:
+            self._prefetcher = prefetch_settings.create_prefetcher(
+                self.session, self.finder, self._download_dir
+            )
+        self._multi_index = None
+        multi_index_settings = multiindex.get_current_settings()
+        if multi_index_settings is not None and len(self.finder.index_urls) > 1:
+            # pylint: disable=protected-access
+            self._multi_index = multi_index_settings.create_fetcher(
+                self.finder._link_collector,
+                os.path.join(self._cache_dir, "index-absences.json"),
+            )
+            # pylint: enable=protected-access
+        # Per thread, the prefetch threads also evaluate links
+        self._rejected_links = threading.local()
+        # Parse the index pages ourselves, dropping what the impersonated system can't use
+        self.finder.process_project_url = self._process_project_url
+        if resolvertrace.get_current_trace() is not None:
+            # Record why the finder skips links while tracing
+            self._original_get_install_candidate = self.finder.get_install_candidate
+            self.finder.get_install_candidate = self._get_install_candidate
 
     def _make_resolver(self, *args, py_version_info=None, **kwargs):
         if py_version_info is None:
             py_version_info = self._mocked_python_version
         return self._original_make_resolver(*args, py_version_info=py_version_info, **kwargs)
 
+    def _get_install_candidate(self, link_evaluator, link):
+        candidate = self._original_get_install_candidate(link_evaluator, link)
+        rejected_links = getattr(self._rejected_links, "links", None)
+        if candidate is None and rejected_links is not None:
+            _, reason = link_evaluator.evaluate_link(link)
+            if reason is None:
+                # pip does not give a reason when the requires-python check fails
+                reason = "requires-python {} does not match Python {}.{}".format(
+                    link.requires_python, *self._mocked_python_version
+                )
+            rejected_links.append("{}: {}".format(link.filename, reason))
+        return candidate
+
+    def _record_rejected_link(self, filename, reason):
+        rejected_links = getattr(self._rejected_links, "links", None)
+        if rejected_links is not None:
+            rejected_links.append("{}: {}".format(filename, reason))
+
+    def _fetch_project_page(self, project_url, project_name):
+        html_page = None
+        if self._session_pool is not None:
+            html_page = self._session_pool.get_page(project_url.url)
+            eventstream.emit(
+                "cache", cache="index-page", hit=html_page is not None, url=project_url.url
+            )
+            if html_page is not None:
+                log.debug("Reusing the project page fetched by a previous compile")
+                return html_page
+        if self._multi_index is None:
+            # pylint: disable=protected-access
+            html_page = self.finder._link_collector.fetch_page(project_url)
+            # pylint: enable=protected-access
+        else:
+            html_page = self._multi_index.fetch_page(project_url, project_name)
+        if html_page is not None and self._session_pool is not None:
+            self._session_pool.add_page(project_url.url, html_page)
+        return html_page
+
+    def _process_project_url(self, project_url, link_evaluator):
+        log.debug("Fetching project page and analyzing links: %s", project_url)
+        html_page = self._fetch_project_page(project_url, link_evaluator.project_name)
+        if html_page is None:
+            return []
+        link_filter = indexparser.LinkFilter(link_evaluator, on_reject=self._record_rejected_link)
+        if equivalence.get_current_recorder() is None:
+            links = indexparser.iter_links(html_page, link_filter)
+        else:
+            # Every file must be judged by pip's link evaluator for its decision to be recorded
+            links = parse_links(html_page)
+        candidates = self.finder.evaluate_links(link_evaluator, links=links)
+        log.debug(
+            "%s: %d links dropped while parsing, %d evaluated by pip",
+            project_url,
+            link_filter.rejected,
+            link_filter.accepted,
+        )
+        return candidates
+
+    @contextlib.contextmanager
+    def freshen_build_caches(self):
+        # pip-tools starts every resolver round with fresh build caches
+        resolver_trace = resolvertrace.get_current_trace()
+        run_checkpoint = checkpoint.get_current_checkpoint()
+        with super().freshen_build_caches(), eventstream.resolver_round():
+            try:
+                if resolver_trace is None:
+                    yield
+                else:
+                    with resolver_trace.round():
+                        yield
+            finally:
+                if run_checkpoint is not None:
+                    run_checkpoint.end_round()
+
+    def find_all_candidates(self, req_name):
+        if self._cost_ledger is None or req_name in self._available_candidates_cache:
+            return self._find_all_candidates(req_name)
+        self._cost_ledger.add_index_urls(
+            req_name, self.finder.search_scope.get_index_urls_locations(req_name)
+        )
+        with self._cost_ledger.lookup(req_name):
+            candidates = self._find_all_candidates(req_name)
+        self._cost_ledger.add_links(req_name, (candidate.link for candidate in candidates))
+        return candidates
+
+    def _find_all_candidates(self, req_name):
+        resolver_trace = resolvertrace.get_current_trace()
+        if resolver_trace is None or req_name in self._available_candidates_cache:
+            return super().find_all_candidates(req_name)
+        with resolver_trace.span(
+            "find_all_candidates {}".format(req_name), "index", project=req_name
+        ) as args:
+            self._rejected_links.links = args["rejected"] = []
+            try:
+                candidates = super().find_all_candidates(req_name)
+            finally:
+                self._rejected_links.links = None
+            args["candidates"] = len(candidates)
+        return candidates
+
+    def _find_seeded_match(self, ireq):
+        version = self.seed_pins.get(ireq.name)
+        if version is None:
+            return None
+        candidates = []
+        if ireq.specifier.contains(version, prereleases=True):
+            candidates = [
+                candidate
+                for candidate in self.find_all_candidates(ireq.name)
+                if candidate.version == parse_version(version) and not candidate.link.is_yanked
+            ]
+        # Unless the impersonated system can install that version, the compile diverges
+        self.seed_pins.record(ireq.name, used=bool(candidates))
+        if not candidates:
+            log.debug("Not using the seed pin %s==%s for %s", ireq.name, version, ireq)
+            return None
+        return make_install_requirement(
+            candidates[0].name, candidates[0].version, ireq.extras, constraint=ireq.constraint
+        )
+
+    def _get_negative_cache_key(self, ireq, prereleases):
+        # Everything which changes the candidates the finder accepts, besides the system
+        format_control = self.finder.format_control
+        # pylint: disable=protected-access
+        candidate_prefs = self.finder._candidate_prefs
+        # pylint: enable=protected-access
+        return "{}{} no-binary={} only-binary={}{}".format(
+            ireq.specifier,
+            " +prereleases" if prereleases or candidate_prefs.allow_all_prereleases else "",
+            ",".join(sorted(format_control.no_binary)),
+            ",".join(sorted(format_control.only_binary)),
+            " +prefer-binary" if candidate_prefs.prefer_binary else "",
+        )
+
+    def _find_best_match(self, ireq, prereleases):
+        if self.seed_pins:
+            seeded_match = self._find_seeded_match(ireq)
+            if seeded_match is not None:
+                return seeded_match
+        if self.finder.find_links:
+            # We can't tell if local directories changed
+            return super().find_best_match(ireq, prereleases=prereleases)
+        key = self._get_negative_cache_key(ireq, prereleases)
+        if self._negative_cache.lookup(ireq.name, key) is not None:
+            validators = self._index_validators.get_index_validators(self.session, ireq.name)
+            if validators is not None:
+                candidates_tried = self._negative_cache.get(ireq.name, key, validators)
+                if candidates_tried is not None:
+                    log.info("No candidate for %s according to the negative cache", ireq)
+                    eventstream.emit("cache", cache="negative", hit=True, requirement=str(ireq))
+                    raise NoCandidateFound(ireq, candidates_tried, self.finder)
+        try:
+            return super().find_best_match(ireq, prereleases=prereleases)
+        except NoCandidateFound as exc:
+            # Recorded when the finder fetched the pages
+            validators = self._index_validators.get_index_validators(self.session, ireq.name)
+            if validators is not None:
+                self._negative_cache.add(ireq.name, key, validators, exc.candidates_tried)
+            raise
+
+    def find_best_match(self, ireq, prereleases=None):
+        if ireq.editable or ireq.link:
+            return super().find_best_match(ireq, prereleases=prereleases)
+        resolver_trace = resolvertrace.get_current_trace()
+        if resolver_trace is None:
+            best_match = self._find_best_match(ireq, prereleases)
+        else:
+            best_match = self._traced_find_best_match(resolver_trace, ireq, prereleases)
+        decision_recorder = equivalence.get_current_recorder()
+        if decision_recorder is not None:
+            # pylint: disable=protected-access
+            candidate_prefs = self.finder._candidate_prefs
+            # pylint: enable=protected-access
+            decision_recorder.add_best_match(
+                ireq,
+                prereleases,
+                best_match,
+                candidate_prefs.prefer_binary or self._is_yanked(ireq, best_match),
+            )
+        run_checkpoint = checkpoint.get_current_checkpoint()
+        if run_checkpoint is not None:
+            run_checkpoint.add_pin(best_match)
+        if self._prefetcher is not None:
+            # The resolver asks for the dependencies of the best matches once all are known
+            self._prefetcher.schedule_ireq(best_match)
+        return best_match
+
+    def _is_yanked(self, ireq, best_match):
+        # pip only picks a yanked version when nothing else matches
+        _, version, _ = as_tuple(best_match)
+        return all(
+            candidate.link.is_yanked
+            for candidate in self._available_candidates_cache.get(ireq.name, [])
+            if str(candidate.version) == version
+        )
+
+    def _traced_find_best_match(self, resolver_trace, ireq, prereleases):
+        with resolver_trace.span(
+            "find_best_match {}".format(ireq.name),
+            "candidates",
+            constraint=str(ireq),
+            round=resolver_trace.rounds,
+        ) as args:
+            try:
+                best_match = self._find_best_match(ireq, prereleases)
+            except Exception as exc:
+                args["error"] = str(exc)
+                raise
+            finally:
+                candidates = self._available_candidates_cache.get(ireq.name)
+                if candidates is not None:
+                    versions = {candidate.version for candidate in candidates}
+                    matching_versions = set(
+                        ireq.specifier.filter(versions, prereleases=prereleases)
+                    )
+                    args["rejected_by_specifier"] = [
+                        str(version) for version in sorted(versions - matching_versions)
+                    ]
+            args["best_match"] = str(best_match.req)
+        return best_match
+
+    def get_dependencies(self, ireq):
+        if ireq not in self._dependencies_cache:
+            # pip-tools only asks when its dependency cache misses
+            eventstream.emit("cache", cache="dependencies", hit=False, requirement=str(ireq))
+            if self._cost_ledger is not None:
+                return self._get_dependencies_costed(ireq)
+        return self._get_prefetched_dependencies(ireq)
+
+    def _get_dependencies_costed(self, ireq):
+        project_name = ireq.name or str(ireq)
+        with self._cost_ledger.lookup(project_name):
+            dependencies = self._get_prefetched_dependencies(ireq)
+        if ireq.editable or (ireq.link and not ireq.link.is_wheel):
+            # Its metadata had to be built
+            self._cost_ledger.add_build(project_name)
+        return dependencies
+
+    def _get_prefetched_dependencies(self, ireq):
+        if self._prefetcher is None or ireq in self._dependencies_cache:
+            return self._get_dependencies(ireq)
+        self._prefetcher.wait(ireq)
+        dependencies = self._get_dependencies(ireq)
+        # Most of these are the candidates of the next resolver round
+        for dependency in dependencies:
+            self._prefetcher.schedule_ireq(dependency)
+        return dependencies
+
+    def _get_dependencies(self, ireq):
+        if ireq in self._dependencies_cache:
+            return super().get_dependencies(ireq)
+        with _get_dependency_lock(ireq):
+            resolver_trace = resolvertrace.get_current_trace()
+            if resolver_trace is None:
+                return super().get_dependencies(ireq)
+            with resolver_trace.span(
+                "get_dependencies {}".format(ireq.name or ireq),
+                "metadata",
+                requirement=str(ireq),
+                round=resolver_trace.rounds,
+            ) as args:
+                dependencies = super().get_dependencies(ireq)
+                args["dependencies"] = sorted(str(dependency) for dependency in dependencies)
+            return dependencies
+
+
+def _get_dependency_lock(ireq):
+    with _DEPENDENCY_LOCKS_LOCK:
+        return _DEPENDENCY_LOCKS[str(ireq.link or ireq.req)]
+
+
+@contextlib.contextmanager
+def _global_tempdir_manager():
+    # pip registers its temporary directories with a process wide stack, use one per context
+    with contextlib.ExitStack() as stack, Substitution(
+        "pip._internal.utils.temp_dir._tempdir_manager", stack
+    ):
+        yield
+
+
+@contextlib.contextmanager
+def _get_requirement_tracker():
+    # pip shares its build tracker through os.environ, which the other threads would see go away
+    with TempDirectory(kind="req-tracker") as root, RequirementTracker(root.path) as tracker:
+        yield tracker
+
+
+def _enter_build_env(build_env):
+    _BUILD_ENV_LOCK.acquire()
+    try:
+        return _build_env_enter(build_env)
+    except BaseException:
+        _BUILD_ENV_LOCK.release()
+        raise
+
+
+def _exit_build_env(build_env, *exc_info):
+    try:
+        return _build_env_exit(build_env, *exc_info)
+    finally:
+        _BUILD_ENV_LOCK.release()
+
 
 class TargetPython(_TargetPython):
     def __init__(
@@ -90,6 +529,20 @@ class TargetPython(_TargetPython):
         )
 
 
+class OutputWriter(_OutputWriter):
+    def write(self, results, unsafe_requirements, markers, hashes):
+        recorder = lockgraph.get_current_recorder()
+        if recorder is not None:
+            recorder.record(results, unsafe_requirements, markers, hashes, self.allow_unsafe)
+        decision_recorder = equivalence.get_current_recorder()
+        if decision_recorder is not None:
+            decision_recorder.resolved = True
+        cost_ledger = costledger.get_current_ledger()
+        if cost_ledger is not None:
+            cost_ledger.record(results)
+        super().write(results, unsafe_requirements, markers, hashes)
+
+
 real_version_info = sys.version_info
 
 
@@ -100,7 +553,7 @@ version_info = namedtuple("version_info", ["major", "minor", "micro", "releasele
 
 class ImpersonateSystem:
 
-    __slots__ = ("_python_version_info", "_platform", "platform_machine")
+    __slots__ = ("_python_version_info", "_platform", "platform_machine", "_substitutions")
 
     def __init__(self, python_version_info, platform, machine=None):
         parts = [int(part) for part in python_version_info.split(".") if part.isdigit()]
@@ -115,66 +568,152 @@ class ImpersonateSystem:
             platform = "freebsd14"
         self._platform = platform
         if machine is not None:
-            assert machine.lower() in ("arm64", "amd64", "x86_64")
+            assert machine.lower() in MACHINES
+            if machine.lower() == type(self).platform_machine.lower():
+                # The spelling of the impersonated system, part of the depcache file name
+                machine = type(self).platform_machine
+            else:
+                machine = MACHINES[machine.lower()]
             self.platform_machine = machine
+        self._substitutions = []
 
-    def get_mocks(self):
-        yield mock.patch(
+    def get_substitutions(self):
+        yield Substitution(
             "piptools.scripts.compile.DependencyCache",
-            wraps=functools.partial(
-                tweak_piptools_depcache_filename, self._python_version_info, self._platform
+            functools.partial(
+                tweak_piptools_depcache_filename,
+                self._python_version_info,
+                self._platform,
+                self.platform_machine,
+                # Legacy depcache files were shared by every machine, migrate them for the default
+                self.platform_machine == type(self).platform_machine,
             ),
         )
-        yield mock.patch(
+        yield Substitution(
             "piptools.scripts.compile.PyPIRepository",
-            wraps=functools.partial(PyPIRepository, self._python_version_info, self._platform),
+            functools.partial(PyPIRepository, self._python_version_info, self._platform),
         )
-        yield mock.patch(
+        yield Substitution("piptools.scripts.compile.OutputWriter", OutputWriter)
+        environment = tweak_packaging_markers(self)
+        # Marker.evaluate() updates the environment it gets, hand out copies
+        yield Substitution(
             "pip._vendor.packaging.markers.default_environment",
-            wraps=functools.partial(tweak_packaging_markers, self),
+            functools.partial(dict, environment),
         )
-        yield mock.patch(
-            "pip._vendor.distlib.markers.DEFAULT_CONTEXT",
-            new_callable=mock.PropertyMock(return_value=tweak_packaging_markers(self)),
+        yield Substitution("pip._vendor.distlib.markers.DEFAULT_CONTEXT", environment)
+        # The process wide state pip keeps while preparing distributions
+        yield Substitution(
+            "piptools.repositories.pypi.global_tempdir_manager", _global_tempdir_manager
         )
+        yield Substitution(
+            "piptools.repositories.pypi.get_requirement_tracker", _get_requirement_tracker
+        )
+        yield Substitution("pip._internal.build_env.BuildEnvironment.__enter__", _enter_build_env)
+        yield Substitution("pip._internal.build_env.BuildEnvironment.__exit__", _exit_build_env)
 
     def __enter__(self):
-        for mock_obj in self.get_mocks():
-            if mock_obj is None:
-                continue
-            mock_obj.start()
+        self._substitutions = []
+        try:
+            for substitution in self.get_substitutions():
+                substitution.start()
+                self._substitutions.append(substitution)
+        except Exception:
+            self.__exit__()
+            raise
         return self
 
     def __exit__(self, *_):
-        mock.patch.stopall()
+        while self._substitutions:
+            self._substitutions.pop().stop()
+
+
+class AtomicDependencyCache(DependencyCache):
+    """
+    The pip-tools dependency cache, written atomically, since the compiles of a system, in other
+    threads or processes, write the same file.
+    """
+
+    def write_cache(self):
+        doc = {"__format__": 1, "dependencies": self._cache}
+        tmp_file = "{}.{}.{}.tmp".format(self._cache_file, os.getpid(), threading.get_ident())
+        with open(tmp_file, "w") as wfh:
+            json.dump(doc, wfh, sort_keys=True)
+        os.replace(tmp_file, self._cache_file)
 
 
-def tweak_piptools_depcache_filename(version_info, platform, *args, **kwargs):
-    depcache = DependencyCache(*args, **kwargs)
+def tweak_piptools_depcache_filename(
+    version_info, platform, machine, migrate_legacy, *args, **kwargs
+):
+    depcache = AtomicDependencyCache(*args, **kwargs)
+    cache_settings = get_current_cache_settings()
     # pylint: disable=protected-access
-    if os.environ.get("USE_STATIC_REQUIREMENTS", "0") == "1":
+    if cache_settings.static_requirements:
         use_static_requirements = "-static"
     else:
         use_static_requirements = ""
+    cache_dir = os.path.dirname(depcache._cache_file)
+    # Only what the cached dependencies depend on, the impersonated system, is part of the name
     cache_file = os.path.join(
-        os.path.dirname(depcache._cache_file),
-        "depcache{}-{}-ptc{}-py{}.{}-mocked-py{}.{}.json".format(
-            use_static_requirements,
-            platform,
-            __version__,
-            *sys.version_info[:2],
-            *version_info[:2],
+        cache_dir,
+        "depcache-v{}{}-{}-{}-mocked-py{}.{}.json".format(
+            DEPCACHE_SCHEMA, use_static_requirements, platform, machine, *version_info[:2]
         ),
     )
     log.info("Tweaking the pip-tools depcache file to: %s", cache_file)
     depcache._cache_file = cache_file
     # pylint: enable=protected-access
-    if os.environ["PIP_TOOLS_COMPILE_CLEAN_CACHE"] == "1":
+    if cache_settings.clean:
         if os.path.exists(cache_file):
             os.unlink(cache_file)
+    elif migrate_legacy and not os.path.exists(cache_file):
+        # Before the schema, the pip-tools-compile and host python versions were part of the name
+        migrate_legacy_depcaches(
+            cache_file,
+            glob.glob(
+                os.path.join(
+                    glob.escape(cache_dir),
+                    "depcache{}-{}-ptc*-py*-mocked-py{}.{}.json".format(
+                        use_static_requirements, platform, *version_info[:2]
+                    ),
+                )
+            ),
+        )
     return depcache
 
 
+def migrate_legacy_depcaches(cache_file, legacy_files):
+    """
+    Merge the dependencies found in ``legacy_files`` into ``cache_file`` and remove them.
+
+    The most recently written files win when they disagree. Unreadable files are left alone.
+    """
+    dependencies = {}
+    migrated = []
+    for legacy_file in sorted(legacy_files, key=os.path.getmtime):
+        try:
+            with open(legacy_file) as rfh:
+                doc = json.load(rfh)
+            if doc["__format__"] != 1:
+                raise ValueError("Unknown cache file format")
+            entries = doc["dependencies"]
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.warning("Not migrating the legacy depcache file %s: %s", legacy_file, exc)
+            continue
+        for name, versions in entries.items():
+            dependencies.setdefault(name, {}).update(versions)
+        migrated.append(legacy_file)
+    if not migrated:
+        return
+    log.info("Migrating %d legacy depcache file(s) to %s", len(migrated), cache_file)
+    tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+    with open(tmp_file, "w") as wfh:
+        json.dump({"__format__": 1, "dependencies": dependencies}, wfh, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+    for legacy_file in migrated:
+        with contextlib.suppress(OSError):
+            os.unlink(legacy_file)
+
+
 def tweak_packaging_markers(impersonation):
     environment = DEFAULT_ENVIRONMENT.copy()
     environment["os_name"] = impersonation.os_name
@@ -196,15 +735,13 @@ class ImpersonateWindows(ImpersonateSystem):
     platform_system = "Windows"
     platform_version = "6.3.9600"
 
-    def get_mocks(self):
-        yield from super().get_mocks()
+    def get_substitutions(self):
+        yield from super().get_substitutions()
         if SYSTEM != "windows":
             # We don't want pip trying query python's internals, it knows how to mock that internal information
-            yield mock.patch("pip._vendor.packaging.tags._get_config_var", return_value=None)
-            yield mock.patch("pip._internal.network.session.libc_ver", return_value=("", ""))
-            yield mock.patch(
-                "pip._vendor.packaging.tags._platform_tags", return_value=["win_amd64"]
-            )
+            yield Substitution("pip._vendor.packaging.tags._get_config_var", constant(None))
+            yield Substitution("pip._internal.network.session.libc_ver", constant(("", "")))
+            yield Substitution("pip._vendor.packaging.tags._platform_tags", constant(["win_amd64"]))
 
 
 class ImpersonateDarwin(ImpersonateSystem):
@@ -214,16 +751,16 @@ class ImpersonateDarwin(ImpersonateSystem):
     platform_system = "Darwin"
     platform_version = "Darwin Kernel Version 19.2.0: Sat Nov  9 03:47:04 PST 2019; root:xnu-6153.61.1~20/RELEASE_X86_64"
 
-    def get_mocks(self):
-        yield from super().get_mocks()
+    def get_substitutions(self):
+        yield from super().get_substitutions()
         if SYSTEM != "darwin":
             # We don't want pip trying query python's internals, it knows how to mock that internal information
-            yield mock.patch("pip._vendor.packaging.tags._get_config_var", return_value=None)
+            yield Substitution("pip._vendor.packaging.tags._get_config_var", constant(None))
             tags = []
             for version in range(4, 16):
                 for cpu in ("fat32", "fat64", "intel", "universal", "x86_64"):
                     tags.append("macosx_10_{}_{}".format(version, cpu))
-            yield mock.patch("pip._vendor.packaging.tags._platform_tags", return_value=tags)
+            yield Substitution("pip._vendor.packaging.tags._platform_tags", constant(tags))
 
 
 class ImpersonateLinux(ImpersonateSystem):
@@ -233,19 +770,21 @@ class ImpersonateLinux(ImpersonateSystem):
     platform_system = "Linux"
     platform_version = "#1 SMP Thu Mar 14 15:39:08 CET 2019"
 
-    def get_mocks(self):
-        yield from super().get_mocks()
+    def get_substitutions(self):
+        yield from super().get_substitutions()
         if SYSTEM != "linux":
             # We don't want pip trying query python's internals, it knows how to mock that internal information
-            yield mock.patch("pip._vendor.packaging.tags._get_config_var", return_value=None)
-            yield mock.patch(
+            yield Substitution("pip._vendor.packaging.tags._get_config_var", constant(None))
+            yield Substitution(
                 "pip._vendor.packaging.tags._platform_tags",
-                return_value=[
-                    "linux_x86_64",
-                    "manylinux1_x86_64",
-                    "manylinux2010_x86_64",
-                    "manylinux2014_x86_64",
-                ],
+                constant(
+                    [
+                        "linux_x86_64",
+                        "manylinux1_x86_64",
+                        "manylinux2010_x86_64",
+                        "manylinux2014_x86_64",
+                    ]
+                ),
             )
 
 
@@ -259,20 +798,22 @@ class ImpersonateFreeBSD(ImpersonateSystem):
         "root@krion.cc:/usr/obj/usr/src/amd64.amd64/sys/GENERIC"
     )
 
-    def get_mocks(self):
-        yield from super().get_mocks()
+    def get_substitutions(self):
+        yield from super().get_substitutions()
         if SYSTEM != "freebsd":
             # We don't want pip trying query python's internals, it knows how to mock that internal information
-            yield mock.patch("pip._vendor.packaging.tags._get_config_var", return_value=None)
-            yield mock.patch(
+            yield Substitution("pip._vendor.packaging.tags._get_config_var", constant(None))
+            yield Substitution(
                 "pip._vendor.packaging.tags._platform_tags",
-                return_value=[
-                    "{}_{}_{}".format(
-                        self.platform_system.lower(),
-                        self.platform_release.replace("-", "_").replace(".", "_"),
-                        self.platform_machine,
-                    )
-                ],
+                constant(
+                    [
+                        "{}_{}_{}".format(
+                            self.platform_system.lower(),
+                            self.platform_release.replace("-", "_").replace(".", "_"),
+                            self.platform_machine,
+                        )
+                    ]
+                ),
             )
 
 
@@ -316,9 +857,176 @@ class CatureSTDs:
             self._stderr.seek(pos)
 
 
-def compile_requirement_file(source, dest, options, unknown_args):
-    log.info("Compiling requirements to %s", dest)
+@contextlib.contextmanager
+def redirect_piptools_output(stream):
+    """
+    Send everything pip-tools, and pip through pip-tools, would print to the console to ``stream``.
+    """
+    from piptools.logging import log as piptools_log
+
+    def _log(message, *args, **kwargs):
+        kwargs.pop("err", None)
+        click.secho(" " * piptools_log.current_indent + message, *args, file=stream, **kwargs)
+
+    # Only within this context, other threads keep their own output
+    with Substitution("piptools.logging.log.stream", stream), Substitution(
+        "piptools.logging.log.log", _log
+    ):
+        yield
+
+
+def _backup_input_file(path, backups):
+    shutil.move(path, path + ".bak")
+    backups.append(path)
+
+
+def _acquire_input_file(path):
+    with _INPUT_LOCKS_LOCK:
+        lock = _INPUT_LOCKS[os.path.abspath(path)]
+    lock.acquire()
+    return lock
+
+
+def _release_input_file(path, lock, rewritten, input_locks):
+    if rewritten:
+        # Other compiles, in other threads, must not read the rewritten file until it is restored
+        input_locks.append(lock)
+    else:
+        lock.release()
+
 
+def compile_requirement_file(
+    source, dest, options, unknown_args, stdout=None, preflight_report=None
+):
+    """
+    Compile ``source`` into ``dest`` by running ``pip-compile`` in this process.
+
+    Nothing is printed to ``sys.stdout`` if ``stdout`` is passed, and any input files which had
+    to be rewritten are restored before returning.
+
+    With ``options.preflight``, the direct requirements are checked before resolving them, and
+    the outcome recorded in ``preflight_report``, if passed. When ``options.preflight`` is
+    ``"only"``, the compile stops there, without writing ``dest``.
+    """
+    log.info("Compiling requirements to %s", dest)
+    if options.preflight and preflight_report is None:
+        preflight_report = inputcheck.PreflightReport()
+    elif not options.preflight:
+        preflight_report = None
+    backups = []
+    input_locks = []
+    resolver_trace = None
+    if options.trace:
+        resolver_trace = resolvertrace.ResolverTrace(
+            target={
+                "source": source,
+                "platform": options.platform,
+                "py_version": options.py_version,
+                "machine": options.machine,
+            }
+        )
+    prefetch_settings = None
+    if options.prefetch_workers > 0 and not options.offline:
+        prefetch_settings = prefetch.PrefetchSettings(
+            workers=options.prefetch_workers,
+            max_bytes=prefetch.parse_size(options.prefetch_max_bytes),
+        )
+    multi_index_settings = multiindex.MultiIndexSettings(
+        ttl=options.index_absence_ttl, clean=options.clean_cache
+    )
+    cache_settings = CacheSettings(
+        static_requirements=options.static_requirements, clean=options.clean_cache
+    )
+    lock_graph_recorder = None
+    if options.lock_graph:
+        lock_graph_recorder = lockgraph.LockGraphRecorder()
+    offline_misses = None
+    if options.offline:
+        offline_misses = offline.CacheMisses()
+    seed_paths = list(options.seed_from)
+    if options.seed_siblings:
+        seed_paths.extend(seeding.find_siblings(dest))
+    resume_pins = {}
+    run_checkpoint = checkpoint.get_current_checkpoint()
+    if run_checkpoint is not None:
+        # The pins found before the compile of this target was interrupted
+        resume_pins = run_checkpoint.get_pins()
+    seed_pins = None
+    if seed_paths or resume_pins:
+        seed_pins = seeding.SeedPins(seed_paths, pins=resume_pins)
+    cost_ledger = None
+    if options.cost_report:
+        cost_ledger = costledger.CostLedger()
+    http_archive = None
+    if options.record:
+        http_archive = httparchive.ArchiveRecorder(options.record)
+    elif options.replay:
+        http_archive = httparchive.ArchiveReplayer(options.replay)
+    try:
+        with resolvertrace.activate(resolver_trace), prefetch.activate(
+            prefetch_settings
+        ), multiindex.activate(multi_index_settings), lockgraph.activate(lock_graph_recorder):
+            with offline.activate(offline_misses), httparchive.activate(
+                http_archive
+            ), costledger.activate(cost_ledger), seeding.activate(seed_pins):
+                with backtracking.activate(options.resolver), inputcheck.preflight(
+                    preflight_report, only=options.preflight == "only"
+                ), inputcheck.activate(), activate_cache_settings(cache_settings):
+                    success = _compile_requirement_file(
+                        source, dest, options, unknown_args, backups, input_locks, stdout
+                    )
+        if resume_pins:
+            print(
+                "Resumed with {} pin(s) found before the interruption".format(len(resume_pins)),
+                file=stdout,
+            )
+        if preflight_report is not None and preflight_report.sdist_only:
+            print(
+                "Only sdists satisfy {}, building them for {} may fail".format(
+                    ", ".join(str(ireq.req) for ireq in preflight_report.sdist_only),
+                    preflight_report.system,
+                ),
+                file=stdout,
+            )
+        if seed_pins and seed_pins.paths:
+            print(
+                "Seeded from {}: {} pin(s) kept, {} diverged".format(
+                    ", ".join(seed_pins.paths), len(seed_pins.used), len(seed_pins.diverged)
+                ),
+                file=stdout,
+            )
+        if not success and offline_misses:
+            print(
+                "Compiling offline, these were not found in the caches, "
+                "run 'pip-tools-compile prefetch' with network access first:",
+                file=stdout,
+            )
+            for url in offline_misses:
+                print("  {}".format(url), file=stdout)
+        if not success and options.replay and http_archive.misses:
+            print(
+                "Replaying {}, these requests were not recorded:".format(options.replay),
+                file=stdout,
+            )
+            for url in http_archive.misses:
+                print("  {}".format(url), file=stdout)
+        return success
+    finally:
+        for path in reversed(backups):
+            shutil.move(path + ".bak", path)
+        for lock in reversed(input_locks):
+            lock.release()
+        if resolver_trace is not None:
+            trace_path = resolvertrace.trace_path_for(dest)
+            resolver_trace.write(trace_path)
+            log.info("Wrote the resolver trace to %s", trace_path)
+        if cost_ledger is not None:
+            cost_report_path = costledger.cost_report_path_for(dest)
+            cost_ledger.write(cost_report_path)
+            log.info("Wrote the cost report to %s", cost_report_path)
+
+
+def _compile_requirement_file(source, dest, options, unknown_args, backups, input_locks, stdout):
     input_rewrites = {}
     passthrough_lines = {}
 
@@ -327,6 +1035,7 @@ def compile_requirement_file(source, dest, options, unknown_args):
         regexes.append(re.compile(regex))
 
     call_args = ["pip-compile", "-o", dest]
+    input_files = []
     if unknown_args:
         for unknown_arg in unknown_args:
             if "{py_version}" in unknown_arg:
@@ -337,9 +1046,69 @@ def compile_requirement_file(source, dest, options, unknown_args):
         for input_file in options.include:
             out_contents = []
             input_file = input_file.format(py_version=options.py_version)
-            with open(input_file) as rfh:
-                in_contents = rfh.read()
-            for line in in_contents.splitlines():
+            input_lock = _acquire_input_file(input_file)
+            try:
+                with open(input_file) as rfh:
+                    in_contents = rfh.read()
+                for line in in_contents.splitlines():
+                    constraint_flag = req_path = None
+                    if line.strip().startswith("-c "):
+                        constraint_flag = "-c "
+                        req_path = os.path.abspath(
+                            line.split()[-1].format(
+                                py_version=options.py_version, platform=options.platform
+                            )
+                        )
+                    if line.strip().startswith("--constraint="):
+                        constraint_flag = "--constraint="
+                        req_path = os.path.abspath(
+                            line.split("--constraint=")[-1].format(
+                                py_version=options.py_version, platform=options.platform
+                            )
+                        )
+                    if constraint_flag and req_path:
+                        line = f"{constraint_flag}{os.path.relpath(req_path, os.getcwd())}"
+                        if input_file not in input_rewrites:
+                            input_rewrites[input_file] = input_file
+                            _backup_input_file(input_file, backups)
+                    match_found = False
+                    for regex in regexes:
+                        if match_found:
+                            break
+                        if regex.match(line):
+                            match_found = True
+                            if input_file not in input_rewrites:
+                                input_rewrites[input_file] = input_file
+                                _backup_input_file(input_file, backups)
+                            if input_file not in passthrough_lines:
+                                passthrough_lines[input_file] = []
+                    if match_found:
+                        passthrough_lines[input_file].append(line)
+                        # Skip this line
+                        continue
+                    out_contents.append(line)
+                if input_file in input_rewrites:
+                    with open(input_rewrites[input_file], "w") as wfh:
+                        for line in out_contents:
+                            wfh.write("{}\n".format(line))
+                    includes.append(input_rewrites[input_file])
+                else:
+                    includes.append(input_file)
+            finally:
+                _release_input_file(
+                    input_file, input_lock, input_file in input_rewrites, input_locks
+                )
+        call_args += includes
+        input_files += includes
+
+    source_lock = _acquire_input_file(source)
+    source_contents = ""
+    try:
+        with open(source) as rfh:
+            source_contents = rfh.read()
+        if "{py_version}" in source_contents:
+            out_contents = []
+            for line in source_contents.splitlines():
                 constraint_flag = req_path = None
                 if line.strip().startswith("-c "):
                     constraint_flag = "-c "
@@ -357,89 +1126,78 @@ def compile_requirement_file(source, dest, options, unknown_args):
                     )
                 if constraint_flag and req_path:
                     line = f"{constraint_flag}{os.path.relpath(req_path, os.getcwd())}"
-                    if input_file not in input_rewrites:
-                        input_rewrites[input_file] = input_file
-                        shutil.move(input_file, input_file + ".bak")
-                        atexit.register(shutil.move, input_file + ".bak", input_file)
-                match_found = False
-                for regex in regexes:
-                    if match_found:
-                        break
-                    if regex.match(line):
-                        match_found = True
-                        if input_file not in input_rewrites:
-                            input_rewrites[input_file] = input_file
-                            shutil.move(input_file, input_file + ".bak")
-                            atexit.register(shutil.move, input_file + ".bak", input_file)
-                        if input_file not in passthrough_lines:
-                            passthrough_lines[input_file] = []
-                if match_found:
-                    passthrough_lines[input_file].append(line)
-                    # Skip this line
-                    continue
+                    if os.path.exists(source):
+                        _backup_input_file(source, backups)
                 out_contents.append(line)
-            if input_file in input_rewrites:
-                with open(input_rewrites[input_file], "w") as wfh:
-                    for line in out_contents:
-                        wfh.write("{}\n".format(line))
-                includes.append(input_rewrites[input_file])
-            else:
-                includes.append(input_file)
-        call_args += includes
-
-    with open(source) as rfh:
-        source_contents = rfh.read()
-    if "{py_version}" in source_contents:
-        out_contents = []
-        for line in source_contents.splitlines():
-            constraint_flag = req_path = None
-            if line.strip().startswith("-c "):
-                constraint_flag = "-c "
-                req_path = os.path.abspath(
-                    line.split()[-1].format(
-                        py_version=options.py_version, platform=options.platform
-                    )
-                )
-            if line.strip().startswith("--constraint="):
-                constraint_flag = "--constraint="
-                req_path = os.path.abspath(
-                    line.split("--constraint=")[-1].format(
-                        py_version=options.py_version, platform=options.platform
-                    )
-                )
-            if constraint_flag and req_path:
-                line = f"{constraint_flag}{os.path.relpath(req_path, os.getcwd())}"
-                if os.path.exists(source):
-                    shutil.move(source, source + ".bak")
-                    atexit.register(shutil.move, source + ".bak", source)
-            out_contents.append(line)
-        with open(source, "w") as wfh:
-            for line in out_contents:
-                wfh.write("{}\n".format(line))
+            with open(source, "w") as wfh:
+                for line in out_contents:
+                    wfh.write("{}\n".format(line))
+    finally:
+        _release_input_file(source, source_lock, "{py_version}" in source_contents, input_locks)
     call_args.append(source)
+    input_files.append(source)
+
+    companions = []
+    lock_graph_recorder = lockgraph.get_current_recorder()
+    if lock_graph_recorder is not None:
+        companions.append(lockgraph.lock_graph_path_for(dest))
+
+    result_cache = cache_key = None
+    if options.result_cache:
+        if resultcache.is_cacheable(call_args):
+            result_cache = resultcache.ResultCache.from_location(options.result_cache)
+            extra = {"passthrough_lines": sorted(passthrough_lines.items())}
+            if options.resolver != "legacy":
+                # Keeps the keys of the compiles with pip-tools' resolver
+                extra["resolver"] = options.resolver
+            seed_pins = seeding.get_current_seeds()
+            if seed_pins and seed_pins.paths:
+                # The pins of an interrupted compile of this target don't change the result
+                extra["seeds"] = seed_pins.digest()
+            cache_key = resultcache.fingerprint(
+                call_args, input_files, dest, profile=get_profile(options), extra=extra
+            )
+            restored = result_cache.restore(cache_key, dest, companions=companions)
+            eventstream.emit("cache", cache="result", hit=restored, key=cache_key)
+            if restored:
+                print("Restored {} from the result cache: {}".format(dest, cache_key), file=stdout)
+                return True
+        else:
+            log.info("Not using the result cache, pip-compile was asked to upgrade/rebuild")
 
-    original_sys_arg = sys.argv[:]
     success = False
     try:
-        print("Running: {}".format(" ".join(call_args)))
+        print("Running: {}".format(" ".join(call_args)), file=stdout)
         if options.machine:
-            print("  Impersonating CPU: {}".format(options.machine))
-        print("  Impersonating: {}".format(options.platform))
-        print("  Mocked Python Version: {}".format(options.py_version))
-        sys.argv = call_args[:]
-        log.debug("Switching sys.argv to: %s", sys.argv)
+            print("  Impersonating CPU: {}".format(options.machine), file=stdout)
+        print("  Impersonating: {}".format(options.platform), file=stdout)
+        print("  Mocked Python Version: {}".format(options.py_version), file=stdout)
+        log.debug("Running pip-compile with: %s", call_args[1:])
         try:
             import piptools.scripts.compile
 
-            piptools.scripts.compile.cli()
+            # Don't let click parse sys.argv nor call sys.exit
+            exitcode = piptools.scripts.compile.cli.main(
+                args=call_args[1:], prog_name=call_args[0], standalone_mode=False
+            )
         except SystemExit as exc:
-            success = exc.code == 0
-            if success is False:
-                print("Failed to compile requirements. Exit code: {}".format(exc.code))
+            exitcode = exc.code
+        except inputcheck.PreflightStopped:
+            exitcode = None
+            print("Stopped after checking the requirements of {}".format(source), file=stdout)
+        except click.ClickException as exc:
+            exitcode = exc.exit_code
+            print("Error: {}".format(exc.format_message()), file=stdout)
         except Exception:  # pylint: disable=broad-except
-            success = False
-            print("Exception raised when processing {}".format(source))
-            print(traceback.format_exc())
+            exitcode = None
+            print("Exception raised when processing {}".format(source), file=stdout)
+            print(traceback.format_exc(), file=stdout)
+        else:
+            # click returns None when the command just returns
+            exitcode = exitcode or 0
+        success = exitcode == 0
+        if success is False and exitcode is not None:
+            print("Failed to compile requirements. Exit code: {}".format(exitcode), file=stdout)
     finally:
         if success is True:
             log.info("Finished compiling %s", dest)
@@ -452,11 +1210,6 @@ def compile_requirement_file(source, dest, options, unknown_args):
                     if rewriten_file in dest_contents:
                         dest_contents = dest_contents.replace(rewriten_file, input_file)
 
-                    try:
-                        os.unlink(rewriten_file)
-                    except OSError:
-                        pass
-
                 with open(dest, "w") as wfh:
                     wfh.write(dest_contents)
                     for input_file, lines in passthrough_lines.items():
@@ -464,7 +1217,23 @@ def compile_requirement_file(source, dest, options, unknown_args):
                         for line in lines:
                             wfh.write("{}\n".format(line))
 
-        sys.argv = original_sys_arg
+            if lock_graph_recorder is not None:
+                lock_graph_path = lockgraph.lock_graph_path_for(dest)
+                lockgraph.write_lock_graph(
+                    lockgraph.build_lock_graph(
+                        lock_graph_recorder,
+                        source,
+                        get_profile(options),
+                        passthrough=[
+                            line for lines in passthrough_lines.values() for line in lines
+                        ],
+                    ),
+                    lock_graph_path,
+                )
+                log.info("Wrote the lock graph to %s", lock_graph_path)
+
+            if result_cache is not None:
+                result_cache.store(cache_key, dest, companions=companions)
 
     # Flag success
     return success
@@ -482,7 +1251,15 @@ def show_info_to_patch():
         print("  * '{}'".format(tag))
 
 
-def main():
+IMPERSONATIONS = {
+    "darwin": ImpersonateDarwin,
+    "windows": ImpersonateWindows,
+    "linux": ImpersonateLinux,
+    "freebsd": ImpersonateFreeBSD,
+}
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--show-info-to-patch",
@@ -503,7 +1280,7 @@ def main():
         "--static-requirements",
         action="store_true",
         default=False,
-        help="Set USE_STATIC_REQUIREMENTS=1 environment variable prior to compiling requirements",
+        help="Use the dependency cache of the static requirements",
     )
     parser.add_argument("--py-version", default="{}.{}".format(*sys.version_info))
     parser.add_argument("--include", action="append", default=[])
@@ -530,8 +1307,320 @@ def main():
         default=False,
         help="Clean pip-tools dependency cache files",
     )
+    parser.add_argument(
+        "--result-cache",
+        default=None,
+        help=(
+            "Directory, or HTTP URL accepting GET and PUT requests, where to share compiled "
+            "requirements between runs. Compiles whose inputs, arguments and impersonated system "
+            "match a previous one are restored from there instead of resolved."
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=False,
+        help=(
+            "Record the resolver rounds, candidate lookups, rejected files and dependency lookups "
+            "and write them, in the Chrome trace format, next to each compiled requirements file"
+        ),
+    )
+    parser.add_argument(
+        "--cost-report",
+        action="store_true",
+        default=False,
+        help=(
+            "Record, per project, the index requests, downloads, bytes, metadata builds and time "
+            "the compile spent on it, and which top level requirements pulled it in, and write "
+            "that, the most expensive first, next to each compiled requirements file"
+        ),
+    )
+    parser.add_argument(
+        "--resolver",
+        choices=backtracking.ENGINES,
+        default="legacy",
+        help=(
+            "The resolver engine: pip-tools' own, resolving in rounds, or a backtracking one, "
+            "built on resolvelib, like pip's. Default: %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--seed-from",
+        default=[],
+        action="append",
+        metavar="COMPILED_FILE",
+        help=(
+            "Prefer the pins of this compiled requirements file, from another target, when the "
+            "impersonated system can use them. Can be passed several times, the first file "
+            "pinning a project wins."
+        ),
+    )
+    parser.add_argument(
+        "--seed-siblings",
+        action="store_true",
+        default=False,
+        help=(
+            "Prefer the pins of the files compiled for the other Python versions, in the sibling "
+            "py<version> directories, the closest versions first, after --seed-from"
+        ),
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_const",
+        const="check",
+        default=None,
+        help=(
+            "Before resolving, check that the index has a candidate satisfying each direct "
+            "requirement on the impersonated system, and fail at once otherwise"
+        ),
+    )
+    parser.add_argument(
+        "--variant",
+        default=[],
+        action="append",
+        metavar="NAME=INCLUDE[,INCLUDE...]",
+        help=(
+            "Also compile each requirements file with these extra includes, to the NAME prefixed "
+            "output file, after the --out-prefix if any, on top of the pins of its compile "
+            "without them. Can be passed several times."
+        ),
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        type=int,
+        default=0,
+        help=(
+            "Number of background threads downloading, ahead of the resolver, the distributions "
+            "it is about to inspect. Disabled by default."
+        ),
+    )
+    parser.add_argument(
+        "--prefetch-max-bytes",
+        default="100M",
+        help="The maximum amount of data speculatively downloaded per compile. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--index-absence-ttl",
+        type=int,
+        default=multiindex.DEFAULT_TTL,
+        help=(
+            "When several indexes are configured, they are queried concurrently, and the ones "
+            "which do not carry a project are not asked for it again for this many seconds. "
+            "0 disables that cache. Default: %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--lock-graph",
+        action="store_true",
+        default=False,
+        help=(
+            "Also write, next to each compiled requirements file, a JSON lock graph with the "
+            "pins, hashes, markers, dependency edges, install order and impersonated system"
+        ),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=False,
+        help=(
+            "Never access the network, only use what is cached, see 'pip-tools-compile prefetch'. "
+            "The compile fails listing the cache misses."
+        ),
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        metavar="ARCHIVE",
+        help=(
+            "Record every HTTP request made while compiling, and its response, into this archive, "
+            "for --replay"
+        ),
+    )
+    parser.add_argument(
+        "--replay",
+        default=None,
+        metavar="ARCHIVE",
+        help=(
+            "Never access the network, answer every HTTP request from this archive, written by "
+            "--record. Use --clean-cache in both runs for them to make the same requests."
+        ),
+    )
+    parser.add_argument(
+        "--local-proxy",
+        action="store_true",
+        default=False,
+        help=(
+            "Send the HTTP requests through a caching proxy, on localhost, shared with the other "
+            "pip-tools-compile processes running at once, started unless already running. "
+            "Identical requests are sent to the index once."
+        ),
+    )
+    parser.add_argument(
+        "--local-proxy-connections",
+        type=int,
+        default=localproxy.DEFAULT_CONNECTIONS,
+        help=(
+            "The maximum number of requests the local proxy sends to the index at once. "
+            "Default: %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--local-proxy-idle-timeout",
+        type=int,
+        default=localproxy.DEFAULT_IDLE_TIMEOUT,
+        help="Seconds after which an idle local proxy exits. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help=(
+            "Only compile the requirements files assigned to this shard, given as <index>/<count>, "
+            "index starting at 1. Files are balanced across shards using --durations."
+        ),
+    )
+    parser.add_argument(
+        "--durations",
+        default=None,
+        help=(
+            "JSON file with the compile durations recorded by previous runs, used to balance "
+            "--shard. The durations measured by this run are recorded there, or, when sharding, "
+            "in a shard specific file next to it, which 'pip-tools-compile merge-durations' "
+            "folds back in."
+        ),
+    )
+    parser.add_argument(
+        "--events",
+        default=None,
+        metavar="PATH|FD",
+        help=(
+            "Write the progress of the run, targets, resolver rounds, HTTP requests, cache hits "
+            "and outputs, as newline delimited JSON events, to this file or file descriptor"
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        default=False,
+        help=(
+            "Write the progress of the run to a checkpoint, removed once the run is over, which "
+            "--resume continues from when the run is interrupted"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help=(
+            "Continue the same command, run with --checkpoint and interrupted before, from its "
+            "checkpoint: skip the requirements files it compiled since the inputs did not "
+            "change, and prefer the pins it had found for the one it was compiling"
+        ),
+    )
     parser.add_argument("files", nargs="*")
 
+    return parser
+
+
+def get_output_path(fpath, options, makedirs=True):
+    """
+    Return the path of the compiled requirements file for ``fpath``, creating its directory
+    unless ``makedirs`` is false.
+    """
+    source_dir = os.path.dirname(fpath)
+    if options.output_dir:
+        dest_dir = options.output_dir
+    else:
+        dest_dir = os.path.join(source_dir, "py{}".format(options.py_version))
+    if makedirs and not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+    outfile = os.path.basename(fpath).replace(".in", ".txt")
+    if options.out_prefix:
+        outfile = "{}-{}".format(options.out_prefix, outfile)
+    return os.path.join(dest_dir, outfile)
+
+
+def get_profile(options):
+    """
+    Return the description of the system impersonated according to ``options``.
+    """
+    return {
+        "platform": options.platform,
+        "py_version": options.py_version,
+        "machine": options.machine,
+        "static_requirements": "1" if options.static_requirements else "0",
+    }
+
+
+def post_process_compiled_file(outfile_path, regexes, stdout=None, lock_graph_path=None):
+    """
+    Normalize paths when running on windows and comment out the lines matching ``regexes``.
+
+    The packages commented out are flagged as excluded in the lock graph at ``lock_graph_path``.
+    """
+    if SYSTEM == "windows":
+        with open(outfile_path) as rfh:
+            contents = re.sub("'([^']*)'", r"\1", rfh.read().replace("\\", "/"), re.MULTILINE)
+        with open(outfile_path, "w") as wfh:
+            wfh.write(contents)
+
+    if not regexes:
+        return
+
+    with open(outfile_path) as rfh:
+        in_contents = rfh.read()
+
+    out_contents = []
+    for line in in_contents.splitlines():
+        print("Processing line: {!r} // {}".format(line, [r.pattern for r in regexes]), file=stdout)
+        for regex in regexes:
+            if regex.match(line):
+                print(
+                    "Line commented out by regex '{}': '{}'".format(regex.pattern, line),
+                    file=stdout,
+                )
+                line = textwrap.dedent(
+                    """\
+                    # Next line explicitly commented out by {} because of the following regex: '{}'
+                    # {}""".format(
+                        os.path.basename(__file__), regex.pattern, line
+                    )
+                )
+                break
+        out_contents.append(line)
+
+    out_contents = os.linesep.join(out_contents) + os.linesep
+    with open(outfile_path, "w") as wfh:
+        wfh.write(out_contents)
+
+    if lock_graph_path is not None and os.path.exists(lock_graph_path):
+        lockgraph.sync_excluded(lock_graph_path, outfile_path)
+
+
+def main():
+    # Kept in memory, and written next to the compiled file when a compile fails. Importing
+    # piptools already configured a stderr handler, replace it
+    log_stream = io.StringIO()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(log_stream)
+    handler.setFormatter(logging.Formatter(fmt=LOG_FORMAT, datefmt=LOG_DATEFMT))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    if sys.argv[1:2] == ["prefetch"]:
+        from pip_tools_compile import warmup
+
+        sys.exit(warmup.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["preflight"]:
+        from pip_tools_compile import preflight
+
+        sys.exit(preflight.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["proxy"]:
+        sys.exit(localproxy.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["merge-durations"]:
+        sys.exit(sharding.main(sys.argv[2:]))
+
+    parser = get_parser()
     options, unknown_args = parser.parse_known_args()
 
     if options.show_info_to_patch:
@@ -541,9 +1630,25 @@ def main():
     if not options.files:
         parser.exit(2, "Please pass at least one requirement file")
 
-    os.environ["USE_STATIC_REQUIREMENTS"] = "1" if options.static_requirements else "0"
+    if options.record and (options.replay or options.offline):
+        parser.error(
+            "--record needs network access, it can't be combined with --replay or --offline"
+        )
 
-    os.environ["PIP_TOOLS_COMPILE_CLEAN_CACHE"] = "1" if options.clean_cache else "0"
+    if options.local_proxy and (options.replay or options.offline):
+        parser.error(
+            "--local-proxy needs network access, it can't be combined with --replay or --offline"
+        )
+
+    variant_list = []
+    for value in options.variant:
+        try:
+            variant = variants.parse_variant(value)
+        except ValueError as exc:
+            parser.error(str(exc))
+        if variant.name in [other.name for other in variant_list]:
+            parser.error("The output files of the variant {} clash".format(variant.name))
+        variant_list.append(variant)
 
     if SYSTEM == "windows":
         print(
@@ -565,107 +1670,184 @@ def main():
             file=sys.stderr,
         )
 
-    impersonations = {
-        "darwin": ImpersonateDarwin,
-        "windows": ImpersonateWindows,
-        "linux": ImpersonateLinux,
-        "freebsd": ImpersonateFreeBSD,
-    }
-
     regexes = []
     for regex in options.remove_line:
         regexes.append(re.compile(regex))
 
+    files = [fpath for fpath in options.files if fpath.endswith(".in")]
+    work_item_keys = [
+        sharding.get_work_item_key(fpath, options.platform, options.py_version, options.machine)
+        for fpath in files
+    ]
+    durations = {}
+    if options.durations:
+        durations = sharding.read_durations(options.durations)
+    durations_path = options.durations
+    if options.shard:
+        try:
+            shard_index, shard_count = sharding.parse_shard(options.shard)
+        except ValueError as exc:
+            parser.error(str(exc))
+        selected = sharding.select(work_item_keys, shard_index, shard_count, durations)
+        print(
+            "Shard {}/{}: compiling {} of {} requirements files, estimated {:.0f} seconds".format(
+                shard_index,
+                shard_count,
+                len(selected),
+                len(files),
+                sharding.estimate(selected, durations),
+            )
+        )
+        selected = set(selected)
+        files = [fpath for fpath, key in zip(files, work_item_keys) if key in selected]
+        work_item_keys = [key for key in work_item_keys if key in selected]
+        if durations_path:
+            durations_path = sharding.get_shard_durations_path(
+                durations_path, shard_index, shard_count
+            )
+    measured = {}
+
+    event_stream = None
+    if options.events:
+        try:
+            event_stream = eventstream.EventStream.open(options.events)
+        except OSError as exc:
+            parser.error("Can't write the events to {}: {}".format(options.events, exc))
+
+    proxy_url = None
+    if options.local_proxy:
+        try:
+            proxy_url = localproxy.ensure_proxy(
+                localproxy.get_proxy_dir(),
+                connections=options.local_proxy_connections,
+                idle_timeout=options.local_proxy_idle_timeout,
+            )
+        except (OSError, localproxy.ProxyUnavailable) as exc:
+            parser.error("Can't start the local proxy: {}".format(exc))
+
+    run_checkpoint = None
+    if options.checkpoint or options.resume:
+        checkpoint_path = checkpoint.get_checkpoint_path(sys.argv[1:])
+        if options.resume:
+            run_checkpoint = checkpoint.Checkpoint.load(checkpoint_path)
+        else:
+            run_checkpoint = checkpoint.Checkpoint(checkpoint_path)
+
     stdout = stderr = None
     exitcode = 0
+    run_start = time.monotonic()
 
-    with CatureSTDs() as capstds:
-        with impersonations[options.platform](
+    with CatureSTDs() as capstds, sessionpool.activate(
+        sessionpool.SessionPool()
+    ), eventstream.activate(event_stream), localproxy.activate(proxy_url), checkpoint.activate(
+        run_checkpoint
+    ):
+        eventstream.emit("run_started", targets=len(files))
+        with IMPERSONATIONS[options.platform](
             options.py_version, options.platform, options.machine
         ):
             import piptools.scripts.compile
 
-            for fpath in options.files:
-                if not fpath.endswith(".in"):
-                    continue
-
-                # Return the log strem to 0, either to write a log file in case of an error,
-                # or to overwrite the contents for this next fpath
-                LOG_STREAM.seek(0)
-
-                source_dir = os.path.dirname(fpath)
-                if options.output_dir:
-                    dest_dir = options.output_dir
-                else:
-                    dest_dir = os.path.join(source_dir, "py{}".format(options.py_version))
-                if not os.path.isdir(dest_dir):
-                    os.makedirs(dest_dir)
-                outfile = os.path.basename(fpath).replace(".in", ".txt")
-                if options.out_prefix:
-                    outfile = "{}-{}".format(options.out_prefix, outfile)
-                outfile_path = os.path.join(dest_dir, outfile)
-                if not compile_requirement_file(fpath, outfile_path, options, unknown_args):
-                    exitcode = 1
-                    error_logfile = outfile_path.replace(".txt", ".log")
-                    with open(error_logfile, "w") as wfh:
-                        LOG_STREAM.seek(0)
-                        wfh.write(
-                            ">>>>>>> LOGS >>>>>>>>>\n{}\n<<<<<<< LOGS <<<<<<<<<\n".format(
-                                LOG_STREAM.read().strip()
-                            )
+            for fpath, source_key in zip(files, work_item_keys):
+                base_path = get_output_path(fpath, options)
+                compiles = [(source_key, options, None)]
+                for variant in variant_list:
+                    compiles.append(
+                        (
+                            variants.get_work_item_key(source_key, variant),
+                            variants.get_variant_options(options, variant, base_path),
+                            base_path,
                         )
-                        wfh.write(
-                            "\n>>>>>>> STDOUT >>>>>>>\n{}\n<<<<<<< STDOUT <<<<<<<\n".format(
-                                capstds.stdout.strip()
+                    )
+                for work_item_key, compile_options, variant_base in compiles:
+                    # Return the log strem to 0, either to write a log file in case of an error,
+                    # or to overwrite the contents for this next fpath
+                    log_stream.seek(0)
+                    log_stream.truncate()
+
+                    outfile_path = get_output_path(fpath, compile_options)
+                    input_files = [
+                        include.format(py_version=options.py_version)
+                        for include in compile_options.include
+                    ]
+                    input_files.append(fpath)
+                    if variant_base is not None:
+                        # Compiled again when the base changes
+                        input_files.append(variant_base)
+                    if run_checkpoint is not None and run_checkpoint.is_completed(
+                        work_item_key, input_files, outfile_path
+                    ):
+                        print(
+                            "Skipping {}, compiled to {} before the interruption".format(
+                                fpath, outfile_path
                             )
                         )
-                        wfh.write(
-                            "\n>>>>>>> STDERR >>>>>>>\n{}\n<<<<<<< STDERR <<<<<<<\n".format(
-                                capstds.stderr.strip()
+                        eventstream.emit("target_resumed", target=work_item_key, dest=outfile_path)
+                        continue
+                    start = time.monotonic()
+                    with eventstream.target(
+                        work_item_key, source=fpath, dest=outfile_path
+                    ) as target_result, eventstream.watch_output(outfile_path):
+                        if run_checkpoint is not None:
+                            checkpoint_target = run_checkpoint.target(work_item_key, input_files)
+                        else:
+                            checkpoint_target = contextlib.nullcontext()
+                        with checkpoint_target, variants.activate(variant_base):
+                            success = compile_requirement_file(
+                                fpath, outfile_path, compile_options, unknown_args
                             )
-                        )
-                        print("Error log file at {}".format(error_logfile))
-                    continue
-
-                if SYSTEM == "windows":
-                    with open(outfile_path) as rfh:
-                        contents = re.sub(
-                            "'([^']*)'", r"\1", rfh.read().replace("\\", "/"), re.MULTILINE
-                        )
-                    with open(outfile_path, "w") as wfh:
-                        wfh.write(contents)
-
-                if not regexes:
-                    continue
-
-                with open(outfile_path) as rfh:
-                    in_contents = rfh.read()
-
-                out_contents = []
-                for line in in_contents.splitlines():
-                    print("Processing line: {!r} // {}".format(line, [r.pattern for r in regexes]))
-                    for regex in regexes:
-                        if regex.match(line):
-                            print(
-                                "Line commented out by regex '{}': '{}'".format(regex.pattern, line)
+                        if success:
+                            post_process_compiled_file(
+                                outfile_path,
+                                regexes,
+                                lock_graph_path=(
+                                    lockgraph.lock_graph_path_for(outfile_path)
+                                    if options.lock_graph
+                                    else None
+                                ),
+                            )
+                        target_result["success"] = success
+                    if not success:
+                        exitcode = 1
+                        error_logfile = outfile_path.replace(".txt", ".log")
+                        with open(error_logfile, "w") as wfh:
+                            log_stream.seek(0)
+                            wfh.write(
+                                ">>>>>>> LOGS >>>>>>>>>\n{}\n<<<<<<< LOGS <<<<<<<<<\n".format(
+                                    log_stream.read().strip()
+                                )
                             )
-                            line = textwrap.dedent(
-                                """\
-                                # Next line explicitly commented out by {} because of the following regex: '{}'
-                                # {}""".format(
-                                    os.path.basename(__file__), regex.pattern, line
+                            wfh.write(
+                                "\n>>>>>>> STDOUT >>>>>>>\n{}\n<<<<<<< STDOUT <<<<<<<\n".format(
+                                    capstds.stdout.strip()
                                 )
                             )
+                            wfh.write(
+                                "\n>>>>>>> STDERR >>>>>>>\n{}\n<<<<<<< STDERR <<<<<<<\n".format(
+                                    capstds.stderr.strip()
+                                )
+                            )
+                            print("Error log file at {}".format(error_logfile))
+                        if variant_base is None and variant_list:
+                            print("Not compiling the variants of {}, without a base".format(fpath))
                             break
-                    out_contents.append(line)
+                        continue
 
-                out_contents = os.linesep.join(out_contents) + os.linesep
-                with open(outfile_path, "w") as wfh:
-                    wfh.write(out_contents)
+                    # The variants are in the shard of their base
+                    measured[source_key] = measured.get(source_key, 0) + time.monotonic() - start
+                    if run_checkpoint is not None:
+                        run_checkpoint.complete(work_item_key, input_files, outfile_path)
 
+            if run_checkpoint is not None:
+                # Went through all the targets, the failed ones are compiled again next time
+                run_checkpoint.remove()
             if exitcode:
                 stdout = capstds.stdout
                 stderr = capstds.stderr
+        eventstream.emit("run_finished", exitcode=exitcode, duration=time.monotonic() - run_start)
+
+    if durations_path and measured:
+        sharding.write_durations(durations_path, measured)
 
     if stdout:
         sys.__stdout__.write(capstds.stdout)
@@ -0,0 +1,471 @@
+"""
+pip_tools_compile.api
+~~~~~~~~~~~~~~~~~~~~~
+
+In-process API to compile requirements files.
+
+Contrary to the ``pip-tools-compile`` command line, nothing here parses ``sys.argv``, swaps
+``sys.stdout``/``sys.stderr`` or calls ``sys.exit``. What would otherwise be printed is captured
+per job and returned in its :py:class:`Result`. Since everything runs in the calling process,
+pip, pip-tools and their caches stay loaded between compiles.
+
+Impersonations are scoped to the thread compiling, see :py:mod:`pip_tools_compile.patching`, so
+``compile_many`` can compile the jobs of several systems at once, in threads, sharing those caches.
+
+.. code-block:: python
+
+    from pip_tools_compile.api import Job, compile_many
+
+    results = compile_many(
+        [
+            Job("requirements/static/linux.in", platform="linux", py_version="3.9"),
+            Job("requirements/static/windows.in", platform="windows", py_version="3.9"),
+        ]
+    )
+    for result in results:
+        print(result.output_path, result.success, result.duration)
+"""
+import collections
+import concurrent.futures
+import contextvars
+import functools
+import io
+import logging
+import re
+import time
+
+from piptools.scripts import compile as piptools_compile
+
+from pip_tools_compile import equivalence
+from pip_tools_compile import eventstream
+from pip_tools_compile import lockgraph
+from pip_tools_compile import patching
+from pip_tools_compile import sessionpool
+from pip_tools_compile import sharding
+from pip_tools_compile.__main__ import activate_cache_settings
+from pip_tools_compile.__main__ import CacheSettings
+from pip_tools_compile.__main__ import compile_requirement_file
+from pip_tools_compile.__main__ import get_output_path
+from pip_tools_compile.__main__ import get_parser
+from pip_tools_compile.__main__ import get_profile
+from pip_tools_compile.__main__ import IMPERSONATIONS
+from pip_tools_compile.__main__ import LOG_DATEFMT
+from pip_tools_compile.__main__ import LOG_FORMAT
+from pip_tools_compile.__main__ import post_process_compiled_file
+from pip_tools_compile.__main__ import redirect_piptools_output
+from pip_tools_compile.__main__ import TargetPython
+
+log = logging.getLogger("pip-tools-compile.api")
+
+_CURRENT_CAPTURE = contextvars.ContextVar("pip_tools_compile_api_capture", default=None)
+
+Result = collections.namedtuple(
+    "Result", ["job", "success", "output_path", "duration", "output", "logs"]
+)
+Result.__doc__ = """
+The outcome of compiling a :py:class:`Job`.
+
+``success`` tells if the compile succeeded, ``output_path`` is the compiled requirements file,
+``duration`` the number of seconds it took, ``output`` what pip-compile printed and ``logs`` the
+log messages emitted while compiling, at the levels the application enabled for the
+``pip-tools-compile`` logger.
+"""
+
+
+class Job:
+    """
+    A requirements file to compile, and how to compile it.
+
+    The keyword arguments match the ``pip-tools-compile`` command line flags of the same name,
+    ``pip_args`` are the extra arguments passed through to ``pip-compile``.
+    """
+
+    __slots__ = (
+        "source",
+        "platform",
+        "py_version",
+        "machine",
+        "include",
+        "output_dir",
+        "out_prefix",
+        "remove_line",
+        "passthrough_line_from_input",
+        "result_cache",
+        "lock_graph",
+        "offline",
+        "record",
+        "replay",
+        "resolver",
+        "seed_from",
+        "seed_siblings",
+        "static_requirements",
+        "clean_cache",
+        "pip_args",
+    )
+
+    def __init__(
+        self,
+        source,
+        platform=None,
+        py_version=None,
+        machine=None,
+        include=(),
+        output_dir=None,
+        out_prefix=None,
+        remove_line=(),
+        passthrough_line_from_input=(),
+        result_cache=None,
+        lock_graph=False,
+        offline=False,
+        record=None,
+        replay=None,
+        resolver="legacy",
+        seed_from=(),
+        seed_siblings=False,
+        static_requirements=False,
+        clean_cache=False,
+        pip_args=(),
+    ):
+        defaults = get_parser().parse_args([])
+        self.source = source
+        self.platform = platform or defaults.platform
+        self.py_version = py_version or defaults.py_version
+        self.machine = machine
+        self.include = list(include)
+        self.output_dir = output_dir
+        self.out_prefix = out_prefix
+        self.remove_line = list(remove_line)
+        self.passthrough_line_from_input = list(passthrough_line_from_input)
+        self.result_cache = result_cache
+        self.lock_graph = lock_graph
+        self.offline = offline
+        self.record = record
+        self.replay = replay
+        self.resolver = resolver
+        self.seed_from = list(seed_from)
+        self.seed_siblings = seed_siblings
+        self.static_requirements = static_requirements
+        self.clean_cache = clean_cache
+        self.pip_args = list(pip_args)
+
+    def __repr__(self):
+        return "{}({!r}, platform={!r}, py_version={!r})".format(
+            self.__class__.__name__, self.source, self.platform, self.py_version
+        )
+
+    @property
+    def target(self):
+        """
+        The system to impersonate while compiling this job.
+        """
+        return self.platform, self.py_version, self.machine
+
+    @property
+    def work_item_key(self):
+        """
+        The key under which the duration of this job is recorded, see
+        :py:mod:`pip_tools_compile.sharding`.
+        """
+        return sharding.get_work_item_key(self.source, *self.target)
+
+    def get_options(self):
+        """
+        Return the options namespace, as the command line would parse it, for this job.
+        """
+        options = get_parser().parse_args([])
+        for name in self.__slots__:
+            if name == "source":
+                options.files = [self.source]
+            elif name != "pip_args":
+                setattr(options, name, getattr(self, name))
+        return options
+
+
+class _CaptureLogs:
+    def __init__(self, stream):
+        self._handler = logging.StreamHandler(stream)
+        self._handler.setFormatter(logging.Formatter(fmt=LOG_FORMAT, datefmt=LOG_DATEFMT))
+        # Not the messages of the compiles running in other threads
+        self._handler.addFilter(self._is_current)
+        self._logger = logging.getLogger("pip-tools-compile")
+        self._token = None
+
+    def _is_current(self, _record):
+        return _CURRENT_CAPTURE.get() is self
+
+    def __enter__(self):
+        self._token = _CURRENT_CAPTURE.set(self)
+        self._logger.addHandler(self._handler)
+        return self
+
+    def __exit__(self, *_):
+        self._logger.removeHandler(self._handler)
+        _CURRENT_CAPTURE.reset(self._token)
+
+
+def _compile_job(job):
+    options = job.get_options()
+    regexes = [re.compile(regex) for regex in options.remove_line]
+    output = io.StringIO()
+    logs = io.StringIO()
+    start = time.monotonic()
+    output_path = get_output_path(job.source, options)
+    with _CaptureLogs(logs), redirect_piptools_output(output), eventstream.target(
+        job.work_item_key, source=job.source, dest=output_path
+    ) as target_result, eventstream.watch_output(output_path):
+        success = compile_requirement_file(
+            job.source, output_path, options, job.pip_args, stdout=output
+        )
+        if success:
+            lock_graph_path = None
+            if options.lock_graph:
+                lock_graph_path = lockgraph.lock_graph_path_for(output_path)
+            post_process_compiled_file(
+                output_path, regexes, stdout=output, lock_graph_path=lock_graph_path
+            )
+        target_result["success"] = success
+    return Result(
+        job=job,
+        success=success,
+        output_path=output_path,
+        duration=time.monotonic() - start,
+        output=output.getvalue(),
+        logs=logs.getvalue(),
+    )
+
+
+def _read_file(path):
+    try:
+        with open(path) as rfh:
+            return rfh.read()
+    except FileNotFoundError:
+        return None
+
+
+def _get_sharing_key(job):
+    # Jobs which only differ by the system to impersonate
+    return tuple(
+        tuple(value) if isinstance(value, list) else value
+        for name, value in ((name, getattr(job, name)) for name in job.__slots__)
+        if name not in ("platform", "py_version", "machine")
+    )
+
+
+def _get_template_fields(job):
+    contents = [job.source] + job.include + job.pip_args
+    if not equivalence.get_template_fields(*contents):
+        for path in [job.source] + job.include:
+            contents.append(_read_file(path) or "")
+    return equivalence.get_template_fields(*contents)
+
+
+def _share_result(result, previous_contents, recorder, job):
+    """
+    Write the compiled files of ``job`` from ``result`` if it can be proven that ``job`` resolves
+    exactly the same, and return its :py:class:`Result`, otherwise return ``None``.
+    """
+    start = time.monotonic()
+    options = job.get_options()
+    output_path = get_output_path(job.source, options)
+    if output_path == result.output_path:
+        return None
+    contents = _read_file(output_path)
+    if contents is None or previous_contents is None:
+        same_contents = contents is previous_contents
+    else:
+        same_contents = equivalence.strip_header(contents) == equivalence.strip_header(
+            previous_contents
+        )
+    if not same_contents:
+        # pip-compile prefers the pins of the current compiled file
+        log.info("Not sharing %r with %r, the current compiled files differ", result.job, job)
+        return None
+    # The dependency cache the compile of the job would use, without discarding it
+    cache_settings = CacheSettings(static_requirements=job.static_requirements, clean=False)
+    with activate_cache_settings(cache_settings), IMPERSONATIONS[job.platform](
+        job.py_version, job.platform, job.machine
+    ) as impersonation:
+        # pylint: disable=protected-access
+        target_python = TargetPython(impersonation._python_version_info, impersonation._platform)
+        # pylint: enable=protected-access
+        differences = recorder.get_differences(
+            target_python,
+            # The dependency cache of the impersonated system
+            depcache_factory=piptools_compile.DependencyCache,
+            hashes="--generate-hashes" in job.pip_args,
+        )
+    if differences:
+        log.info(
+            "Not sharing %r with %r, %d decision(s) differ, starting with %s",
+            result.job,
+            job,
+            len(differences),
+            differences[0],
+        )
+        return None
+    with open(output_path, "w") as wfh:
+        wfh.write(
+            equivalence.rewrite_header(
+                _read_file(result.output_path), result.output_path, output_path
+            )
+        )
+    if options.lock_graph:
+        graph = lockgraph.read_lock_graph(lockgraph.lock_graph_path_for(result.output_path))
+        graph["profile"] = get_profile(options)
+        lockgraph.write_lock_graph(graph, lockgraph.lock_graph_path_for(output_path))
+    eventstream.emit(
+        "target_shared",
+        target=job.work_item_key,
+        shared_from=result.job.work_item_key,
+        dest=output_path,
+    )
+    return Result(
+        job=job,
+        success=True,
+        output_path=output_path,
+        duration=time.monotonic() - start,
+        output="{} resolves exactly like {}, wrote {} from {}\n".format(
+            job, result.job, output_path, result.output_path
+        ),
+        logs="",
+    )
+
+
+def _compile_sharing_equivalent(jobs, indexes, results):
+    pending = list(indexes)
+    first = jobs[pending[0]]
+    if first.resolver != "legacy" or first.seed_from or first.seed_siblings:
+        # Only the decisions of pip-tools' resolver, without seeds, are recorded
+        log.info(
+            "Not sharing results between the %d system(s) compiling %s, with the %s resolver "
+            "or seed files",
+            len(pending),
+            first.source,
+            first.resolver,
+        )
+        for idx in pending:
+            job = jobs[idx]
+            with IMPERSONATIONS[job.platform](job.py_version, job.platform, job.machine):
+                results[idx] = _compile_job(job)
+        return
+    template_fields = _get_template_fields(jobs[pending[0]])
+    if template_fields:
+        log.info(
+            "Not sharing results between the %d system(s) compiling %s, the inputs depend on %s",
+            len(pending),
+            jobs[pending[0]].source,
+            ", ".join(template_fields),
+        )
+    while pending:
+        idx = pending.pop(0)
+        job = jobs[idx]
+        options = job.get_options()
+        previous_contents = _read_file(get_output_path(job.source, options))
+        with IMPERSONATIONS[job.platform](
+            job.py_version, job.platform, job.machine
+        ) as impersonation:
+            # pylint: disable=protected-access
+            recorder = equivalence.DecisionRecorder(impersonation._python_version_info)
+            # pylint: enable=protected-access
+            with equivalence.activate(recorder):
+                results[idx] = _compile_job(job)
+        if template_fields or not results[idx].success or not recorder.resolved:
+            continue
+        for other_idx in list(pending):
+            result = _share_result(results[idx], previous_contents, recorder, jobs[other_idx])
+            if result is not None:
+                results[other_idx] = result
+                pending.remove(other_idx)
+
+
+def compile_many(jobs, share_equivalent=False, events=None, workers=1):
+    """
+    Compile all ``jobs`` and return a list of :py:class:`Result`, in the same order.
+
+    Jobs targeting the same system are compiled together, under a single impersonation.
+
+    With ``share_equivalent``, jobs which only differ by the system to impersonate are compiled
+    once for each group of systems proven to resolve them identically, see
+    :py:mod:`pip_tools_compile.equivalence`. The other jobs of a group get their compiled files
+    written from that result.
+
+    All the compiles share their connections to the indexes, and the index pages fetched, see
+    :py:mod:`pip_tools_compile.sessionpool`.
+
+    ``events``, a path or a file descriptor number as for ``--events``, or a writable text
+    stream, receives the progress of the compiles, see :py:mod:`pip_tools_compile.eventstream`.
+
+    Up to ``workers`` threads compile the jobs of different systems, or with ``share_equivalent``
+    the groups of jobs, at once. Compiles rewriting the same input file, to render its
+    ``{py_version}`` or ``{platform}`` placeholders, still take turns.
+    """
+    jobs = list(jobs)
+    results = [None] * len(jobs)
+    event_stream = None
+    if isinstance(events, str):
+        event_stream = eventstream.EventStream.open(events)
+    elif events is not None:
+        event_stream = eventstream.EventStream(events)
+    start = time.monotonic()
+    with sessionpool.activate(sessionpool.SessionPool()), eventstream.activate(event_stream):
+        eventstream.emit("run_started", targets=len(jobs))
+        _compile_many(jobs, results, share_equivalent, workers)
+        eventstream.emit(
+            "run_finished",
+            exitcode=0 if all(result.success for result in results) else 1,
+            duration=time.monotonic() - start,
+        )
+    return results
+
+
+def _compile_many(jobs, results, share_equivalent, workers):
+    groups = []
+    if share_equivalent:
+        jobs_by_sharing_key = collections.OrderedDict()
+        for idx, job in enumerate(jobs):
+            jobs_by_sharing_key.setdefault(_get_sharing_key(job), []).append(idx)
+        for indexes in jobs_by_sharing_key.values():
+            groups.append(functools.partial(_compile_sharing_equivalent, jobs, indexes, results))
+    else:
+        jobs_by_target = collections.OrderedDict()
+        for idx, job in enumerate(jobs):
+            jobs_by_target.setdefault(job.target, []).append(idx)
+        for indexes in jobs_by_target.values():
+            groups.append(functools.partial(_compile_target, jobs, indexes, results))
+    if workers <= 1 or len(groups) <= 1:
+        for group in groups:
+            group()
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each group impersonates its systems within a copy of this context, with the session
+        # pool and the event stream
+        futures = [patching.submit(executor, group) for group in groups]
+        for future in futures:
+            future.result()
+
+
+def _compile_target(jobs, indexes, results):
+    platform, py_version, machine = jobs[indexes[0]].target
+    log.info("Compiling %d job(s) impersonating %s/py%s", len(indexes), platform, py_version)
+    with IMPERSONATIONS[platform](py_version, platform, machine):
+        for idx in indexes:
+            results[idx] = _compile_job(jobs[idx])
+
+
+def select_shard(jobs, index, count, durations=None):
+    """
+    Return the jobs, out of ``jobs``, which the shard ``index`` out of ``count`` must compile.
+
+    ``durations`` are the durations of previous compiles by :py:attr:`Job.work_item_key`, as
+    returned by :py:func:`pip_tools_compile.sharding.read_durations`.
+    """
+    jobs = list(jobs)
+    selected = set(sharding.select([job.work_item_key for job in jobs], index, count, durations))
+    return [job for job in jobs if job.work_item_key in selected]
+
+
+def get_durations(results):
+    """
+    Return the durations of the successful compiles in ``results``, by work item key.
+    """
+    return {result.job.work_item_key: result.duration for result in results if result.success}
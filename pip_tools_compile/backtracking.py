@@ -0,0 +1,347 @@
+"""
+pip_tools_compile.backtracking
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+A backtracking resolver engine for pip-compile, built on the `resolvelib`_ pip vendors.
+
+pip-tools' own resolver works in rounds, each one looking up the best match of every known
+requirement again, and only stops once a round finds no new dependency, which takes many rounds,
+each one slower than the previous, on large dependency graphs. :py:class:`BacktrackingResolver`
+pins one project at a time, the most constrained first, and backtracks when a pin turns out to
+conflict with the dependencies found later on, like pip's own resolver does since pip 20.3.
+
+It is a drop in replacement of the pip-tools ``Resolver``: candidates are still looked up through
+the repository pip-compile built, so the impersonated system decides which files are usable,
+existing pins, then seed pins, are still preferred, dependencies go through the pip-tools dependency cache and the
+result is written by pip-compile in the usual format.
+
+.. code-block:: console
+
+    pip-tools-compile --resolver=backtracking requirements/static/*.in
+
+.. _resolvelib: https://github.com/sarugaru/resolvelib
+"""
+import collections
+import contextlib
+import logging
+
+from pip._vendor import resolvelib
+from pip._vendor.packaging.specifiers import SpecifierSet
+from pip._vendor.packaging.utils import canonicalize_name
+from pip._vendor.packaging.version import parse as parse_version
+from piptools.exceptions import NoCandidateFound
+from piptools.exceptions import PipToolsError
+from piptools.resolver import Resolver
+from piptools.utils import as_tuple
+from piptools.utils import is_url_requirement
+from piptools.utils import key_from_ireq
+from piptools.utils import make_install_requirement
+from piptools.utils import UNSAFE_PACKAGES
+
+from pip_tools_compile import eventstream
+from pip_tools_compile.patching import Substitution
+
+ENGINES = ("legacy", "backtracking")
+
+# resolvelib pins one project per round, and backtracking takes rounds too
+MAX_ROUNDS = 200000
+
+log = logging.getLogger("pip-tools-compile.backtracking")
+
+
+@contextlib.contextmanager
+def activate(engine):
+    """
+    Make pip-compile resolve with ``engine``, one of :py:data:`ENGINES`, within this context.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown resolver engine: {}".format(engine))
+    if engine == "legacy":
+        yield
+        return
+    with Substitution("piptools.scripts.compile.Resolver", BacktrackingResolver):
+        yield
+
+
+class ConflictingRequirements(PipToolsError):
+    """
+    Raised when no set of pins satisfies all the requirements.
+    """
+
+    def __init__(self, causes):
+        super().__init__(causes)
+        self.causes = causes
+
+    def __str__(self):
+        lines = ["Could not find versions satisfying all the requirements, these conflict:"]
+        for requirement, parent in self.causes:
+            if parent is None:
+                lines.append("  {}".format(requirement))
+            else:
+                lines.append("  {} (required by {})".format(requirement, parent))
+        return "\n".join(lines)
+
+
+def _get_identifier(name, extras):
+    if not extras:
+        return name
+    return "{}[{}]".format(name, ",".join(sorted(extras)))
+
+
+class Candidate:
+    """
+    A version of a project, with some of its extras, or the project at an URL, an editable one.
+    """
+
+    __slots__ = ("name", "version", "extras", "project_name", "url_ireq")
+
+    def __init__(self, name, version, extras=(), project_name=None, url_ireq=None):
+        self.name = name
+        self.version = version
+        self.extras = frozenset(extras)
+        self.project_name = project_name or name
+        self.url_ireq = url_ireq
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self)
+
+    def __str__(self):
+        if self.url_ireq is not None:
+            return str(self.url_ireq)
+        return "{}=={}".format(_get_identifier(self.name, self.extras), self.version)
+
+    def __eq__(self, other):
+        if not isinstance(other, Candidate):
+            return NotImplemented
+        return (self.name, self.version, self.extras, self.url_ireq) == (
+            other.name,
+            other.version,
+            other.extras,
+            other.url_ireq,
+        )
+
+    def __hash__(self):
+        return hash((self.name, self.version, self.extras))
+
+    def make_ireq(self, extras=None):
+        """
+        Return the pinned ``InstallRequirement`` of this candidate, as pip-tools' resolver
+        would.
+        """
+        if self.url_ireq is not None:
+            return self.url_ireq
+        return make_install_requirement(
+            self.project_name, self.version, self.extras if extras is None else extras
+        )
+
+
+class Provider(resolvelib.AbstractProvider):
+    """
+    Tells resolvelib about the candidates and dependencies the pip-tools ``resolver`` finds.
+    """
+
+    def __init__(self, resolver, constraints):
+        self._resolver = resolver
+        repository = resolver.repository
+        # pip-compile wraps the repository to prefer the existing pins
+        self._existing_pins = getattr(repository, "existing_pins", {})
+        self._repository = getattr(repository, "repository", repository)
+        self._constraints = collections.defaultdict(list)
+        for ireq in constraints:
+            self._constraints[canonicalize_name(ireq.name)].append(ireq)
+
+    def identify(self, requirement_or_candidate):
+        if isinstance(requirement_or_candidate, Candidate):
+            return _get_identifier(requirement_or_candidate.name, requirement_or_candidate.extras)
+        return _get_identifier(
+            canonicalize_name(requirement_or_candidate.name), requirement_or_candidate.extras
+        )
+
+    def get_preference(self, resolution, candidates, information):
+        # The most constrained projects first, they are the most likely to conflict
+        return sum(1 for _ in candidates)
+
+    def find_matches(self, requirements):
+        name = canonicalize_name(requirements[0].name)
+        extras = frozenset(requirements[0].extras)
+        for ireq in requirements + self._constraints[name]:
+            if ireq.editable or is_url_requirement(ireq):
+                return [Candidate(name, None, extras, ireq.name, url_ireq=ireq)]
+        specifier = SpecifierSet()
+        for ireq in requirements + self._constraints[name]:
+            specifier &= ireq.specifier
+        all_candidates = self._repository.find_all_candidates(requirements[0].name)
+        matching_versions = set(
+            specifier.filter(
+                {candidate.version for candidate in all_candidates},
+                prereleases=self._resolver.prereleases,
+            )
+        )
+        matching_candidates = [
+            candidate for candidate in all_candidates if candidate.version in matching_versions
+        ]
+        if not matching_candidates:
+            return []
+        evaluator = self._repository.finder.make_candidate_evaluator(requirements[0].name)
+        # pylint: disable=protected-access
+        matching_candidates.sort(key=evaluator._sort_key, reverse=True)
+        # pylint: enable=protected-access
+        preferred_versions = []
+        existing_pin = self._existing_pins.get(key_from_ireq(requirements[0]))
+        if existing_pin is not None:
+            preferred_versions.append(parse_version(as_tuple(existing_pin)[1]))
+        # Then the pins of the seed files, see pip_tools_compile.seeding
+        seed_pins = getattr(self._repository, "seed_pins", None)
+        seed_version = seed_pins.get(name) if seed_pins else None
+        if seed_version is not None:
+            preferred_versions.append(parse_version(seed_version))
+        versions = []
+        for preferred_version in preferred_versions:
+            for candidate in matching_candidates:
+                if candidate.version == preferred_version and not candidate.link.is_yanked:
+                    versions.append(candidate.version)
+                    break
+        if seed_version is not None:
+            seed_pins.record(name, used=parse_version(seed_version) in versions)
+        for candidate in matching_candidates:
+            if candidate.version not in versions:
+                versions.append(candidate.version)
+        project_name = matching_candidates[0].name
+        return [Candidate(name, version, extras, project_name) for version in versions]
+
+    def is_satisfied_by(self, requirement, candidate):
+        if candidate.url_ireq is not None:
+            return True
+        return requirement.specifier.contains(candidate.version, prereleases=True)
+
+    def get_dependencies(self, candidate):
+        ireq = candidate.make_ireq()
+        # Through the dependency cache
+        # pylint: disable=protected-access
+        dependencies = list(self._resolver._iter_dependencies(ireq))
+        # pylint: enable=protected-access
+        if candidate.extras:
+            # The project itself, at the same version, besides the dependencies of its extras
+            base = Candidate(candidate.name, candidate.version, (), candidate.project_name)
+            dependencies.insert(0, base.make_ireq())
+            dependencies[0].comes_from = ireq
+        return dependencies
+
+
+class Reporter(resolvelib.BaseReporter):
+    """
+    Counts the rounds and the backtracks of a resolution.
+    """
+
+    def __init__(self):
+        self.rounds = 0
+        self.backtracks = 0
+
+    def starting_round(self, index):
+        self.rounds = index + 1
+
+    def backtracking(self, candidate):
+        self.backtracks += 1
+        log.debug("Backtracking, %s conflicts with the other pins", candidate)
+
+
+class BacktrackingResolver(Resolver):
+    """
+    The pip-tools ``Resolver``, resolving with resolvelib.
+
+    pip-compile's ``--max-rounds`` only applies to pip-tools' resolver.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rounds = 0
+        self.backtracks = 0
+
+    def resolve(self, max_rounds=10):
+        if self.clear_caches:
+            self.dependency_cache.clear()
+            self.repository.clear_caches()
+
+        for ireq in self.our_constraints:
+            if ireq.name is None:
+                # Gives URL requirements their name
+                self.repository.get_dependencies(ireq)
+        requirements = [ireq for ireq in self.our_constraints if not ireq.constraint]
+        constraints = [ireq for ireq in self.our_constraints if ireq.constraint]
+        provider = Provider(self, constraints)
+        reporter = Reporter()
+        try:
+            with self.repository.freshen_build_caches():
+                result = resolvelib.Resolver(provider, reporter).resolve(
+                    requirements, max_rounds=MAX_ROUNDS
+                )
+                pins = self._get_pins(result)
+                # The dependency cache must know the pins with all their extras
+                for ireq in pins:
+                    if not ireq.editable and not is_url_requirement(ireq):
+                        list(self._iter_dependencies(ireq))
+        except resolvelib.ResolutionImpossible as exc:
+            self._raise_conflict(provider, exc.causes)
+        except resolvelib.ResolutionTooDeep:
+            raise RuntimeError(
+                "No stable configuration of concrete packages could be found for the given "
+                "constraints after {} rounds of resolving.".format(MAX_ROUNDS)
+            )
+        finally:
+            self.rounds = reporter.rounds
+            self.backtracks = reporter.backtracks
+            eventstream.emit("backtracking", rounds=self.rounds, backtracks=self.backtracks)
+        log.debug("Resolved in %d round(s), backtracking %d time(s)", self.rounds, self.backtracks)
+
+        results = {ireq for ireq in pins if not ireq.constraint}
+        self.unsafe_constraints = set()
+        if not self.allow_unsafe:
+            # Same as pip-tools' resolver
+            reverse_dependencies = self.reverse_dependencies(results)
+            for req in results.copy():
+                required_by = reverse_dependencies.get(req.name.lower(), [])
+                if req.name in UNSAFE_PACKAGES or (
+                    required_by and all(name in UNSAFE_PACKAGES for name in required_by)
+                ):
+                    self.unsafe_constraints.add(req)
+                    results.remove(req)
+        return results
+
+    def _get_pins(self, result):
+        candidates = {}
+        extras = collections.defaultdict(set)
+        source_ireqs = collections.defaultdict(list)
+        for identifier, candidate in result.mapping.items():
+            candidates.setdefault(candidate.name, candidate)
+            extras[candidate.name] |= candidate.extras
+            for requirement, parent in result.criteria[identifier].information:
+                if parent is not None and parent.name == candidate.name:
+                    # Required by one of its extras
+                    continue
+                source_ireqs[candidate.name].append(requirement)
+        pins = []
+        for name, candidate in sorted(candidates.items()):
+            ireq = candidate.make_ireq(extras=extras[name])
+            if source_ireqs[name]:
+                ireq.comes_from = source_ireqs[name][0].comes_from
+            ireq._source_ireqs = source_ireqs[name]  # pylint: disable=protected-access
+            pins.append(ireq)
+        return pins
+
+    def _raise_conflict(self, provider, causes):
+        names = {canonicalize_name(requirement.name) for requirement, _ in causes}
+        if len(names) == 1 and all(parent is None for _, parent in causes):
+            # Nothing matches a requirement given in the input files
+            ireq = causes[0].requirement
+            # pylint: disable=protected-access
+            repository = provider._repository
+            # pylint: enable=protected-access
+            raise NoCandidateFound(
+                ireq, repository.find_all_candidates(ireq.name), repository.finder
+            )
+        raise ConflictingRequirements(
+            [
+                (requirement, None if parent is None else parent.make_ireq())
+                for requirement, parent in causes
+            ]
+        )
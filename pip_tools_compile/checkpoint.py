@@ -0,0 +1,225 @@
+"""
+pip_tools_compile.checkpoint
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Checkpoint the progress of a run, to resume it once interrupted.
+
+A run compiling a large matrix of requirements files can reach a CI time limit, or be pre-empted,
+and the next attempt would start from nothing. With ``--checkpoint``, while compiling, the run
+writes, to a checkpoint file in the pip-tools cache directory:
+
+* the targets already compiled, with a digest of their inputs and of the compiled file written;
+* the pins found by each pip-tools resolver round of the target being compiled, and a digest of
+  its inputs.
+
+Passing ``--resume`` to the same command, from the same directory, skips the targets whose inputs
+and compiled files did not change since, and prefers the pins found before the interruption when
+compiling the interrupted target from the same inputs, the way :py:mod:`pip_tools_compile.seeding`
+does. pip-tools' resolver only ever adds constraints from one round to the next, so a pin found by
+an earlier round which still satisfies the requirement is the one the resolver would pick again.
+The dependencies of the pinned distributions are in the pip-tools dependency cache, written as
+they are found.
+
+The resumed run keeps writing the checkpoint. The checkpoint is removed once a run went through
+all its targets, the ones which failed to compile are compiled again by the next run.
+
+.. code-block:: console
+
+    pip-tools-compile --py-version=3.9 --checkpoint requirements/static/*/*.in
+    # Interrupted, then
+    pip-tools-compile --py-version=3.9 --resume requirements/static/*/*.in
+"""
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+
+from piptools.locations import CACHE_DIR
+from piptools.utils import as_tuple
+
+from pip_tools_compile import resultcache
+
+CHECKPOINT_FORMAT = 1
+
+log = logging.getLogger("pip-tools-compile.checkpoint")
+
+_CURRENT_CHECKPOINT = contextvars.ContextVar("pip_tools_compile_checkpoint", default=None)
+
+
+def get_current_checkpoint():
+    """
+    Return the :py:class:`Checkpoint` of the run, if any.
+    """
+    return _CURRENT_CHECKPOINT.get()
+
+
+@contextlib.contextmanager
+def activate(run_checkpoint):
+    """
+    Record the progress of the run in ``run_checkpoint`` within this context.
+    """
+    token = _CURRENT_CHECKPOINT.set(run_checkpoint)
+    try:
+        yield run_checkpoint
+    finally:
+        _CURRENT_CHECKPOINT.reset(token)
+
+
+def get_checkpoint_path(args, cwd=None):
+    """
+    Return the path of the checkpoint of a run with the command line ``args``, without
+    ``--checkpoint`` nor ``--resume``, from the ``cwd`` directory.
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    key = hashlib.sha256(
+        json.dumps(
+            [os.path.abspath(cwd), [arg for arg in args if arg not in ("--checkpoint", "--resume")]]
+        ).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(CACHE_DIR, "checkpoints", "{}.json".format(key))
+
+
+def get_inputs_digest(input_files):
+    """
+    Return a digest of ``input_files`` and of the requirements files they reference.
+    """
+    hasher = hashlib.sha256()
+    seen = set()
+    for input_file in input_files:
+        for path in resultcache.iter_referenced_files(input_file, seen):
+            with open(path, "rb") as rfh:
+                hasher.update(
+                    "{}\0{}\0".format(path, hashlib.sha256(rfh.read()).hexdigest()).encode("utf-8")
+                )
+    return hasher.hexdigest()
+
+
+def _get_file_digest(path):
+    try:
+        with open(path, "rb") as rfh:
+            return hashlib.sha256(rfh.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class Checkpoint:
+    """
+    The progress of a run, stored at ``path``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self.pins = {}
+        self._target = None
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return the checkpoint stored at ``path``, an empty one if there is none.
+        """
+        checkpoint = cls(path)
+        try:
+            with open(path) as rfh:
+                doc = json.load(rfh)
+            if doc["__format__"] != CHECKPOINT_FORMAT:
+                raise ValueError("Unknown checkpoint format")
+            checkpoint.completed = doc["completed"]
+            checkpoint.pins = doc["pins"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.warning("Ignoring the checkpoint %s: %s", path, exc)
+        return checkpoint
+
+    def save(self):
+        """
+        Write the checkpoint, atomically.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as wfh:
+            json.dump(
+                {"__format__": CHECKPOINT_FORMAT, "completed": self.completed, "pins": self.pins},
+                wfh,
+                sort_keys=True,
+            )
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        """
+        Remove the stored checkpoint, the run is over.
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    def is_completed(self, work_item_key, input_files, dest):
+        """
+        Return whether the target ``work_item_key`` was compiled into ``dest`` from the current
+        contents of ``input_files``, and ``dest`` was not changed since.
+        """
+        completed = self.completed.get(work_item_key)
+        if completed is None or completed["dest"] != os.path.abspath(dest):
+            return False
+        return completed["inputs"] == get_inputs_digest(input_files) and completed[
+            "output"
+        ] == _get_file_digest(dest)
+
+    def complete(self, work_item_key, input_files, dest):
+        """
+        Record that the target ``work_item_key`` was compiled into ``dest`` from ``input_files``.
+        """
+        self.pins.pop(work_item_key, None)
+        self.completed[work_item_key] = {
+            "dest": os.path.abspath(dest),
+            "inputs": get_inputs_digest(input_files),
+            "output": _get_file_digest(dest),
+        }
+        self.save()
+
+    @contextlib.contextmanager
+    def target(self, work_item_key, input_files):
+        """
+        Record the resolver rounds of the target ``work_item_key``, compiled from ``input_files``,
+        within this context.
+        """
+        inputs = get_inputs_digest(input_files)
+        resumed = self.pins.get(work_item_key)
+        if resumed is None or resumed["inputs"] != inputs:
+            # The pins found from other inputs could be other than the best matches
+            self.pins[work_item_key] = {"inputs": inputs, "pins": {}}
+        self._target = work_item_key
+        try:
+            yield
+        finally:
+            self._target = None
+
+    def get_pins(self):
+        """
+        Return the ``name => version`` pins found before the current target was interrupted.
+        """
+        if self._target is None:
+            return {}
+        return dict(self.pins[self._target]["pins"])
+
+    def add_pin(self, ireq):
+        """
+        Record the pinned ``ireq`` found by the current resolver round.
+        """
+        if self._target is None:
+            return
+        name, version, _ = as_tuple(ireq)
+        self.pins[self._target]["pins"][name] = version
+
+    def end_round(self):
+        """
+        Write the pins found so far, at the end of a resolver round.
+        """
+        if self._target is not None:
+            self.save()
@@ -0,0 +1,282 @@
+"""
+pip_tools_compile.costledger
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Opt-in ledger of what each project costs a compile, and which top level requirement brought it in.
+
+.. code-block:: console
+
+    pip-tools-compile --cost-report requirements/static/ci/linux.in
+
+For every project the resolver looked at, the ledger counts the index pages requested, the other
+files downloaded, the bytes which came from the network, rather than pip's HTTP cache, the
+metadata builds, of source distributions or local projects, and the seconds the compile spent
+looking up its candidates and dependencies. Requests are attributed to a project by their URL, its
+project pages and the files they link to, or else to the project being looked up by the thread
+making them.
+
+Once resolved, every pinned project is traced back, through the ``# via`` annotations of the
+compiled file, to the requirements of the ``.in`` and ``--include`` files which pulled it in.
+The report, written next to the compiled requirements file, or to the ``.log`` of a failed compile,
+lists the projects, the most expensive first, and the top level requirements with what dropping
+each of them would save, the cost of the projects only it pulled in:
+
+.. code-block:: json
+
+    {
+     "projects": [
+      {
+       "builds": 1,
+       "bytes": 1837210,
+       "downloads": 1,
+       "index_requests": 1,
+       "name": "pycryptodomex",
+       "pinned": true,
+       "pulled_in_by": ["requests"],
+       "seconds": 12.5,
+       "via": ["requests"]
+      }
+     ],
+     "requirements": [
+      {"bytes": 1910432, "exclusive_projects": ["..."], "name": "requests", "seconds": 14.2}
+     ],
+     "totals": {"builds": 1, "bytes": 2512000, "downloads": 9, "index_requests": 9, "seconds": 21.3}
+    }
+
+Projects the resolver looked at but did not pin, candidates the resolver discarded, have
+``pinned`` false and are not pulled in by any requirement.
+"""
+import contextlib
+import contextvars
+import json
+import threading
+import time
+
+from pip._vendor.packaging.utils import canonicalize_name
+from pip._vendor.requests.adapters import BaseAdapter
+from piptools.utils import key_from_ireq
+
+from pip_tools_compile import lockgraph
+
+UNATTRIBUTED = "<unattributed>"
+
+_CURRENT_LEDGER = contextvars.ContextVar("pip_tools_compile_cost_ledger", default=None)
+
+_COUNTERS = ("index_requests", "downloads", "bytes", "builds", "seconds")
+
+
+def get_current_ledger():
+    """
+    Return the :py:class:`CostLedger` costs are recorded to, if any.
+    """
+    return _CURRENT_LEDGER.get()
+
+
+@contextlib.contextmanager
+def activate(ledger):
+    """
+    Record the costs of the compile happening within this context to ``ledger``.
+    """
+    token = _CURRENT_LEDGER.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _CURRENT_LEDGER.reset(token)
+
+
+def cost_report_path_for(dest):
+    """
+    Return the path of the cost report for the compiled requirements file ``dest``.
+    """
+    if dest.endswith(".txt"):
+        dest = dest[:-4]
+    return dest + ".costs.json"
+
+
+def _strip_fragment(url):
+    return url.split("#", 1)[0]
+
+
+class CostLedger:
+    """
+    Collects the costs of a single compile, per project.
+    """
+
+    def __init__(self):
+        self.projects = {}
+        self.via = {}
+        self.top_level = {}
+        self._urls = {}
+        self._index_urls = set()
+        self._lock = threading.Lock()
+        self._current = threading.local()
+
+    def _add(self, project_name, **counters):
+        with self._lock:
+            costs = self.projects.setdefault(project_name, dict.fromkeys(_COUNTERS, 0))
+            for name, value in counters.items():
+                costs[name] += value
+
+    def add_index_urls(self, project_name, urls):
+        """
+        Attribute the requests to the project pages at ``urls`` to ``project_name``.
+        """
+        project_name = canonicalize_name(project_name)
+        with self._lock:
+            for url in urls:
+                self._urls[url] = project_name
+                self._index_urls.add(url)
+
+    def add_links(self, project_name, links):
+        """
+        Attribute the downloads of the files at ``links`` to ``project_name``.
+        """
+        project_name = canonicalize_name(project_name)
+        with self._lock:
+            for link in links:
+                self._urls.setdefault(_strip_fragment(link.url), project_name)
+
+    @contextlib.contextmanager
+    def lookup(self, project_name):
+        """
+        Attribute the time spent, and the requests made by this thread, within this context to
+        ``project_name``.
+        """
+        project_name = canonicalize_name(project_name)
+        previous = getattr(self._current, "project_name", None)
+        self._current.project_name = project_name
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._current.project_name = previous
+            self._add(project_name, seconds=time.monotonic() - start)
+
+    def add_build(self, project_name):
+        self._add(canonicalize_name(project_name), builds=1)
+
+    def add_request(self, url, nbytes, from_cache):
+        """
+        Record a request to ``url``, which transferred ``nbytes`` unless it came ``from_cache``.
+        """
+        url = _strip_fragment(url)
+        with self._lock:
+            project_name = self._urls.get(url)
+            is_index_page = url in self._index_urls
+        if project_name is None:
+            project_name = getattr(self._current, "project_name", None) or UNATTRIBUTED
+        self._add(
+            project_name,
+            index_requests=int(is_index_page),
+            downloads=int(not is_index_page),
+            bytes=0 if from_cache else nbytes or 0,
+        )
+
+    def record(self, results):
+        """
+        Record the requirements of the ``results`` of the resolver, and what required them.
+        """
+        self.via = {}
+        self.top_level = {}
+        for ireq in results:
+            key = canonicalize_name(key_from_ireq(ireq))
+            required_by = lockgraph.get_required_by(ireq)
+            self.via[key] = sorted(
+                canonicalize_name(source) for source in required_by if not source.startswith("-")
+            )
+            self.top_level[key] = sorted(
+                source for source in required_by if source.startswith("-r ")
+            )
+
+    def get_pulled_in_by(self, project_name):
+        """
+        Return the top level requirements which, directly or not, pulled in ``project_name``.
+        """
+        pulled_in_by = set()
+        seen = set()
+        pending = [project_name]
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            if self.top_level.get(name):
+                pulled_in_by.add(name)
+            pending.extend(self.via.get(name, ()))
+        return sorted(pulled_in_by)
+
+    def install(self, session):
+        """
+        Wrap the HTTP(S) transport adapters of the pip ``session`` so that its requests are
+        recorded, whichever thread makes them.
+        """
+        for prefix, adapter in list(session.adapters.items()):
+            if prefix.startswith(("http://", "https://")):
+                session.mount(prefix, CostAdapter(self, adapter))
+
+    def get_report(self):
+        """
+        Return the cost report, see the module documentation.
+        """
+        with self._lock:
+            projects = {name: dict(costs) for name, costs in self.projects.items()}
+        for name in self.via:
+            projects.setdefault(name, dict.fromkeys(_COUNTERS, 0))
+        entries = []
+        for name, costs in projects.items():
+            costs["seconds"] = round(costs["seconds"], 3)
+            entries.append(
+                dict(
+                    costs,
+                    name=name,
+                    pinned=name in self.via,
+                    via=self.via.get(name, []),
+                    pulled_in_by=self.get_pulled_in_by(name),
+                )
+            )
+        entries.sort(key=lambda entry: (-entry["seconds"], -entry["bytes"], entry["name"]))
+        requirements = []
+        for name in sorted(name for name, sources in self.top_level.items() if sources):
+            exclusive = [entry for entry in entries if entry["pulled_in_by"] == [name]]
+            requirements.append(
+                {
+                    "name": name,
+                    "exclusive_projects": sorted(entry["name"] for entry in exclusive),
+                    "seconds": round(sum(entry["seconds"] for entry in exclusive), 3),
+                    "bytes": sum(entry["bytes"] for entry in exclusive),
+                }
+            )
+        requirements.sort(key=lambda entry: (-entry["seconds"], -entry["bytes"], entry["name"]))
+        totals = {name: sum(entry[name] for entry in entries) for name in _COUNTERS}
+        totals["seconds"] = round(totals["seconds"], 3)
+        return {"projects": entries, "requirements": requirements, "totals": totals}
+
+    def write(self, path):
+        with open(path, "w") as wfh:
+            json.dump(self.get_report(), wfh, indent=1, sort_keys=True)
+            wfh.write("\n")
+
+
+class CostAdapter(BaseAdapter):
+    """
+    Transport adapter recording the requests sent through the adapter it wraps to a
+    :py:class:`CostLedger`.
+    """
+
+    def __init__(self, ledger, adapter):
+        super().__init__()
+        self._ledger = ledger
+        self._adapter = adapter
+
+    def send(self, request, **kwargs):
+        response = self._adapter.send(request, **kwargs)
+        content_length = response.headers.get("Content-Length")
+        self._ledger.add_request(
+            request.url,
+            int(content_length) if content_length and content_length.isdigit() else 0,
+            getattr(response, "from_cache", False),
+        )
+        return response
+
+    def close(self):
+        self._adapter.close()
@@ -0,0 +1,294 @@
+"""
+pip_tools_compile.equivalence
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Detect impersonated systems which resolve a requirements file exactly like an already compiled
+one, so that their compiled files are written from that result instead of resolved again.
+
+The only decisions of pip and pip-tools which depend on the impersonated system are environment
+marker evaluations, which project files are usable, judged from their wheel tags and their
+``requires-python``, the ``requires-python`` of the distributions inspected, and the dependency
+cache, which pip-tools keeps per system. While the representative system is resolved, every such
+decision is recorded, along with its outcome. Another system is proven equivalent when,
+impersonating it, every recorded decision which could matter has the same outcome: the resolver,
+being deterministic, would then take the exact same path.
+
+Whether a project file is usable only matters for the versions the resolver could have picked,
+versions older than a best match, or rejected by the specifiers asked for, are not looked at.
+Inputs formatted with the Python version or the platform, or existing compiled files which differ
+between the two systems, make the proof fail, and the system is resolved on its own.
+"""
+import contextlib
+import contextvars
+import os
+import re
+import threading
+
+from pip._internal.index.package_finder import LinkEvaluator
+from pip._internal.utils.packaging import check_requires_python
+from pip._vendor.packaging.markers import Marker
+from pip._vendor.packaging.specifiers import SpecifierSet
+from pip._vendor.packaging.utils import canonicalize_name
+from pip._vendor.packaging.version import parse as parse_version
+from piptools.resolver import Resolver
+from piptools.utils import as_tuple
+from piptools.utils import is_pinned_requirement
+
+from pip_tools_compile.patching import Substitution
+
+_CURRENT_RECORDER = contextvars.ContextVar("pip_tools_compile_equivalence", default=None)
+
+_TEMPLATE_RE = re.compile(r"{(py_version|platform)}")
+
+_marker_evaluate = Marker.evaluate
+_evaluate_link = LinkEvaluator.evaluate_link
+_iter_dependencies = Resolver._iter_dependencies  # pylint: disable=protected-access
+
+
+def get_current_recorder():
+    """
+    Return the :py:class:`DecisionRecorder` recording the system dependent decisions, if any.
+    """
+    return _CURRENT_RECORDER.get()
+
+
+@contextlib.contextmanager
+def activate(recorder):
+    """
+    Make ``recorder`` record the system dependent decisions taken within this context.
+    """
+    token = _CURRENT_RECORDER.set(recorder)
+    substitutions = []
+    try:
+        if recorder is not None:
+            for substitution in _get_substitutions():
+                substitution.start()
+                substitutions.append(substitution)
+        yield recorder
+    finally:
+        while substitutions:
+            substitutions.pop().stop()
+        _CURRENT_RECORDER.reset(token)
+
+
+def _get_substitutions():
+    yield Substitution("pip._vendor.packaging.markers.Marker.evaluate", _recording_marker_evaluate)
+    yield Substitution(
+        "pip._internal.index.package_finder.LinkEvaluator.evaluate_link",
+        _recording_evaluate_link,
+    )
+    yield Substitution(
+        "pip._internal.resolution.legacy.resolver.check_requires_python",
+        _recording_check_requires_python,
+    )
+    yield Substitution(
+        "piptools.resolver.Resolver._iter_dependencies", _recording_iter_dependencies
+    )
+
+
+def _recording_marker_evaluate(self, environment=None):
+    result = _marker_evaluate(self, environment)
+    recorder = get_current_recorder()
+    if recorder is not None:
+        recorder.add_marker(str(self), environment, result)
+    return result
+
+
+def _recording_evaluate_link(self, link):
+    result = _evaluate_link(self, link)
+    recorder = get_current_recorder()
+    if recorder is not None:
+        recorder.add_link(self, link, *result)
+    return result
+
+
+def _recording_check_requires_python(requires_python, version_info):
+    result = check_requires_python(requires_python, version_info=version_info)
+    recorder = get_current_recorder()
+    if recorder is not None:
+        recorder.add_requires_python(requires_python, version_info, result)
+    return result
+
+
+def _recording_iter_dependencies(self, ireq):
+    recorder = get_current_recorder()
+    if recorder is None or ireq.constraint or not is_pinned_requirement(ireq):
+        yield from _iter_dependencies(self, ireq)
+        return
+    cached = ireq in self.dependency_cache
+    dependencies = list(_iter_dependencies(self, ireq))
+    recorder.add_dependencies(self.dependency_cache, ireq, cached)
+    yield from dependencies
+
+
+def _get_link_evaluator_key(link_evaluator):
+    # pylint: disable=protected-access
+    return (
+        link_evaluator.project_name,
+        link_evaluator._canonical_name,
+        frozenset(link_evaluator._formats),
+        link_evaluator._allow_yanked,
+        link_evaluator._ignore_requires_python,
+    )
+    # pylint: enable=protected-access
+
+
+class DecisionRecorder:
+    """
+    The outcome of every system dependent decision taken while resolving for a system.
+
+    :param tuple py_version_info: The impersonated Python version, as three integers
+    """
+
+    def __init__(self, py_version_info):
+        self.py_version_info = tuple(py_version_info[:3])
+        self.markers = {}
+        self.links = {}
+        self.requires_python = {}
+        self.best_matches = {}
+        self.dependencies = {}
+        self.pinned = set()
+        self.depcache_dir = None
+        self.resolved = False
+        self._lock = threading.Lock()
+
+    def add_marker(self, marker, environment, result):
+        key = (marker, tuple(sorted((environment or {}).items())))
+        with self._lock:
+            self.markers[key] = result
+
+    def add_link(self, link_evaluator, link, is_candidate, result):
+        key = (_get_link_evaluator_key(link_evaluator), link)
+        with self._lock:
+            self.links[key] = (is_candidate, result)
+
+    def add_requires_python(self, requires_python, version_info, result):
+        key = (requires_python, tuple(version_info))
+        with self._lock:
+            self.requires_python[key] = result
+
+    def add_best_match(self, ireq, prereleases, best_match, any_version):
+        """
+        Record that ``best_match`` was picked for ``ireq``. With ``any_version``, as when binary
+        distributions are preferred, older versions could have been picked too.
+        """
+        _, version, _ = as_tuple(best_match)
+        key = (canonicalize_name(ireq.name), str(ireq.specifier), prereleases)
+        with self._lock:
+            self.best_matches[key] = (parse_version(version), any_version)
+
+    def add_dependencies(self, depcache, ireq, cached):
+        """
+        Record the dependencies of the pinned ``ireq`` found in the pip-tools ``depcache``, and
+        whether they were read from it rather than from the distribution metadata.
+        """
+        name, version_and_extras = depcache.as_cache_key(ireq)
+        with self._lock:
+            # pylint: disable=protected-access
+            self.depcache_dir = os.path.dirname(depcache._cache_file)
+            # pylint: enable=protected-access
+            self.pinned.add((canonicalize_name(name), parse_version(as_tuple(ireq)[1])))
+            self.dependencies[(name, version_and_extras)] = (
+                tuple(depcache.cache[name][version_and_extras]),
+                cached,
+            )
+
+    def _may_pick(self, project_name, version):
+        name = canonicalize_name(project_name)
+        version = parse_version(version)
+        if (name, version) in self.pinned:
+            return True
+        for (match_name, specifier, prereleases), (best, any_version) in self.best_matches.items():
+            if match_name != name:
+                continue
+            if not list(SpecifierSet(specifier).filter([version], prereleases=prereleases)):
+                continue
+            if any_version or version >= best:
+                return True
+        return False
+
+    def get_differences(self, target_python, depcache_factory=None, hashes=False):
+        """
+        Return the decisions which could matter and have another outcome for the system
+        currently impersonated, described by the pip ``target_python``.
+
+        :param callable depcache_factory: Returns the pip-tools dependency cache of that system,
+            given the cache directory
+        :param bool hashes: Whether pip-compile generates hashes, which it computes over every
+            usable file of the pinned versions
+        """
+        py_version_info = tuple(target_python.py_version_info[:3])
+        differences = []
+        for (marker, environment), result in sorted(self.markers.items(), key=repr):
+            if _marker_evaluate(Marker(marker), dict(environment) or None) is not result:
+                differences.append("marker {!r} {}".format(marker, dict(environment)))
+        evaluators = {}
+        for (evaluator_key, link), (is_candidate, result) in sorted(
+            self.links.items(), key=lambda item: (item[0][0][0], item[0][1].url)
+        ):
+            if evaluator_key not in evaluators:
+                project_name, canonical_name, formats, allow_yanked, ignore = evaluator_key
+                evaluators[evaluator_key] = LinkEvaluator(
+                    project_name=project_name,
+                    canonical_name=canonical_name,
+                    formats=formats,
+                    target_python=target_python,
+                    allow_yanked=allow_yanked,
+                    ignore_requires_python=ignore,
+                )
+            other_is_candidate, other_result = _evaluate_link(evaluators[evaluator_key], link)
+            if other_is_candidate is is_candidate:
+                continue
+            # The version of the file, given by whichever system can use it
+            version = result if is_candidate else other_result
+            if hashes or self._may_pick(evaluator_key[0], version):
+                differences.append("usable file {}".format(link.filename))
+        for (requires_python, version_info), result in sorted(
+            self.requires_python.items(), key=str
+        ):
+            if version_info == self.py_version_info:
+                version_info = py_version_info
+            if check_requires_python(requires_python, version_info=version_info) is not result:
+                differences.append("requires-python {}".format(requires_python))
+        if self.dependencies:
+            depcache = depcache_factory(self.depcache_dir) if depcache_factory else None
+            for (name, version_and_extras), (dependencies, cached) in sorted(
+                self.dependencies.items()
+            ):
+                other = None
+                if depcache is not None:
+                    other = depcache.cache.get(name, {}).get(version_and_extras)
+                if other is None and not cached:
+                    # Read from the metadata, the recorded markers decided which ones apply
+                    continue
+                if other is None or tuple(other) != dependencies:
+                    differences.append("dependencies of {}=={}".format(name, version_and_extras))
+        return differences
+
+
+def get_template_fields(*contents):
+    """
+    Return the ``{py_version}`` and ``{platform}`` fields found in ``contents``.
+    """
+    return sorted({match for content in contents for match in _TEMPLATE_RE.findall(content)})
+
+
+def strip_header(contents):
+    """
+    Return the compiled requirements ``contents`` without the header pip-compile writes, which
+    holds the output file path.
+    """
+    lines = contents.splitlines(True)
+    idx = 0
+    while idx < len(lines) and (not lines[idx].strip() or lines[idx].startswith("#")):
+        idx += 1
+    return "".join(lines[idx:])
+
+
+def rewrite_header(contents, dest, new_dest):
+    """
+    Replace ``dest`` with ``new_dest`` in the header of the compiled requirements ``contents``.
+    """
+    body = strip_header(contents)
+    header = contents[: len(contents) - len(body)]
+    return header.replace(dest, new_dest) + body
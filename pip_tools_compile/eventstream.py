@@ -0,0 +1,267 @@
+"""
+pip_tools_compile.eventstream
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Live progress of a compile run, as newline delimited JSON events.
+
+.. code-block:: console
+
+    pip-tools-compile --events=events.ndjson requirements/static/*.in
+    pip-tools-compile --events=3 requirements/static/*.in 3>&1 >/dev/null
+
+Each line is a JSON object with an ``event`` name, the wall clock ``time``, the ``elapsed`` seconds
+since the run started and, while compiling, the ``target`` being compiled, identified by its
+:py:func:`pip_tools_compile.sharding.get_work_item_key`. The events are:
+
+``run_started``, ``run_finished``
+    The whole run, with the number of ``targets``, then the ``exitcode`` and ``duration``.
+``target_started``, ``target_finished``
+    A requirements file compiled for an impersonated system, then whether it was a ``success``,
+    its ``duration`` and the resolver ``rounds`` it took.
+``target_shared``
+    A target written from the result of an equivalent one, ``shared_from``.
+``target_resumed``
+    A target skipped by ``--resume``, compiled to ``dest`` before the run was interrupted.
+``round_started``, ``round_finished``
+    A pip-tools resolver ``round``, then its ``duration``.
+``backtracking``
+    The end of a resolution by the backtracking resolver, with its ``rounds`` and ``backtracks``.
+``fetch_started``, ``fetch_finished``
+    An HTTP request, then its ``status``, the ``bytes`` announced by the response, the
+    ``duration`` until the response headers were received, whether it came ``from_cache``, pip's
+    HTTP cache, or the ``error`` raised.
+``cache``
+    A hit, or a miss, of one of the caches, ``index-page``, ``negative``, ``result`` or
+    ``dependencies``.
+``output``
+    The compiled file written, ``changed`` or not.
+
+Events are written, and flushed, as they happen, from whichever thread they happen on.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+from pip._vendor.requests.adapters import BaseAdapter
+
+_CURRENT_STREAM = contextvars.ContextVar("pip_tools_compile_eventstream", default=None)
+_CURRENT_TARGET = contextvars.ContextVar("pip_tools_compile_eventstream_target", default=None)
+
+
+def get_current_stream():
+    """
+    Return the :py:class:`EventStream` events are written to, if any.
+    """
+    return _CURRENT_STREAM.get()
+
+
+@contextlib.contextmanager
+def activate(event_stream):
+    """
+    Write the events happening within this context to ``event_stream``, closing it when leaving
+    it.
+    """
+    token = _CURRENT_STREAM.set(event_stream)
+    try:
+        yield event_stream
+    finally:
+        _CURRENT_STREAM.reset(token)
+        if event_stream is not None:
+            event_stream.close()
+
+
+def emit(event, **fields):
+    """
+    Write ``event``, with ``fields``, to the current event stream, if any.
+    """
+    event_stream = get_current_stream()
+    if event_stream is not None:
+        event_stream.emit(event, **fields)
+
+
+def _get_file_contents(path):
+    try:
+        with open(path) as rfh:
+            return rfh.read()
+    except FileNotFoundError:
+        return None
+
+
+class _Target:
+    __slots__ = ("key", "rounds")
+
+    def __init__(self, key):
+        self.key = key
+        self.rounds = 0
+
+
+@contextlib.contextmanager
+def target(key, **fields):
+    """
+    Tag the events happening within this context with the target ``key``, framed by the
+    ``target_started`` and ``target_finished`` events.
+
+    The yielded dictionary is added to the ``target_finished`` event and can be updated while in
+    context.
+    """
+    event_stream = get_current_stream()
+    if event_stream is None:
+        yield {}
+        return
+    current = _Target(key)
+    token = _CURRENT_TARGET.set(current)
+    start = time.monotonic()
+    result = {"success": False}
+    try:
+        event_stream.emit("target_started", **fields)
+        yield result
+    finally:
+        event_stream.emit(
+            "target_finished", duration=time.monotonic() - start, rounds=current.rounds, **result
+        )
+        _CURRENT_TARGET.reset(token)
+
+
+@contextlib.contextmanager
+def resolver_round():
+    """
+    Frame a pip-tools resolver round with the ``round_started`` and ``round_finished`` events.
+    """
+    event_stream = get_current_stream()
+    if event_stream is None:
+        yield
+        return
+    current = _CURRENT_TARGET.get()
+    number = None
+    if current is not None:
+        current.rounds += 1
+        number = current.rounds
+    start = time.monotonic()
+    event_stream.emit("round_started", round=number)
+    try:
+        yield
+    finally:
+        event_stream.emit("round_finished", round=number, duration=time.monotonic() - start)
+
+
+@contextlib.contextmanager
+def watch_output(path):
+    """
+    Emit the ``output`` event, telling whether the file at ``path`` changed, when leaving this
+    context, unless an exception was raised.
+    """
+    if get_current_stream() is None:
+        yield
+        return
+    previous = _get_file_contents(path)
+    yield
+    contents = _get_file_contents(path)
+    if contents is not None:
+        emit("output", path=path, changed=contents != previous)
+
+
+class EventStream:
+    """
+    Writes events, one JSON object per line, to the text ``stream``.
+
+    :param bool close_stream: Whether :py:meth:`close` closes ``stream``
+    """
+
+    def __init__(self, stream, close_stream=False):
+        self._stream = stream
+        self._close_stream = close_stream
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    @classmethod
+    def open(cls, location):
+        """
+        Return an :py:class:`EventStream` writing to ``location``, a file path, or a file
+        descriptor number, which is left open.
+        """
+        if location.isdigit():
+            return cls(os.fdopen(int(location), "w", buffering=1, closefd=False), close_stream=True)
+        return cls(open(location, "w", buffering=1), close_stream=True)
+
+    def emit(self, event, **fields):
+        record = {"event": event, "time": time.time(), "elapsed": time.monotonic() - self._start}
+        current = _CURRENT_TARGET.get()
+        if current is not None:
+            record["target"] = current.key
+        record.update(fields)
+        line = json.dumps(record, sort_keys=True, default=str)
+        with self._lock:
+            if self._stream is None:
+                return
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None and self._close_stream:
+                self._stream.close()
+            self._stream = None
+
+    def install(self, session):
+        """
+        Wrap the HTTP(S) transport adapters of the pip ``session`` so that its requests are
+        reported, tagged with the current target, whichever thread makes them.
+        """
+        current = _CURRENT_TARGET.get()
+        for prefix, adapter in list(session.adapters.items()):
+            if prefix.startswith(("http://", "https://")):
+                session.mount(prefix, EventAdapter(self, adapter, current))
+
+
+class EventAdapter(BaseAdapter):
+    """
+    Transport adapter reporting the requests sent through the adapter it wraps.
+    """
+
+    def __init__(self, event_stream, adapter, current_target=None):
+        super().__init__()
+        self._event_stream = event_stream
+        self._adapter = adapter
+        self._target = current_target
+
+    def _emit(self, event, **fields):
+        if self._target is None:
+            self._event_stream.emit(event, **fields)
+            return
+        token = _CURRENT_TARGET.set(self._target)
+        try:
+            self._event_stream.emit(event, **fields)
+        finally:
+            _CURRENT_TARGET.reset(token)
+
+    def send(self, request, **kwargs):
+        self._emit("fetch_started", method=request.method, url=request.url)
+        start = time.monotonic()
+        try:
+            response = self._adapter.send(request, **kwargs)
+        except Exception as exc:
+            self._emit(
+                "fetch_finished",
+                method=request.method,
+                url=request.url,
+                duration=time.monotonic() - start,
+                error=str(exc),
+            )
+            raise
+        content_length = response.headers.get("Content-Length")
+        self._emit(
+            "fetch_finished",
+            method=request.method,
+            url=request.url,
+            status=response.status_code,
+            bytes=int(content_length) if content_length and content_length.isdigit() else None,
+            duration=time.monotonic() - start,
+            from_cache=getattr(response, "from_cache", False),
+        )
+        return response
+
+    def close(self):
+        self._adapter.close()
@@ -0,0 +1,261 @@
+"""
+pip_tools_compile.httparchive
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Record the HTTP traffic of compiles into an archive, and replay compiles from it, without network
+access, for repeatable runs and performance comparisons.
+
+.. code-block:: console
+
+    pip-tools-compile --clean-cache --record=traffic.zip requirements/static/*.in
+    pip-tools-compile --clean-cache --replay=traffic.zip requirements/static/*.in
+
+The archive is a zip file. Response bodies, index pages, metadata and distributions alike, are
+stored once per content, under their SHA256, so the same files fetched by a whole matrix of
+compiles are stored once, and each one is read back on its own through the zip central directory.
+Each recording adds an index member, mapping every request to the status, headers and body of its
+response, later recordings winning. Only one process should record into an archive at a time.
+
+When replaying, every HTTP(S) request is answered from the archive, pip's HTTP cache being bypassed,
+and requests which were not recorded fail at once. Recording and replaying with ``--clean-cache``
+makes both compiles go through the same requests.
+"""
+import contextlib
+import contextvars
+import hashlib
+import io
+import json
+import logging
+import posixpath
+import threading
+import urllib.parse
+import zipfile
+
+from pip._vendor.requests.adapters import BaseAdapter
+from pip._vendor.requests.adapters import HTTPAdapter
+from pip._vendor.requests.exceptions import ConnectionError
+from pip._vendor.urllib3.response import HTTPResponse
+
+log = logging.getLogger("pip-tools-compile.httparchive")
+
+_CURRENT_ARCHIVE = contextvars.ContextVar("pip_tools_compile_httparchive", default=None)
+
+# Already compressed, not worth deflating again
+COMPRESSED_EXTENSIONS = (".whl", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".egg")
+
+
+class NotRecorded(ConnectionError):
+    """
+    Raised, when replaying, for requests which are not in the archive.
+
+    pip handles it like any other connection error.
+    """
+
+
+def get_current_archive():
+    """
+    Return the :py:class:`ArchiveRecorder` or :py:class:`ArchiveReplayer` in use, if any.
+    """
+    return _CURRENT_ARCHIVE.get()
+
+
+@contextlib.contextmanager
+def activate(archive):
+    """
+    Record into, or replay from, ``archive`` within this context, the archive being opened and
+    closed around it.
+    """
+    token = _CURRENT_ARCHIVE.set(archive)
+    try:
+        if archive is None:
+            yield archive
+        else:
+            with archive:
+                yield archive
+    finally:
+        _CURRENT_ARCHIVE.reset(token)
+
+
+def _get_request_key(method, url):
+    return "{} {}".format(method, url)
+
+
+def _make_raw_response(status, reason, headers, body, decode_content=True):
+    return HTTPResponse(
+        body=io.BytesIO(body),
+        headers=headers,
+        status=status,
+        reason=reason,
+        preload_content=False,
+        decode_content=decode_content,
+    )
+
+
+def _iter_http_adapters(session):
+    for prefix, adapter in list(session.adapters.items()):
+        if prefix.startswith(("http://", "https://")):
+            yield prefix, adapter
+
+
+class ArchiveRecorder:
+    """
+    Record the HTTP(S) interactions of the pip sessions it is installed on into the archive at
+    ``path``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._zipfile = None
+        self._blobs = set()
+        self._index = {}
+
+    def __enter__(self):
+        self._zipfile = zipfile.ZipFile(self.path, "a")
+        self._blobs = {name for name in self._zipfile.namelist() if name.startswith("blobs/")}
+        self._index = {}
+        return self
+
+    def __exit__(self, *_):
+        try:
+            if self._index:
+                count = sum(1 for name in self._zipfile.namelist() if name.startswith("index/"))
+                self._zipfile.writestr(
+                    "index/{:05d}.json".format(count),
+                    json.dumps(self._index, indent=1, sort_keys=True),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+                log.info("Recorded %d HTTP interactions into %s", len(self._index), self.path)
+        finally:
+            self._zipfile.close()
+            self._zipfile = None
+
+    def record(self, method, url, status, reason, headers, body):
+        digest = hashlib.sha256(body).hexdigest()
+        blob = "blobs/{}".format(digest)
+        path = urllib.parse.urlsplit(url).path
+        if posixpath.splitext(path)[-1] in COMPRESSED_EXTENSIONS or any(
+            name.lower() == "content-encoding" for name, _ in headers
+        ):
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+        with self._lock:
+            if self._zipfile is None:
+                # A straggling prefetch thread, after the compile is over
+                return
+            if blob not in self._blobs:
+                self._zipfile.writestr(blob, body, compress_type=compress_type)
+                self._blobs.add(blob)
+            self._index[_get_request_key(method, url)] = {
+                "status": status,
+                "reason": reason,
+                "headers": headers,
+                "body": digest,
+            }
+
+    def install(self, session):
+        """
+        Wrap the HTTP(S) transport adapters of the pip ``session`` so that its traffic is recorded.
+        """
+        for prefix, adapter in _iter_http_adapters(session):
+            session.mount(prefix, RecordingAdapter(self, adapter))
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Transport adapter recording the responses of the adapter it wraps.
+    """
+
+    def __init__(self, recorder, adapter):
+        super().__init__()
+        self._recorder = recorder
+        self._adapter = adapter
+
+    def send(self, request, **kwargs):
+        response = self._adapter.send(request, **kwargs)
+        raw = response.raw
+        # Recorded as received, pip reads distributions without decoding them
+        body = raw.read(decode_content=False)
+        headers = list(raw.headers.items())
+        self._recorder.record(
+            request.method, request.url, response.status_code, response.reason, headers, body
+        )
+        response.raw = _make_raw_response(
+            response.status_code, response.reason, raw.headers, body, raw.decode_content
+        )
+        return response
+
+    def close(self):
+        self._adapter.close()
+
+
+class ArchiveReplayer:
+    """
+    Answer the HTTP(S) requests of the pip sessions it is installed on from the archive at
+    ``path``, collecting the requests which were not recorded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.misses = []
+        self._lock = threading.Lock()
+        self._zipfile = None
+        self._index = {}
+
+    def __enter__(self):
+        self._zipfile = zipfile.ZipFile(self.path)
+        self._index = {}
+        for name in sorted(self._zipfile.namelist()):
+            if name.startswith("index/"):
+                self._index.update(json.loads(self._zipfile.read(name).decode("utf-8")))
+        self.misses = []
+        return self
+
+    def __exit__(self, *_):
+        self._zipfile.close()
+        self._zipfile = None
+
+    def get(self, method, url):
+        """
+        Return the recorded ``(status, reason, headers, body)`` for the request, if any.
+        """
+        entry = self._index.get(_get_request_key(method, url))
+        if entry is None:
+            with self._lock:
+                if url not in self.misses:
+                    self.misses.append(url)
+            return None
+        body = self._zipfile.read("blobs/{}".format(entry["body"]))
+        return entry["status"], entry["reason"], entry["headers"], body
+
+    def install(self, session):
+        """
+        Replace the HTTP(S) transport adapters of the pip ``session`` by
+        :py:class:`ReplayAdapter`.
+        """
+        for prefix, _ in _iter_http_adapters(session):
+            session.mount(prefix, ReplayAdapter(self))
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Transport adapter serving the responses recorded in an archive.
+    """
+
+    def __init__(self, replayer):
+        super().__init__()
+        self._replayer = replayer
+
+    def send(self, request, **kwargs):
+        recorded = self._replayer.get(request.method, request.url)
+        if recorded is None:
+            log.debug("Not recorded: %s %s", request.method, request.url)
+            raise NotRecorded(
+                "{} {} was not recorded in {}".format(
+                    request.method, request.url, self._replayer.path
+                ),
+                request=request,
+            )
+        status, reason, headers, body = recorded
+        return self.build_response(request, _make_raw_response(status, reason, headers, body))
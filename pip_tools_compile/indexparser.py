@@ -0,0 +1,159 @@
+"""
+pip_tools_compile.indexparser
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Streaming parser for simple repository API (PEP 503) project pages.
+
+pip builds the whole ``html5lib`` document tree of a project page, and a ``Link`` for each of its
+anchors, before evaluating them. For projects with thousands of files, like ``botocore``, most of
+those links are wheels for other platforms or files whose ``requires-python`` excludes the
+impersonated Python version, and the same work is repeated for every impersonated system.
+
+Here anchors are read off the page as it is decoded and those which the impersonated system can't
+use are dropped right away, only the surviving ones become ``Link`` objects and are handed to pip
+for the complete evaluation.
+"""
+import codecs
+import html
+import html.parser
+import posixpath
+import re
+import urllib.parse
+
+from pip._internal.exceptions import InvalidWheelFilename
+from pip._internal.index.collector import _clean_link
+from pip._internal.index.collector import parse_links
+from pip._internal.models.link import Link
+from pip._internal.models.wheel import Wheel
+from pip._internal.utils.packaging import check_requires_python
+from pip._vendor.packaging.specifiers import InvalidSpecifier
+
+CHUNK_SIZE = 64 * 1024
+
+_BASE_TAG_RE = re.compile(rb"<base[\s>]", re.IGNORECASE)
+
+
+class LinkFilter:
+    """
+    Tells, from an anchor ``href`` and ``data-requires-python`` alone, which project files the
+    system impersonated by ``link_evaluator`` can't use.
+
+    Only the checks pip itself does are applied, anything else is left for pip to decide.
+
+    :param callable on_reject: Called with the file name and the reason of every rejected file
+    """
+
+    def __init__(self, link_evaluator, on_reject=None):
+        # pylint: disable=protected-access
+        target_python = link_evaluator._target_python
+        self._check_tags = "binary" in link_evaluator._formats
+        self._ignore_requires_python = link_evaluator._ignore_requires_python
+        # pylint: enable=protected-access
+        self._supported_tags = frozenset(target_python.get_tags())
+        self._py_version_info = target_python.py_version_info
+        self._requires_python = {}
+        self._on_reject = on_reject
+        self.accepted = self.rejected = 0
+
+    def _supports_python(self, requires_python):
+        try:
+            return self._requires_python[requires_python]
+        except KeyError:
+            pass
+        try:
+            supported = check_requires_python(requires_python, version_info=self._py_version_info)
+        except InvalidSpecifier:
+            # pip ignores invalid specifiers
+            supported = True
+        self._requires_python[requires_python] = supported
+        return supported
+
+    def get_rejection_reason(self, href, requires_python):
+        """
+        Return why the file at ``href`` can't be used, or ``None`` if it might be.
+        """
+        url, _, fragment = href.partition("#")
+        filename = urllib.parse.unquote(posixpath.basename(urllib.parse.urlsplit(url).path))
+        if self._check_tags and filename.endswith(".whl") and "egg=" not in fragment:
+            try:
+                wheel = Wheel(filename)
+            except InvalidWheelFilename:
+                wheel = None
+            if wheel is not None and wheel.file_tags.isdisjoint(self._supported_tags):
+                return "none of the wheel's tags match: {}".format(
+                    ", ".join(wheel.get_formatted_file_tags())
+                )
+        if (
+            requires_python
+            and not self._ignore_requires_python
+            and not self._supports_python(requires_python)
+        ):
+            return "requires-python {} does not match Python {}.{}".format(
+                requires_python, *self._py_version_info
+            )
+        return None
+
+    def accepts(self, href, requires_python):
+        reason = self.get_rejection_reason(href, requires_python)
+        if reason is None:
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        if self._on_reject is not None:
+            self._on_reject(href.partition("#")[0].rsplit("/", 1)[-1], reason)
+        return False
+
+
+class _AnchorParser(html.parser.HTMLParser):
+    def __init__(self, page_url, link_filter):
+        super().__init__(convert_charrefs=True)
+        self._page_url = page_url
+        self._link_filter = link_filter
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        href = attrs.get("href")
+        if not href:
+            return
+        # Attribute values were already unescaped, pip unescapes these a second time
+        requires_python = attrs.get("data-requires-python")
+        requires_python = html.unescape(requires_python) if requires_python else None
+        if not self._link_filter.accepts(href, requires_python):
+            return
+        yanked_reason = None
+        if "data-yanked" in attrs:
+            # A valueless data-yanked attribute still means yanked
+            yanked_reason = html.unescape(attrs["data-yanked"] or "")
+        self.links.append(
+            Link(
+                _clean_link(urllib.parse.urljoin(self._page_url, href)),
+                comes_from=self._page_url,
+                requires_python=requires_python,
+                yanked_reason=yanked_reason,
+            )
+        )
+
+
+def iter_links(page, link_filter, chunk_size=CHUNK_SIZE):
+    """
+    Yield the links of the pip ``HTMLPage`` ``page`` which ``link_filter`` accepts.
+
+    Pages with a ``<base>`` tag, which might come after the anchors it applies to, are left to
+    pip's own parser, unfiltered.
+    """
+    if _BASE_TAG_RE.search(page.content):
+        yield from parse_links(page)
+        return
+    parser = _AnchorParser(page.url, link_filter)
+    decoder = codecs.getincrementaldecoder(page.encoding or "utf-8")(errors="replace")
+    content = memoryview(page.content)
+    for offset in range(0, len(content), chunk_size):
+        parser.feed(decoder.decode(content[offset : offset + chunk_size]))
+        yield from parser.links
+        parser.links.clear()
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    yield from parser.links
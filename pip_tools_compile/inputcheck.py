@@ -0,0 +1,301 @@
+"""
+pip_tools_compile.inputcheck
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Check the direct requirements of a compile before resolving them.
+
+pip-compile parses the input files, the source, the ``--include`` files and the files they
+reference with ``-r`` and ``-c``, drops the requirements whose markers do not hold for the
+impersonated system and hands the others to the resolver, which only finds out that two of them
+can't be satisfied together, say ``boto3==1.9.121`` in an include and ``boto3>=1.9.123`` in
+another, after looking candidates up on the index. Before the resolver is created, those
+requirements are:
+
+* deduplicated, a requirement parsed several times from the same line, when a file is referenced
+  twice, is passed once;
+* grouped by normalized project name, and the version specifiers of each project checked for a
+  version satisfying them all. When there is none, the compile fails at once, before any network
+  access, naming the conflicting requirements and where they come from.
+
+The specifiers are checked against a handful of versions, the ones they mention and their closest
+neighbours, which is exact for final releases. Specifiers mentioning pre, post, development or
+local versions, or using ``===``, are left for the resolver to decide.
+
+With ``--preflight``, each direct requirement is then looked up on the index, before resolving.
+Only the index pages are read: the candidates are filtered by the tags of the impersonated system
+and the ``data-requires-python`` of their links, the way the resolver filters them. The compile
+fails at once, naming the requirements no candidate satisfies, like ``pywin32`` outside Windows.
+The requirements only satisfied by sdists are reported without failing the compile: whether an
+sdist builds for the impersonated system, like ``pyobjc`` outside macOS, is only known by building
+it. ``pip-tools-compile preflight`` checks a whole matrix of systems at once, see
+:py:mod:`pip_tools_compile.preflight`.
+"""
+import collections
+import contextlib
+import functools
+import logging
+import time
+
+from pip._vendor.packaging.utils import canonicalize_name
+from pip._vendor.packaging.version import InvalidVersion
+from pip._vendor.packaging.version import Version
+from piptools.exceptions import PipToolsError
+from piptools.utils import is_url_requirement
+
+from pip_tools_compile.patching import get_current
+from pip_tools_compile.patching import Substitution
+
+log = logging.getLogger("pip-tools-compile.inputcheck")
+
+
+class ConflictingInputs(PipToolsError):
+    """
+    Raised when no version of a project satisfies all its direct requirements.
+
+    :param list conflicts: ``(project name, requirements)`` pairs
+    """
+
+    def __init__(self, conflicts):
+        super().__init__(conflicts)
+        self.conflicts = conflicts
+
+    def __str__(self):
+        lines = []
+        for name, ireqs in self.conflicts:
+            lines.append("No version of {} satisfies all these requirements:".format(name))
+            for ireq in ireqs:
+                if ireq.comes_from is None:
+                    lines.append("  {}".format(ireq.req))
+                else:
+                    lines.append("  {} (from {})".format(ireq.req, ireq.comes_from))
+        return "\n".join(lines)
+
+
+class InfeasibleRequirements(PipToolsError):
+    """
+    Raised when no candidate of the index satisfies direct requirements on the impersonated
+    system.
+
+    :param list problems: ``(requirement, reason)`` pairs
+    """
+
+    def __init__(self, problems, system):
+        super().__init__(problems, system)
+        self.problems = problems
+        self.system = system
+
+    def __str__(self):
+        lines = ["These requirements can't be satisfied on {}:".format(self.system)]
+        for ireq, reason in self.problems:
+            if ireq.comes_from is None:
+                lines.append("  {}: {}".format(ireq.req, reason))
+            else:
+                lines.append("  {} (from {}): {}".format(ireq.req, ireq.comes_from, reason))
+        return "\n".join(lines)
+
+
+class PreflightStopped(Exception):
+    """
+    Raised to stop a compile once its direct requirements were checked.
+    """
+
+
+class PreflightReport:
+    """
+    The outcome of the preflight check of a compile.
+    """
+
+    def __init__(self):
+        self.system = None
+        self.checked = False
+        self.problems = []
+        self.sdist_only = []
+
+
+@contextlib.contextmanager
+def activate():
+    """
+    Check the direct requirements before pip-compile resolves them, within this context.
+    """
+    resolver_class = get_current("piptools.scripts.compile.Resolver")
+    with Substitution(
+        "piptools.scripts.compile.Resolver", functools.partial(_make_resolver, resolver_class)
+    ):
+        yield
+
+
+@contextlib.contextmanager
+def preflight(report, only=False):
+    """
+    Look the direct requirements up on the index before pip-compile resolves them, within this
+    context, recording the outcome in ``report``. With ``only``, the compile stops once checked.
+    """
+    if report is None:
+        yield None
+        return
+    resolver_class = get_current("piptools.scripts.compile.Resolver")
+    with Substitution(
+        "piptools.scripts.compile.Resolver",
+        functools.partial(_make_preflight_resolver, resolver_class, report, only),
+    ):
+        yield report
+
+
+def _make_preflight_resolver(resolver_class, report, only, constraints, repository, **kwargs):
+    constraints = list(constraints)
+    target_python = repository.finder.target_python
+    report.system = "{}/py{}".format(
+        ",".join(target_python.platforms or []), target_python.py_version
+    )
+    start = time.monotonic()
+    report.problems, report.sdist_only = find_infeasible(
+        constraints, repository, prereleases=kwargs.get("prereleases", False)
+    )
+    report.checked = True
+    log.info(
+        "Checked %d direct requirement(s) for %s in %.3f seconds",
+        len(constraints),
+        report.system,
+        time.monotonic() - start,
+    )
+    if report.problems:
+        raise InfeasibleRequirements(report.problems, report.system)
+    if only:
+        raise PreflightStopped()
+    return resolver_class(constraints, repository, **kwargs)
+
+
+def find_infeasible(ireqs, repository, prereleases=False):
+    """
+    Return the ``(requirement, reason)`` pairs of the direct requirements ``ireqs`` which no
+    candidate found by ``repository`` satisfies, and the requirements only sdists satisfy.
+    """
+    # pip-compile wraps the repository to prefer the pins of the existing compiled file
+    repository = getattr(repository, "repository", repository)
+    problems = []
+    sdist_only = []
+    for ireq in ireqs:
+        if ireq.constraint or ireq.editable or is_url_requirement(ireq):
+            # Constraints only apply once required, and links are not looked up on the index
+            continue
+        candidates = repository.find_all_candidates(ireq.name)
+        if not candidates:
+            problems.append((ireq, "no distribution for this system"))
+            continue
+        candidates_by_version = collections.defaultdict(list)
+        for candidate in candidates:
+            candidates_by_version[candidate.version].append(candidate)
+        matching = list(ireq.specifier.filter(candidates_by_version, prereleases=prereleases))
+        if not matching:
+            problems.append(
+                (
+                    ireq,
+                    "none of the {} version(s) for this system matches, the latest being {}".format(
+                        len(candidates_by_version), max(candidates_by_version)
+                    ),
+                )
+            )
+        elif not any(
+            candidate.link.is_wheel
+            for version in matching
+            for candidate in candidates_by_version[version]
+        ):
+            sdist_only.append(ireq)
+    return problems, sdist_only
+
+
+def _make_resolver(resolver_class, constraints, *args, **kwargs):
+    constraints = list(constraints)
+    reduced = deduplicate(constraints)
+    log.info("Resolving %d of the %d direct requirements", len(reduced), len(constraints))
+    conflicts = find_conflicts(reduced)
+    if conflicts:
+        raise ConflictingInputs(conflicts)
+    return resolver_class(reduced, *args, **kwargs)
+
+
+def _get_identity(ireq):
+    return (
+        str(ireq.comes_from),
+        str(ireq.req),
+        str(ireq.markers),
+        ireq.editable,
+        ireq.link.url if ireq.link else None,
+        ireq.constraint,
+    )
+
+
+def deduplicate(ireqs):
+    """
+    Return ``ireqs`` without the requirements parsed again from the same line.
+    """
+    seen = set()
+    unique = []
+    for ireq in ireqs:
+        identity = _get_identity(ireq)
+        if identity not in seen:
+            seen.add(identity)
+            unique.append(ireq)
+    return unique
+
+
+def _get_successor(version):
+    release = list(version.release)
+    release[-1] += 1
+    return ".".join(str(part) for part in release)
+
+
+def _get_probes(specifier_set):
+    probes = {"0"}
+    for specifier in specifier_set:
+        if specifier.operator == "===":
+            return None
+        version = specifier.version
+        if version.endswith(".*"):
+            version = version[:-2]
+        try:
+            version = Version(version)
+        except InvalidVersion:
+            return None
+        if version.is_prerelease or version.is_postrelease or version.local:
+            return None
+        probes.add(str(version))
+        # Above the version, below any other a specifier could mention
+        probes.add(version.base_version + ".0.0.0.0.1")
+        probes.add(_get_successor(version))
+    return probes
+
+
+def is_satisfiable(specifier_set):
+    """
+    Return whether a version could satisfy ``specifier_set``, ``True`` when that can't be told.
+    """
+    probes = _get_probes(specifier_set)
+    if probes is None:
+        return True
+    return any(specifier_set.contains(probe, prereleases=True) for probe in probes)
+
+
+def find_conflicts(ireqs):
+    """
+    Return the ``(project name, requirements)`` of the projects for which no version satisfies
+    all the requirements in ``ireqs``.
+    """
+    grouped = {}
+    for ireq in ireqs:
+        if ireq.name is None:
+            continue
+        grouped.setdefault(canonicalize_name(ireq.name), []).append(ireq)
+    conflicts = []
+    for name, group in sorted(grouped.items()):
+        if all(ireq.constraint for ireq in group):
+            # Only a conflict once required
+            continue
+        if any(ireq.editable or is_url_requirement(ireq) for ireq in group):
+            continue
+        specifier_set = group[0].req.specifier
+        for ireq in group[1:]:
+            specifier_set &= ireq.req.specifier
+        if not is_satisfiable(specifier_set):
+            conflicts.append((name, group))
+    return conflicts
@@ -0,0 +1,748 @@
+"""
+pip_tools_compile.localproxy
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+A caching HTTP proxy, on localhost, shared by the ``pip-tools-compile`` processes running at once.
+
+.. code-block:: console
+
+    pip-tools-compile --local-proxy --platform=linux requirements/static/ci/linux.in &
+    pip-tools-compile --local-proxy --platform=windows requirements/static/ci/windows.in &
+
+Compiles running concurrently, one process per pre-commit hook or per target, each send the same
+index page and distribution requests to the package index. With ``--local-proxy``, the first
+compile starts a proxy in the background, the others find it through the state file it writes,
+and every pip session sends its requests through it:
+
+* identical requests in flight are coalesced, a single one goes to the index and its response is
+  streamed to every requester as it arrives;
+* responses are kept on disk, and served from there for as long as the ``Cache-Control`` headers
+  of the index allow, then revalidated. pip asks for index pages to be revalidated on every
+  request, the proxy, like the CDN in front of PyPI, serves them from its cache while fresh;
+* at most ``--local-proxy-connections`` requests are sent to the index at once.
+
+The pip sessions keep their own HTTP cache. TLS verification, ``--trusted-host`` and client
+certificates are passed along with each request and applied by the proxy. The proxy exits once
+idle for ``--local-proxy-idle-timeout`` seconds. Compiles finding a proxy already running use it,
+whatever its number of connections.
+"""
+import argparse
+import contextlib
+import contextvars
+import hashlib
+import http.client
+import http.server
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from pip._internal.network.session import InsecureCacheControlAdapter
+from pip._internal.network.session import InsecureHTTPAdapter
+from pip._vendor import requests
+from pip._vendor.cachecontrol.adapter import CacheControlAdapter
+from pip._vendor.requests.adapters import HTTPAdapter
+from pip._vendor.requests.structures import CaseInsensitiveDict
+from piptools.locations import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows, concurrent compiles may start a proxy each, the last one started is used
+    fcntl = None
+
+log = logging.getLogger("pip-tools-compile.localproxy")
+
+_CURRENT_PROXY = contextvars.ContextVar("pip_tools_compile_localproxy", default=None)
+
+DEFAULT_CONNECTIONS = 8
+DEFAULT_IDLE_TIMEOUT = 60
+
+UPSTREAM_HEADER = "X-Pip-Tools-Compile-Upstream"
+VERIFY_HEADER = "X-Pip-Tools-Compile-Verify"
+CERT_HEADER = "X-Pip-Tools-Compile-Cert"
+SOURCE_HEADER = "X-Pip-Tools-Compile-Proxy"
+
+# The request headers sent on to the index, and which select the cached response
+FORWARDED_HEADERS = ("Accept", "Authorization", "User-Agent")
+CACHEABLE_STATUSES = (200, 203, 300, 301, 308, 404, 410)
+# Not passed back to the pip sessions, bodies are stored decoded
+DROPPED_HEADERS = frozenset(
+    (
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+        "content-encoding",
+        "content-length",
+    )
+)
+REVALIDATION_HEADERS = ("cache-control", "date", "etag", "expires", "last-modified", "age")
+
+CHUNK_SIZE = 64 * 1024
+STARTUP_TIMEOUT = 30
+# Seconds without a byte from the index before giving up on it
+UPSTREAM_TIMEOUT = 60
+# The proxy gives up on the index first, pip's own, shorter, timeout would count the time spent
+# waiting for a connection to the index
+LOCAL_TIMEOUT = (5, UPSTREAM_TIMEOUT * 5)
+
+
+class ProxyUnavailable(RuntimeError):
+    """
+    Raised when the local proxy can't be started.
+    """
+
+
+def get_current_proxy():
+    """
+    Return the URL of the local proxy the pip sessions send their requests through, if any.
+    """
+    return _CURRENT_PROXY.get()
+
+
+@contextlib.contextmanager
+def activate(proxy_url):
+    """
+    Send the requests of the pip sessions created within this context through the local proxy at
+    ``proxy_url``.
+    """
+    token = _CURRENT_PROXY.set(proxy_url)
+    try:
+        yield proxy_url
+    finally:
+        _CURRENT_PROXY.reset(token)
+
+
+def get_proxy_dir():
+    """
+    Return the directory holding the state file, the log and the cache of the local proxy.
+    """
+    return os.path.join(CACHE_DIR, "proxy")
+
+
+class ProxyAdapter(HTTPAdapter):
+    """
+    Transport adapter sending every request to the local proxy at ``proxy_url``, which fetches the
+    requested URL.
+
+    :param bool insecure: Whether the adapter it replaces skipped TLS verification, for a
+                          ``--trusted-host``
+    """
+
+    def __init__(self, proxy_url, insecure=False, **kwargs):
+        self.proxy_url = proxy_url
+        self.insecure = insecure
+        super().__init__(**kwargs)
+
+    def get_connection(self, url, proxies=None):
+        return self.poolmanager.connection_from_url(self.proxy_url)
+
+    def request_url(self, request, proxies):
+        return "/"
+
+    def cert_verify(self, conn, url, verify, cert):
+        # The proxy verifies the index
+        pass
+
+    def add_headers(self, request, verify=True, cert=None, **kwargs):
+        # Redirects copy the headers of the previous request, always overwrite them
+        request.headers[UPSTREAM_HEADER] = request.url
+        if self.insecure or verify is False:
+            request.headers[VERIFY_HEADER] = "0"
+        elif verify is True:
+            request.headers[VERIFY_HEADER] = "1"
+        else:
+            request.headers[VERIFY_HEADER] = os.path.abspath(verify)
+        if cert:
+            request.headers[CERT_HEADER] = json.dumps(cert)
+        else:
+            request.headers.pop(CERT_HEADER, None)
+
+    def send(self, request, **kwargs):
+        kwargs["timeout"] = LOCAL_TIMEOUT
+        return super().send(request, **kwargs)
+
+
+class CachingProxyAdapter(CacheControlAdapter, ProxyAdapter):
+    """
+    :py:class:`ProxyAdapter` keeping pip's HTTP cache.
+    """
+
+
+def install(session, proxy_url):
+    """
+    Replace the HTTP(S) transport adapters of the pip ``session`` by adapters sending its requests
+    through the local proxy at ``proxy_url``.
+    """
+    for prefix, adapter in list(session.adapters.items()):
+        if not prefix.startswith(("http://", "https://")):
+            continue
+        insecure = isinstance(adapter, (InsecureHTTPAdapter, InsecureCacheControlAdapter))
+        if isinstance(adapter, CacheControlAdapter):
+            proxy_adapter = CachingProxyAdapter(
+                cache=adapter.cache,
+                proxy_url=proxy_url,
+                insecure=insecure,
+                max_retries=adapter.max_retries,
+            )
+        else:
+            proxy_adapter = ProxyAdapter(
+                proxy_url, insecure=insecure, max_retries=adapter.max_retries
+            )
+        session.mount(prefix, proxy_adapter)
+
+
+def _get_state_path(proxy_dir):
+    return os.path.join(proxy_dir, "proxy.json")
+
+
+def _read_state(proxy_dir):
+    try:
+        with open(_get_state_path(proxy_dir)) as rfh:
+            return json.load(rfh)
+    except (OSError, ValueError):
+        return None
+
+
+def _ping(proxy_url):
+    host, port = proxy_url.rsplit("/", 1)[-1].rsplit(":", 1)
+    connection = http.client.HTTPConnection(host, int(port), timeout=5)
+    try:
+        connection.request("GET", "/__ping__")
+        return connection.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        connection.close()
+
+
+def get_running_proxy(proxy_dir):
+    """
+    Return the URL of the local proxy running for ``proxy_dir``, if it answers.
+    """
+    state = _read_state(proxy_dir)
+    if state is not None and _ping(state["url"]):
+        return state["url"]
+    return None
+
+
+@contextlib.contextmanager
+def _exclusive(proxy_dir):
+    with open(os.path.join(proxy_dir, "proxy.lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+# Started proxies outlive this process, keep them referenced to not be warned about them
+_STARTED = []
+
+
+def _start(proxy_dir, connections, idle_timeout):
+    cmd = [
+        sys.executable,
+        "-m",
+        "pip_tools_compile",
+        "proxy",
+        "--proxy-dir={}".format(proxy_dir),
+        "--connections={}".format(connections),
+        "--idle-timeout={}".format(idle_timeout),
+    ]
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    log.info("Starting the local proxy: %s", cmd)
+    with open(os.path.join(proxy_dir, "proxy.log"), "a") as log_file:
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, **kwargs
+        )
+    _STARTED.append(process)
+    return process
+
+
+def ensure_proxy(proxy_dir, connections=DEFAULT_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """
+    Return the URL of the local proxy running for ``proxy_dir``, starting it unless already
+    running.
+    """
+    os.makedirs(proxy_dir, exist_ok=True)
+    proxy_url = get_running_proxy(proxy_dir)
+    if proxy_url is not None:
+        return proxy_url
+    with _exclusive(proxy_dir):
+        # Another compile might have started it meanwhile
+        proxy_url = get_running_proxy(proxy_dir)
+        if proxy_url is not None:
+            return proxy_url
+        process = _start(proxy_dir, connections, idle_timeout)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            state = _read_state(proxy_dir)
+            if state is not None and state["pid"] == process.pid and _ping(state["url"]):
+                return state["url"]
+            if process.poll() is not None:
+                raise ProxyUnavailable(
+                    "The local proxy exited with code {}, see {}".format(
+                        process.returncode, os.path.join(proxy_dir, "proxy.log")
+                    )
+                )
+            time.sleep(0.1)
+        process.kill()
+        raise ProxyUnavailable(
+            "The local proxy did not start within {} seconds".format(STARTUP_TIMEOUT)
+        )
+
+
+def _get_cache_key(method, url, headers, verify=True, cert=None):
+    # A response fetched without verifying the index, or with another CA bundle or client
+    # certificate, is not handed to the sessions which configured theirs
+    parts = [
+        method,
+        url,
+        headers.get("Accept", ""),
+        headers.get("Authorization", ""),
+        json.dumps(verify),
+        json.dumps(cert),
+    ]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _get_expires(method, status, headers):
+    """
+    Return until when a response can be served from the cache, ``None`` if it must not be cached.
+    """
+    if method != "GET" or status not in CACHEABLE_STATUSES:
+        return None
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().lower().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    max_age = 0
+    if "no-cache" not in directives:
+        for name in ("s-maxage", "max-age"):
+            if directives.get(name, "").isdigit():
+                max_age = int(directives[name])
+                break
+    age = headers.get("Age", "")
+    if age.isdigit():
+        max_age -= int(age)
+    # Without a lifetime, the response is still kept for its validators
+    return time.time() + max(0, max_age)
+
+
+class ResponseCache:
+    """
+    The responses of the index, in ``directory``.
+
+    Every response is described by a JSON file, its body stored in a file of its own, which is
+    never rewritten, for requesters being streamed a previous version of it. Bodies of the
+    responses which can't be cached are stored in the ``tmp`` directory, cleared by
+    :py:meth:`clear_tmp`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tmp_dir = os.path.join(directory, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _get_meta_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """
+        Return the description of the response cached under ``key``, if its body is there.
+        """
+        try:
+            with open(self._get_meta_path(key)) as rfh:
+                meta = json.load(rfh)
+        except (OSError, ValueError):
+            return None
+        meta["path"] = os.path.join(self.directory, key[:2], meta["body"])
+        if not os.path.exists(meta["path"]):
+            return None
+        return meta
+
+    def new_body_path(self, key, cacheable):
+        filename = "{}-{}.body".format(key, uuid.uuid4().hex)
+        if not cacheable:
+            return os.path.join(self.tmp_dir, filename)
+        os.makedirs(os.path.join(self.directory, key[:2]), exist_ok=True)
+        return os.path.join(self.directory, key[:2], filename)
+
+    def put(self, key, meta):
+        """
+        Store the description of the response cached under ``key``, forgetting the previous one.
+        """
+        previous = self.get(key)
+        meta_path = self._get_meta_path(key)
+        tmp_path = "{}.{}.tmp".format(meta_path, uuid.uuid4().hex)
+        with open(tmp_path, "w") as wfh:
+            json.dump({name: value for name, value in meta.items() if name != "path"}, wfh)
+        os.replace(tmp_path, meta_path)
+        if previous is not None and previous["body"] != meta["body"]:
+            try:
+                os.remove(previous["path"])
+            except OSError:
+                # Still being read, on Windows
+                pass
+
+    def clear_tmp(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+
+class _Download:
+    """
+    A response, streamed to every requester from its body file as it is written.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.meta = None
+        self.size = 0
+        self.complete = False
+        self.error = None
+
+    @classmethod
+    def cached(cls, meta):
+        download = cls()
+        download.meta = meta
+        download.size = os.path.getsize(meta["path"])
+        download.complete = True
+        return download
+
+    def start(self, meta):
+        with self._condition:
+            self.meta = meta
+            self._condition.notify_all()
+
+    def add(self, size):
+        with self._condition:
+            self.size += size
+            self._condition.notify_all()
+
+    def finish(self, meta=None):
+        with self._condition:
+            if meta is not None:
+                self.meta = meta
+                self.size = os.path.getsize(meta["path"])
+            self.complete = True
+            self._condition.notify_all()
+
+    def fail(self, error):
+        with self._condition:
+            self.error = error
+            self._condition.notify_all()
+
+    def wait_meta(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.meta is not None or self.error is not None)
+            if self.meta is None:
+                raise self.error
+            return self.meta
+
+    def wait_data(self, offset):
+        """
+        Wait for the body to grow past ``offset``, return its size, whether it is complete and the
+        error which interrupted it, if any.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.size > offset or self.complete or self.error is not None
+            )
+            return self.size, self.complete, self.error
+
+
+class ProxyServer(http.server.ThreadingHTTPServer):
+    """
+    The local proxy, caching its responses in ``proxy_dir``, sending at most ``connections``
+    requests to the index at once.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, proxy_dir, connections=DEFAULT_CONNECTIONS, address=("127.0.0.1", 0)):
+        super().__init__(address, ProxyRequestHandler)
+        self.cache = ResponseCache(os.path.join(proxy_dir, "cache"))
+        self.upstream = requests.Session()
+        adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+        self.upstream.mount("http://", adapter)
+        self.upstream.mount("https://", adapter)
+        self.upstream_slots = threading.BoundedSemaphore(connections)
+        self.stats = {"hit": 0, "miss": 0, "coalesced": 0, "revalidated": 0}
+        self._lock = threading.Lock()
+        self._downloads = {}
+        self._active = 0
+        self._last_activity = time.monotonic()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    @contextlib.contextmanager
+    def serving(self):
+        """
+        Count a request being served within this context.
+        """
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_activity = time.monotonic()
+
+    def get_idle_time(self):
+        with self._lock:
+            if self._active or self._downloads:
+                return 0
+            return time.monotonic() - self._last_activity
+
+    def get(self, method, url, headers, verify=True, cert=None):
+        """
+        Return the :py:class:`_Download` of the response to the request, and where it came from,
+        ``hit``, ``coalesced`` or ``miss``.
+        """
+        key = _get_cache_key(method, url, headers, verify=verify, cert=cert)
+        cached = self.cache.get(key)
+        with self._lock:
+            if cached is not None and cached["expires"] > time.time():
+                self.stats["hit"] += 1
+                return _Download.cached(cached), "hit"
+            download = self._downloads.get(key)
+            if download is not None:
+                self.stats["coalesced"] += 1
+                return download, "coalesced"
+            self.stats["miss"] += 1
+            download = self._downloads[key] = _Download()
+        thread = threading.Thread(
+            target=self._fetch,
+            args=(key, download, method, url, headers, verify, cert, cached),
+            daemon=True,
+        )
+        thread.start()
+        return download, "miss"
+
+    def _fetch(self, key, download, method, url, headers, verify, cert, cached):
+        meta = None
+        try:
+            headers = dict(headers)
+            if cached is not None:
+                cached_headers = CaseInsensitiveDict(cached["headers"])
+                if "ETag" in cached_headers:
+                    headers["If-None-Match"] = cached_headers["ETag"]
+                if "Last-Modified" in cached_headers:
+                    headers["If-Modified-Since"] = cached_headers["Last-Modified"]
+            with self.upstream_slots:
+                log.debug("Fetching %s %s", method, url)
+                with self.upstream.request(
+                    method,
+                    url,
+                    headers=headers,
+                    verify=verify,
+                    cert=cert,
+                    allow_redirects=False,
+                    stream=True,
+                    timeout=UPSTREAM_TIMEOUT,
+                ) as response:
+                    if response.status_code == 304 and cached is not None:
+                        meta = self._revalidate(key, cached, response)
+                        download.finish(meta)
+                        return
+                    expires = _get_expires(method, response.status_code, response.headers)
+                    meta = {
+                        "url": url,
+                        "status": response.status_code,
+                        "reason": response.reason,
+                        "headers": [
+                            [name, value]
+                            for name, value in response.headers.items()
+                            if name.lower() not in DROPPED_HEADERS
+                        ],
+                        "expires": expires,
+                    }
+                    meta["path"] = self.cache.new_body_path(key, expires is not None)
+                    meta["body"] = os.path.basename(meta["path"])
+                    with open(meta["path"], "wb") as wfh:
+                        download.start(meta)
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            wfh.write(chunk)
+                            wfh.flush()
+                            download.add(len(chunk))
+            if expires is not None:
+                self.cache.put(key, meta)
+            download.finish()
+        except Exception as exc:  # pylint: disable=broad-except
+            log.warning("Fetching %s failed: %s", url, exc)
+            download.fail(exc)
+            if meta is not None and meta.get("path") and not download.complete:
+                try:
+                    os.remove(meta["path"])
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._downloads.pop(key, None)
+
+    def _revalidate(self, key, cached, response):
+        headers = CaseInsensitiveDict(cached["headers"])
+        for name in REVALIDATION_HEADERS:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        meta = dict(cached, headers=[[name, value] for name, value in headers.items()])
+        meta["expires"] = _get_expires("GET", cached["status"], headers) or time.time()
+        self.cache.put(key, meta)
+        with self._lock:
+            self.stats["revalidated"] += 1
+        return meta
+
+
+class ProxyRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.serving():
+            self._proxy()
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug(format, *args)
+
+    def _proxy(self):
+        if self.path == "/__ping__":
+            self._send_body(200, b"pip-tools-compile proxy\n")
+            return
+        url = self.headers.get(UPSTREAM_HEADER)
+        if not url:
+            self.send_error(400, "Missing the {} header".format(UPSTREAM_HEADER))
+            return
+        verify = self.headers.get(VERIFY_HEADER, "1")
+        verify = {"0": False, "1": True}.get(verify, verify)
+        cert = self.headers.get(CERT_HEADER)
+        if cert is not None:
+            cert = json.loads(cert)
+            if isinstance(cert, list):
+                cert = tuple(cert)
+        headers = {name: self.headers[name] for name in FORWARDED_HEADERS if name in self.headers}
+        download, source = self.server.get(self.command, url, headers, verify=verify, cert=cert)
+        try:
+            meta = download.wait_meta()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.send_error(502, "Fetching {} failed: {}".format(url, exc))
+            return
+        self.send_response(meta["status"], meta["reason"])
+        for name, value in meta["headers"]:
+            self.send_header(name, value)
+        self.send_header(SOURCE_HEADER, source)
+        chunked = not download.complete and self.command != "HEAD"
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(download.size))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        offset = 0
+        with open(meta["path"], "rb") as rfh:
+            while True:
+                size, complete, error = download.wait_data(offset)
+                if size > offset:
+                    data = rfh.read(min(CHUNK_SIZE, size - offset))
+                    offset += len(data)
+                    if chunked:
+                        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+                    else:
+                        self.wfile.write(data)
+                elif error is not None:
+                    # Let pip see a truncated response
+                    self.close_connection = True
+                    return
+                elif complete:
+                    break
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _write_state(proxy_dir, state):
+    tmp_path = "{}.{}.tmp".format(_get_state_path(proxy_dir), os.getpid())
+    with open(tmp_path, "w") as wfh:
+        json.dump(state, wfh)
+    os.replace(tmp_path, _get_state_path(proxy_dir))
+
+
+def serve(proxy_dir, connections=DEFAULT_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """
+    Run the local proxy for ``proxy_dir`` until idle for ``idle_timeout`` seconds.
+    """
+    os.makedirs(proxy_dir, exist_ok=True)
+    server = ProxyServer(proxy_dir, connections=connections)
+    server.cache.clear_tmp()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _write_state(proxy_dir, {"url": server.url, "pid": os.getpid()})
+    log.info("Serving on %s, caching in %s", server.url, proxy_dir)
+    try:
+        while server.get_idle_time() < idle_timeout:
+            time.sleep(0.5)
+        log.info("Idle for %s seconds, exiting", idle_timeout)
+    finally:
+        state = _read_state(proxy_dir)
+        if state is not None and state["pid"] == os.getpid():
+            os.remove(_get_state_path(proxy_dir))
+        server.shutdown()
+        server.server_close()
+        server.cache.clear_tmp()
+        log.info("Served %s", ", ".join("{} {}".format(v, k) for k, v in server.stats.items()))
+
+
+def get_proxy_parser():
+    parser = argparse.ArgumentParser(
+        prog="pip-tools-compile proxy",
+        description=(
+            "Run the local caching proxy started by 'pip-tools-compile --local-proxy', in the "
+            "foreground"
+        ),
+    )
+    parser.add_argument("--proxy-dir", default=get_proxy_dir())
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--idle-timeout", type=int, default=DEFAULT_IDLE_TIMEOUT)
+    return parser
+
+
+def main(argv):
+    options = get_proxy_parser().parse_args(argv)
+    # Log to stderr, not to the in memory log of the compiles
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)-8s] %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    # Clean up on termination too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    serve(options.proxy_dir, connections=options.connections, idle_timeout=options.idle_timeout)
+    return 0
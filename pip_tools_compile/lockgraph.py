@@ -0,0 +1,221 @@
+"""
+pip_tools_compile.lockgraph
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Machine readable lock graph written next to a compiled requirements file.
+
+The compiled ``.txt`` is meant for ``pip install -r``, tools which need the dependency graph would
+have to parse the ``# via`` annotations back. The lock graph holds the same pins, with their
+hashes, markers and extras, the dependency edges between them, the requirements files which asked
+for them and the impersonated system, along with an install order grouping packages in levels,
+where every package only depends on packages of the previous levels, suitable for parallel
+``pip install --no-deps``.
+
+.. code-block:: json
+
+    {
+     "__format__": 1,
+     "edges": [["boto3", "botocore"], ["boto3", "jmespath"]],
+     "install_order": [["jmespath", "..."], ["botocore"], ["boto3"]],
+     "packages": {
+      "boto3": {
+       "editable": false,
+       "excluded": false,
+       "extras": [],
+       "hashes": [],
+       "link": null,
+       "marker": null,
+       "name": "boto3",
+       "required_by": ["-r requirements/base.in"],
+       "unsafe": false,
+       "version": "1.9.121"
+      }
+     },
+     "passthrough": [],
+     "profile": {"machine": null, "platform": "linux", "py_version": "3.7"},
+     "source": "requirements/base.in"
+    }
+"""
+import contextlib
+import contextvars
+import json
+import re
+
+from pip._vendor.packaging.utils import canonicalize_name
+from piptools.utils import key_from_ireq
+from piptools.utils import UNSAFE_PACKAGES
+from piptools.writer import _comes_from_as_string
+
+LOCK_GRAPH_FORMAT = 1
+
+_CURRENT_RECORDER = contextvars.ContextVar("pip_tools_compile_lock_graph", default=None)
+
+_REQUIREMENT_NAME_RE = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def get_current_recorder():
+    """
+    Return the :py:class:`LockGraphRecorder` collecting the resolver results, if any.
+    """
+    return _CURRENT_RECORDER.get()
+
+
+@contextlib.contextmanager
+def activate(recorder):
+    """
+    Make ``recorder`` collect the resolver results within this context.
+    """
+    token = _CURRENT_RECORDER.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _CURRENT_RECORDER.reset(token)
+
+
+def lock_graph_path_for(dest):
+    """
+    Return the path of the lock graph for the compiled requirements file ``dest``.
+    """
+    if dest.endswith(".txt"):
+        dest = dest[:-4]
+    return dest + ".lock.json"
+
+
+def get_required_by(ireq):
+    """
+    Return what required ``ireq``, the same sources as the ``# via`` annotations of the compiled
+    file: requirements files, as ``-r <path>``, or package keys.
+    """
+    if hasattr(ireq, "_source_ireqs"):
+        return {
+            _comes_from_as_string(src_ireq)
+            for src_ireq in ireq._source_ireqs  # pylint: disable=protected-access
+            if src_ireq.comes_from
+        }
+    if ireq.comes_from:
+        return {_comes_from_as_string(ireq)}
+    return set()
+
+
+class LockGraphRecorder:
+    """
+    Collects what pip-tools writes to the compiled requirements file.
+    """
+
+    def __init__(self):
+        self.packages = None
+
+    def record(self, results, unsafe_requirements, markers, hashes, allow_unsafe):
+        unsafe_requirements = set(unsafe_requirements or ()) or {
+            ireq for ireq in results if ireq.name in UNSAFE_PACKAGES
+        }
+        unsafe_keys = {key_from_ireq(ireq) for ireq in unsafe_requirements}
+        hashes = hashes or {}
+        self.packages = {}
+        for ireq in set(results) | unsafe_requirements:
+            key = key_from_ireq(ireq)
+            unsafe = key in unsafe_keys
+            if unsafe and not allow_unsafe:
+                # Only listed as a comment in the compiled file
+                continue
+            version = None
+            if not ireq.editable and not ireq.original_link:
+                version = str(ireq.specifier).lstrip("=")
+            marker = markers.get(key)
+            self.packages[key] = {
+                "name": ireq.name,
+                "version": version,
+                "link": ireq.link.url if ireq.link and version is None else None,
+                "editable": bool(ireq.editable),
+                "extras": sorted(ireq.extras),
+                "marker": str(marker) if marker else None,
+                "hashes": sorted(hashes.get(ireq) or ()),
+                "required_by": sorted(get_required_by(ireq)),
+                "unsafe": unsafe,
+                "excluded": False,
+            }
+
+
+def get_install_order(packages, edges):
+    """
+    Group the ``packages`` keys in levels where every package only depends on packages from the
+    previous levels. Packages part of a dependency cycle end up together in the last level.
+    """
+    remaining = {key for key, package in packages.items() if not package["excluded"]}
+    dependencies = {key: set() for key in remaining}
+    for parent, child in edges:
+        if parent in remaining and child in remaining:
+            dependencies[parent].add(child)
+    levels = []
+    while remaining:
+        level = sorted(key for key in remaining if not dependencies[key] & remaining)
+        if not level:
+            level = sorted(remaining)
+        levels.append(level)
+        remaining.difference_update(level)
+    return levels
+
+
+def build_lock_graph(recorder, source, profile, passthrough=()):
+    """
+    Return the lock graph, as a dictionary, from what ``recorder`` collected.
+    """
+    packages = recorder.packages or {}
+    edges = sorted(
+        {
+            (parent, key)
+            for key, package in packages.items()
+            for parent in package["required_by"]
+            if parent in packages
+        }
+    )
+    return {
+        "__format__": LOCK_GRAPH_FORMAT,
+        "source": source,
+        "profile": profile,
+        "packages": packages,
+        "edges": [list(edge) for edge in edges],
+        "install_order": get_install_order(packages, edges),
+        "passthrough": list(passthrough),
+    }
+
+
+def read_lock_graph(path):
+    with open(path) as rfh:
+        return json.load(rfh)
+
+
+def write_lock_graph(graph, path):
+    with open(path, "w") as wfh:
+        json.dump(graph, wfh, indent=1, sort_keys=True)
+        wfh.write("\n")
+
+
+def get_pinned_names(compiled_path):
+    """
+    Return the canonical names of the requirements which are not commented out in
+    ``compiled_path``.
+    """
+    names = set()
+    with open(compiled_path) as rfh:
+        for line in rfh:
+            match = _REQUIREMENT_NAME_RE.match(line)
+            if match:
+                names.add(canonicalize_name(match.group(1)))
+    return names
+
+
+def sync_excluded(graph_path, compiled_path):
+    """
+    Flag the packages whose line was commented out of ``compiled_path`` as excluded, and drop them
+    from the install order.
+    """
+    graph = read_lock_graph(graph_path)
+    pinned_names = get_pinned_names(compiled_path)
+    packages = graph["packages"]
+    for package in packages.values():
+        if package["version"] is not None:
+            package["excluded"] = canonicalize_name(package["name"]) not in pinned_names
+    graph["install_order"] = get_install_order(packages, graph["edges"])
+    write_lock_graph(graph, graph_path)
+    return graph
@@ -0,0 +1,240 @@
+"""
+pip_tools_compile.multiindex
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Concurrent lookups of a project on every configured index.
+
+With an ``--index-url`` and ``--extra-index-url`` options, pip fetches the project page of every
+index one after the other, for every project, even though most projects only exist on one of
+them. As soon as pip asks for the page of a project on the first index, the pages of that project
+on all the indexes are requested concurrently, pip then picking them up in its usual order.
+
+Indexes answering that a project does not exist, a 404, are remembered in a persistent cache,
+shared by all the impersonated systems, and are not asked for that project again until the entry
+expires. Projects do get published on an index from time to time, hence the expiry.
+"""
+import concurrent.futures
+import contextlib
+import contextvars
+import errno
+import json
+import logging
+import os
+import threading
+import time
+
+from pip._internal.models.link import Link
+from pip._vendor.packaging.utils import canonicalize_name
+
+from pip_tools_compile import patching
+
+CACHE_FORMAT = 1
+
+DEFAULT_TTL = 24 * 60 * 60
+
+log = logging.getLogger("pip-tools-compile.multiindex")
+
+_CURRENT_SETTINGS = contextvars.ContextVar("pip_tools_compile_multiindex", default=None)
+
+
+def get_current_settings():
+    """
+    Return the :py:class:`MultiIndexSettings` in effect, if any.
+    """
+    return _CURRENT_SETTINGS.get()
+
+
+@contextlib.contextmanager
+def activate(settings):
+    """
+    Query the indexes concurrently, with ``settings``, within this context.
+
+    Fetchers created within this context are shut down when leaving it.
+    """
+    token = _CURRENT_SETTINGS.set(settings)
+    try:
+        yield settings
+    finally:
+        _CURRENT_SETTINGS.reset(token)
+        if settings is not None:
+            settings.close()
+
+
+class AbsenceCache:
+    """
+    Persistent ``index URL => project name => expiry timestamp`` mapping of the projects an index
+    does not carry.
+
+    :param str cache_file: Where the cache is stored
+    :param int ttl: How many seconds an absence is remembered
+    """
+
+    def __init__(self, cache_file, ttl=DEFAULT_TTL):
+        self._cache_file = cache_file
+        self._ttl = ttl
+        self._cache = None
+        self._changed = False
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = self._read_cache_file()
+        return self._cache
+
+    def _read_cache_file(self):
+        try:
+            with open(self._cache_file) as rfh:
+                doc = json.load(rfh)
+            if doc["__format__"] != CACHE_FORMAT:
+                raise ValueError("Unknown cache file format")
+            return doc["entries"]
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        except (ValueError, KeyError):
+            log.warning("Ignoring corrupt index absence cache file %s", self._cache_file)
+        return {}
+
+    def write_cache(self):
+        """
+        Write the entries added since the cache was read, merged with the ones other processes
+        might have written in the meantime, dropping the expired ones.
+        """
+        if not self._changed:
+            return
+        now = time.time()
+        entries = self._read_cache_file()
+        for index_url, projects in self.cache.items():
+            entries.setdefault(index_url, {}).update(projects)
+        entries = {
+            index_url: {name: expiry for name, expiry in projects.items() if expiry > now}
+            for index_url, projects in entries.items()
+        }
+        doc = {"__format__": CACHE_FORMAT, "entries": entries}
+        os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+        # Concurrent readers never see a partially written file
+        tmp_file = "{}.{}.{}.tmp".format(self._cache_file, os.getpid(), threading.get_ident())
+        with open(tmp_file, "w") as wfh:
+            json.dump(doc, wfh, sort_keys=True)
+        os.replace(tmp_file, self._cache_file)
+        self._changed = False
+
+    def clear(self):
+        self._cache = {}
+        self._changed = False
+        if os.path.exists(self._cache_file):
+            os.unlink(self._cache_file)
+
+    def is_absent(self, index_url, project_name):
+        if self._ttl <= 0:
+            return False
+        expiry = self.cache.get(index_url, {}).get(canonicalize_name(project_name))
+        return expiry is not None and expiry > time.time()
+
+    def add(self, index_url, project_name):
+        if self._ttl <= 0:
+            return
+        expiry = time.time() + self._ttl
+        self.cache.setdefault(index_url, {})[canonicalize_name(project_name)] = expiry
+        self._changed = True
+
+
+class MultiIndexSettings:
+    """
+    How the indexes are queried.
+
+    :param int ttl: How many seconds an index which does not carry a project is not asked for it
+        again, ``0`` disables the absence cache
+    :param bool clean: Discard the absence cache before using it
+    """
+
+    __slots__ = ("ttl", "clean", "_fetchers")
+
+    def __init__(self, ttl=DEFAULT_TTL, clean=False):
+        self.ttl = ttl
+        self.clean = clean
+        self._fetchers = []
+
+    def create_fetcher(self, link_collector, cache_file):
+        fetcher = MultiIndexFetcher(self, link_collector, cache_file)
+        self._fetchers.append(fetcher)
+        return fetcher
+
+    def close(self):
+        while self._fetchers:
+            self._fetchers.pop().shutdown()
+
+
+class MultiIndexFetcher:
+    """
+    Fetches the project pages of all the indexes of the pip ``link_collector`` concurrently.
+    """
+
+    def __init__(self, settings, link_collector, cache_file):
+        self._link_collector = link_collector
+        self._search_scope = link_collector.search_scope
+        self._session = link_collector.session
+        self._absences = AbsenceCache(cache_file, ttl=settings.ttl)
+        if settings.clean:
+            self._absences.clear()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(self._search_scope.index_urls), 1),
+            thread_name_prefix="pip-tools-compile-multiindex",
+        )
+        self._lock = threading.Lock()
+        self._futures = {}
+        # project URL => (index URL, project name), for the project pages being fetched
+        self._project_urls = {}
+        self._session.hooks["response"].append(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        if response.status_code != 404 or response.request.method != "GET":
+            return response
+        with self._lock:
+            location = self._project_urls.get(response.request.url)
+            if location is not None:
+                log.debug("%s is not on %s", location[1], location[0])
+                self._absences.add(*location)
+        return response
+
+    def _schedule(self, project_name):
+        # Under the lock
+        locations = self._search_scope.get_index_urls_locations(project_name)
+        for index_url, project_url in zip(self._search_scope.index_urls, locations):
+            # The same link pip builds, and only when pip would fetch it
+            link = Link(project_url, cache_link_parsing=False)
+            if project_url in self._project_urls or not self._session.is_secure_origin(link):
+                continue
+            self._project_urls[project_url] = (index_url, project_name)
+            if self._absences.is_absent(index_url, project_name):
+                continue
+            self._futures[project_url] = patching.submit(
+                self._executor, self._link_collector.fetch_page, link
+            )
+
+    def fetch_page(self, project_url, project_name):
+        """
+        Return the pip ``HTMLPage`` of ``project_name`` at ``project_url``, ``None`` if the index
+        does not carry it.
+        """
+        with self._lock:
+            if project_url.url not in self._project_urls:
+                self._schedule(project_name)
+            index_url, _ = self._project_urls.get(project_url.url, (None, None))
+            if index_url is not None and self._absences.is_absent(index_url, project_name):
+                log.debug("Skipping %s, %s is known not to carry it", project_url, index_url)
+                return None
+            future = self._futures.pop(project_url.url, None)
+        if future is None:
+            return self._link_collector.fetch_page(project_url)
+        return future.result()
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=True)
+        if self._on_response in self._session.hooks["response"]:
+            self._session.hooks["response"].remove(self._on_response)
+        self._absences.write_cache()
@@ -0,0 +1,204 @@
+"""
+pip_tools_compile.negativecache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Persistent cache of candidate lookups which found nothing compatible with the impersonated system.
+
+Projects like ``pywin32`` when impersonating linux, or versions whose ``requires-python`` excludes
+the mocked Python version, would otherwise have their whole index page evaluated again on every
+compile just to reach the same conclusion. Entries are tied to the index pages state, the
+``X-PyPI-Last-Serial`` or ``ETag`` headers, or the page digest when neither is available, so they
+are discarded as soon as a project page changes. The validators of the pages the finder fetched
+are recorded as it fetches them, see :py:class:`ValidatorRecorder`, so a lookup which finds nothing
+costs no extra request.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import threading
+import urllib.parse
+from collections import namedtuple
+
+from pip._vendor.packaging.utils import canonicalize_name
+from pip._vendor.packaging.version import parse as parse_version
+
+CACHE_FORMAT = 2
+
+log = logging.getLogger("pip-tools-compile.negativecache")
+
+# Just enough of pip's InstallationCandidate for pip-tools' NoCandidateFound error message
+CachedCandidate = namedtuple("CachedCandidate", ["version"])
+
+
+def get_validator(response):
+    """
+    Return the validator describing the state of the index project page of ``response``, or
+    ``None`` if that state can't be determined.
+    """
+    if response.status_code == 404:
+        return "missing"
+    if response.status_code != 200:
+        return None
+    if "X-PyPI-Last-Serial" in response.headers:
+        return "serial:{}".format(response.headers["X-PyPI-Last-Serial"])
+    if "ETag" in response.headers:
+        return "etag:{}".format(response.headers["ETag"])
+    return "sha256:{}".format(hashlib.sha256(response.content).hexdigest())
+
+
+def get_index_validators(session, index_urls, project_name, known=None):
+    """
+    Return a list of ``[project_url, validator]`` pairs describing the current state of the
+    ``project_name`` pages on all ``index_urls``, or ``None`` if that state can't be determined.
+
+    Only the pages missing from ``known``, a ``project_url => validator`` mapping, are fetched.
+    """
+    validators = []
+    for index_url in index_urls:
+        url = posixpath.join(index_url, urllib.parse.quote(canonicalize_name(project_name))) + "/"
+        validator = None
+        if known is not None:
+            validator = known.get(url)
+        if validator is None:
+            try:
+                # The same request pip does, so that it is served from, or stored on, pip's HTTP
+                # cache
+                response = session.get(
+                    url, headers={"Accept": "text/html", "Cache-Control": "max-age=0"}
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                log.debug("Failed to get the validator for %s: %s", url, exc)
+                return None
+            validator = get_validator(response)
+            if validator is None:
+                return None
+        validators.append([url, validator])
+    return validators
+
+
+class ValidatorRecorder:
+    """
+    Records the validators of the index project pages fetched through a pip session, the way the
+    finder fetches them, in :py:attr:`validators`.
+    """
+
+    def __init__(self, index_urls):
+        self._index_urls = tuple(index_url.rstrip("/") + "/" for index_url in index_urls)
+        self.validators = {}
+
+    def install(self, session):
+        session.hooks["response"].append(self._record)
+
+    def get_index_validators(self, session, project_name):
+        """
+        Return the validators of the ``project_name`` pages, only fetching the ones not recorded
+        yet, see :py:func:`get_index_validators`.
+        """
+        return get_index_validators(session, self._index_urls, project_name, known=self.validators)
+
+    def _record(self, response, *_, **__):
+        request = (response.history[0] if response.history else response).request
+        if request.method != "GET" or not request.url.endswith("/"):
+            return
+        if not request.url.startswith(self._index_urls):
+            return
+        validator = get_validator(response)
+        if validator is not None:
+            self.validators[request.url] = validator
+
+
+class NegativeCache:
+    """
+    Persistent ``project name => specifier => validators`` mapping of lookups which found no
+    compatible candidate.
+
+    The impersonated system is part of the cache file name, the same way as for the pip-tools
+    dependency cache.
+    """
+
+    def __init__(self, cache_file):
+        self._cache_file = cache_file
+        self._cache = None
+        # (project name, key) => entry added, or None when discarded, since the cache was read
+        self._changes = {}
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = self._read_cache_file()
+        return self._cache
+
+    def _read_cache_file(self):
+        try:
+            with open(self._cache_file) as rfh:
+                doc = json.load(rfh)
+            if doc["__format__"] != CACHE_FORMAT:
+                raise ValueError("Unknown cache file format")
+            return doc["entries"]
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        except (ValueError, KeyError):
+            log.warning("Ignoring corrupt negative cache file %s", self._cache_file)
+        return {}
+
+    def write_cache(self):
+        """
+        Write the entries added, or discarded, since the cache was read, merged with the ones
+        other processes might have written in the meantime, atomically.
+        """
+        entries = self._read_cache_file()
+        for (name, key), entry in self._changes.items():
+            if entry is None:
+                entries.get(name, {}).pop(key, None)
+            else:
+                entries.setdefault(name, {})[key] = entry
+        entries = {name: keys for name, keys in entries.items() if keys}
+        doc = {"__format__": CACHE_FORMAT, "entries": entries}
+        os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+        tmp_file = "{}.{}.{}.tmp".format(self._cache_file, os.getpid(), threading.get_ident())
+        with open(tmp_file, "w") as wfh:
+            json.dump(doc, wfh, sort_keys=True)
+        os.replace(tmp_file, self._cache_file)
+        self._changes = {}
+
+    def clear(self):
+        self._cache = {}
+        self._changes = {}
+        if os.path.exists(self._cache_file):
+            os.unlink(self._cache_file)
+
+    def lookup(self, project_name, key):
+        """
+        Return the cached entry for ``key``, if any, without validating it.
+        """
+        return self.cache.get(canonicalize_name(project_name), {}).get(key)
+
+    def get(self, project_name, key, validators):
+        """
+        Return the candidates which were tried, and found incompatible, if the cached entry is
+        still valid for ``validators``, otherwise ``None``.
+        """
+        entry = self.lookup(project_name, key)
+        if entry is None:
+            return None
+        if entry["validators"] != validators:
+            log.debug("Discarding the negative cache entry for %s%s", project_name, key)
+            del self.cache[canonicalize_name(project_name)][key]
+            self._changes[(canonicalize_name(project_name), key)] = None
+            self.write_cache()
+            return None
+        return [CachedCandidate(parse_version(version)) for version in entry["tried"]]
+
+    def add(self, project_name, key, validators, tried):
+        name = canonicalize_name(project_name)
+        entry = {
+            "validators": validators,
+            "tried": sorted({str(candidate.version) for candidate in tried}),
+        }
+        self.cache.setdefault(name, {})[key] = entry
+        self._changes[(name, key)] = entry
+        self.write_cache()
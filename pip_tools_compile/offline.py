@@ -0,0 +1,121 @@
+"""
+pip_tools_compile.offline
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compile without network access, from what previous compiles left in the caches.
+
+pip revalidates index pages on every request, and would try the network for anything missing
+from its HTTP cache. When offline, every HTTP(S) request is answered straight from pip's HTTP
+cache, however old the cached response is, and requests with no cached response fail at once,
+without retries. Those cache misses are collected so that a failed compile can list what a
+``pip-tools-compile prefetch`` run should have fetched.
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import zlib
+
+from pip._vendor.cachecontrol.adapter import CacheControlAdapter
+from pip._vendor.requests.adapters import BaseAdapter
+from pip._vendor.requests.exceptions import ConnectionError
+
+log = logging.getLogger("pip-tools-compile.offline")
+
+_CURRENT_MISSES = contextvars.ContextVar("pip_tools_compile_offline", default=None)
+
+
+class CacheMiss(ConnectionError):
+    """
+    Raised for requests which have no cached response.
+
+    pip handles it like any other connection error.
+    """
+
+
+def get_current_misses():
+    """
+    Return the :py:class:`CacheMisses` collecting the misses of the offline compile in progress,
+    if any.
+    """
+    return _CURRENT_MISSES.get()
+
+
+@contextlib.contextmanager
+def activate(misses):
+    """
+    Compile offline, collecting the cache misses in ``misses``, within this context.
+    """
+    token = _CURRENT_MISSES.set(misses)
+    try:
+        yield misses
+    finally:
+        _CURRENT_MISSES.reset(token)
+
+
+class CacheMisses:
+    """
+    The URLs which were requested but not found in the caches, in the order they were requested.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._urls = []
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._urls))
+
+    def __len__(self):
+        return len(self._urls)
+
+    def add(self, url):
+        with self._lock:
+            if url not in self._urls:
+                self._urls.append(url)
+
+
+class OfflineAdapter(BaseAdapter):
+    """
+    Transport adapter serving the responses cached by the ``CacheControlAdapter`` it replaces.
+    """
+
+    def __init__(self, misses, cache_adapter=None):
+        super().__init__()
+        self._misses = misses
+        self._cache_adapter = cache_adapter
+
+    def _get_cached_response(self, request):
+        if self._cache_adapter is None or request.method != "GET":
+            return None
+        controller = self._cache_adapter.controller
+        try:
+            data = self._cache_adapter.cache.get(controller.cache_url(request.url))
+            # Ignores the freshness of the response, unlike controller.cached_request()
+            return controller.serializer.loads(request, data)
+        except zlib.error:
+            return None
+
+    def send(self, request, **kwargs):
+        response = self._get_cached_response(request)
+        if response is None:
+            self._misses.add(request.url)
+            log.debug("Offline, not in pip's HTTP cache: %s %s", request.method, request.url)
+            raise CacheMiss("Offline and {} is not cached".format(request.url), request=request)
+        return self._cache_adapter.build_response(request, response, from_cache=True)
+
+    def close(self):
+        pass
+
+
+def install(session, misses):
+    """
+    Replace the HTTP(S) transport adapters of the pip ``session`` by :py:class:`OfflineAdapter`.
+    """
+    for prefix, adapter in list(session.adapters.items()):
+        if not prefix.startswith(("http://", "https://")):
+            continue
+        if not isinstance(adapter, CacheControlAdapter):
+            # Plain HTTP, or trusted hosts while caching is disabled, pip never caches those
+            adapter = None
+        session.mount(prefix, OfflineAdapter(misses, adapter))
@@ -0,0 +1,209 @@
+"""
+pip_tools_compile.patching
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Lightweight attribute substitution used to impersonate a system.
+
+Contrary to :py:func:`unittest.mock.patch`, there is no ``MagicMock`` in between recording every
+call for the whole run, so the hot paths, like marker evaluation, run at about the same speed as
+unpatched code.
+
+Substitutions are scoped to the :py:mod:`contextvars` context they are started in, not to the
+process: while one is active, the attribute is replaced by a dispatcher which uses the replacement
+of the current context, or the original when there is none. Several threads, each impersonating
+its own system, can then resolve at once in the same process. Threads started by a compile see
+its substitutions when they run in a copy of its context, see :py:func:`submit`.
+"""
+import collections.abc
+import contextvars
+import functools
+import importlib
+import threading
+
+_CURRENT_SUBSTITUTIONS = contextvars.ContextVar("pip_tools_compile_substitutions", default=None)
+
+# Guards the installation of the dispatchers
+_LOCK = threading.Lock()
+# (owner id, attribute) => [owner, attribute, original, own attribute, number of substitutions]
+_DISPATCHERS = {}
+
+_MISSING = object()
+
+
+def _get_current(key, original):
+    substitutions = _CURRENT_SUBSTITUTIONS.get()
+    if substitutions is None:
+        return original
+    return substitutions.get(key, original)
+
+
+def _make_dispatcher(key, original):
+    if callable(original):
+
+        def dispatch(*args, **kwargs):
+            return _get_current(key, original)(*args, **kwargs)
+
+        return dispatch
+    if isinstance(original, collections.abc.Mapping):
+        return _MappingDispatcher(key, original)
+    return _Dispatcher(key, original)
+
+
+class _Dispatcher:
+    """
+    Forwards attribute access to the object of the current context.
+    """
+
+    __slots__ = ("_key", "_original")
+
+    def __init__(self, key, original):
+        self._key = key
+        self._original = original
+
+    def __getattr__(self, name):
+        return getattr(_get_current(self._key, self._original), name)
+
+
+class _MappingDispatcher(collections.abc.Mapping):
+    """
+    The mapping of the current context.
+    """
+
+    __slots__ = ("_key", "_original")
+
+    def __init__(self, key, original):
+        self._key = key
+        self._original = original
+
+    def __getitem__(self, name):
+        return _get_current(self._key, self._original)[name]
+
+    def __iter__(self):
+        return iter(_get_current(self._key, self._original))
+
+    def __len__(self):
+        return len(_get_current(self._key, self._original))
+
+
+class Substitution:
+    """
+    Replace ``attribute`` of the object found at the dotted ``target`` path with ``new``, within
+    the current context.
+
+    .. code-block:: python
+
+        with Substitution("pip._vendor.packaging.tags._get_config_var", constant(None)):
+            ...
+    """
+
+    __slots__ = ("target", "attribute", "new", "_key", "_previous")
+
+    def __init__(self, target, new):
+        self.target, self.attribute = target.rsplit(".", 1)
+        self.new = new
+        self._key = None
+        self._previous = None
+
+    def __repr__(self):
+        return "{}({}.{})".format(self.__class__.__name__, self.target, self.attribute)
+
+    def _resolve_owner(self):
+        parts = self.target.split(".")
+        owner = importlib.import_module(parts[0])
+        imported = parts[0]
+        for part in parts[1:]:
+            imported += "." + part
+            try:
+                owner = getattr(owner, part)
+            except AttributeError:
+                owner = importlib.import_module(imported)
+        return owner
+
+    def _install(self, owner):
+        key = (id(owner), self.attribute)
+        with _LOCK:
+            entry = _DISPATCHERS.get(key)
+            if entry is None:
+                # Fail early, like mock.patch, when the attribute to replace does not exist
+                original = getattr(owner, self.attribute)
+                # Inherited attributes, or class attributes seen from an instance, are deleted
+                # rather than restored
+                own = self.attribute in getattr(owner, "__dict__", {})
+                setattr(owner, self.attribute, _make_dispatcher(key, original))
+                entry = _DISPATCHERS[key] = [owner, self.attribute, original, own, 0]
+            entry[4] += 1
+        return key
+
+    def _uninstall(self, key):
+        with _LOCK:
+            entry = _DISPATCHERS[key]
+            entry[4] -= 1
+            if entry[4] == 0:
+                owner, attribute, original, own, _ = _DISPATCHERS.pop(key)
+                if own:
+                    setattr(owner, attribute, original)
+                else:
+                    delattr(owner, attribute)
+
+    def start(self):
+        if self._key is not None:
+            raise RuntimeError("{!r} was already started".format(self))
+        key = self._install(self._resolve_owner())
+        substitutions = dict(_CURRENT_SUBSTITUTIONS.get() or {})
+        self._previous = substitutions.get(key, _MISSING)
+        substitutions[key] = self.new
+        _CURRENT_SUBSTITUTIONS.set(substitutions)
+        self._key = key
+        return self.new
+
+    def stop(self):
+        if self._key is None:
+            return
+        substitutions = dict(_CURRENT_SUBSTITUTIONS.get() or {})
+        if self._previous is _MISSING:
+            substitutions.pop(self._key, None)
+        else:
+            substitutions[self._key] = self._previous
+        _CURRENT_SUBSTITUTIONS.set(substitutions)
+        self._uninstall(self._key)
+        self._key = self._previous = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+def get_current(target):
+    """
+    Return the value of the dotted ``target`` path within the current context, the replacement
+    of the innermost active :py:class:`Substitution` or the original.
+    """
+    substitution = Substitution(target, None)
+    owner = substitution._resolve_owner()  # pylint: disable=protected-access
+    key = (id(owner), substitution.attribute)
+    with _LOCK:
+        entry = _DISPATCHERS.get(key)
+    if entry is None:
+        return getattr(owner, substitution.attribute)
+    return _get_current(key, entry[2])
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Submit ``fn`` to the ``executor``, to run within a copy of the current context, with its
+    substitutions.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _return(value, *_, **__):
+    return value
+
+
+def constant(value):
+    """
+    Return a callable which accepts any arguments and always returns ``value``.
+    """
+    return functools.partial(_return, value)
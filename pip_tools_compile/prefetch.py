@@ -0,0 +1,289 @@
+"""
+pip_tools_compile.prefetch
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Speculative download of the distributions the pip-tools resolver is about to inspect.
+
+The resolver asks for the dependencies of every pinned candidate one after the other, and each of
+those lookups starts by downloading the candidate distribution. As soon as a candidate is picked,
+or a dependency is discovered, its best matching distribution is downloaded in a background
+thread, into the directory pip looks into before downloading anything. Wheels are also opened to
+prefetch the distributions of the dependencies they declare.
+
+Guesses can be wrong, the resolver might end up pinning another version, so the number of
+download threads and the number of bytes downloaded per compile are bounded.
+"""
+import concurrent.futures
+import contextlib
+import contextvars
+import email.parser
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+
+from pip._vendor.packaging.requirements import InvalidRequirement
+from pip._vendor.packaging.requirements import Requirement
+from pip._vendor.packaging.specifiers import SpecifierSet
+from pip._vendor.packaging.utils import canonicalize_name
+
+from pip_tools_compile import patching
+
+log = logging.getLogger("pip-tools-compile.prefetch")
+
+_CURRENT_SETTINGS = contextvars.ContextVar("pip_tools_compile_prefetch", default=None)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_current_settings():
+    """
+    Return the :py:class:`PrefetchSettings` in effect, if prefetching is enabled.
+    """
+    return _CURRENT_SETTINGS.get()
+
+
+@contextlib.contextmanager
+def activate(settings):
+    """
+    Enable prefetching, with ``settings``, within this context.
+
+    Prefetchers created within this context are shut down when leaving it.
+    """
+    token = _CURRENT_SETTINGS.set(settings)
+    try:
+        yield settings
+    finally:
+        _CURRENT_SETTINGS.reset(token)
+        if settings is not None:
+            settings.close()
+
+
+def parse_size(value):
+    """
+    Parse sizes like ``512K``, ``100M`` or ``1G`` into a number of bytes.
+    """
+    value = value.strip().upper().rstrip("B")
+    multiplier = 1
+    for suffix, suffix_multiplier in (("K", 1024), ("M", 1024**2), ("G", 1024**3)):
+        if value.endswith(suffix):
+            value = value[:-1]
+            multiplier = suffix_multiplier
+            break
+    return int(float(value) * multiplier)
+
+
+class PrefetchSettings:
+    """
+    How much prefetching is allowed per compile.
+
+    :param int workers: The maximum number of concurrent downloads
+    :param int max_bytes: The maximum number of bytes speculatively downloaded
+    :param int depth: How many levels of declared dependencies to follow from a prefetched wheel
+    """
+
+    __slots__ = ("workers", "max_bytes", "depth", "_prefetchers")
+
+    def __init__(self, workers=4, max_bytes=100 * 1024**2, depth=1):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.depth = depth
+        self._prefetchers = []
+
+    def create_prefetcher(self, session, finder, download_dir):
+        prefetcher = Prefetcher(self, session, finder, download_dir)
+        self._prefetchers.append(prefetcher)
+        return prefetcher
+
+    def close(self):
+        while self._prefetchers:
+            self._prefetchers.pop().shutdown()
+
+
+class Prefetcher:
+    """
+    Downloads distributions, in a thread pool, into ``download_dir``.
+    """
+
+    def __init__(self, settings, session, finder, download_dir):
+        self._settings = settings
+        self._session = session
+        self._finder = finder
+        self._download_dir = download_dir
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=settings.workers, thread_name_prefix="pip-tools-compile-prefetch"
+        )
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._bytes_left = settings.max_bytes
+        self._closed = False
+        self.stats = {"scheduled": 0, "downloaded": 0, "bytes": 0, "skipped": 0}
+
+    @property
+    def bytes_left(self):
+        return self._bytes_left
+
+    def schedule(self, name, specifier, extras=(), depth=None):
+        """
+        Prefetch the best distribution matching ``name`` and ``specifier``.
+        """
+        if depth is None:
+            depth = self._settings.depth
+        key = (canonicalize_name(name), str(specifier))
+        with self._lock:
+            if self._closed or key in self._futures or self._bytes_left <= 0:
+                return
+            self.stats["scheduled"] += 1
+            # Within the impersonation of the compile
+            self._futures[key] = patching.submit(
+                self._executor,
+                self._prefetch,
+                key,
+                name,
+                SpecifierSet(str(specifier)),
+                tuple(extras),
+                depth,
+            )
+
+    def schedule_ireq(self, ireq, depth=None):
+        """
+        Prefetch the distribution of the pinned, or not, ``ireq``.
+        """
+        if ireq.editable or ireq.link or ireq.req is None:
+            return
+        self.schedule(ireq.name, ireq.specifier, ireq.extras, depth=depth)
+
+    def wait(self, ireq):
+        """
+        Wait for a prefetch of the pinned ``ireq`` already in progress, so that the resolver does
+        not start downloading the same file.
+        """
+        if ireq.req is None:
+            return
+        with self._lock:
+            future = self._futures.get((canonicalize_name(ireq.name), str(ireq.specifier)))
+        if future is not None and not future.done():
+            log.debug("Waiting for the prefetch of %s", ireq)
+            concurrent.futures.wait([future])
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            for future in self._futures.values():
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        log.debug("Prefetch statistics: %s", self.stats)
+
+    def _reserve(self, size):
+        with self._lock:
+            if size > self._bytes_left:
+                return False
+            self._bytes_left -= size
+            return True
+
+    def _refund(self, size):
+        with self._lock:
+            self._bytes_left += size
+
+    def _prefetch(self, key, name, specifier, extras, depth):
+        try:
+            candidate = self._finder.find_best_candidate(name, specifier).best_candidate
+            if candidate is None:
+                return
+            path = self._download(candidate.link)
+            if path is not None and depth > 0 and path.endswith(".whl"):
+                for requirement in get_wheel_requirements(path, extras):
+                    self.schedule(
+                        requirement.name,
+                        requirement.specifier,
+                        requirement.extras,
+                        depth=depth - 1,
+                    )
+        except Exception as exc:  # pylint: disable=broad-except
+            # A failed guess must never fail the compile, the resolver will try on its own
+            log.debug("Failed to prefetch %s%s: %s", name, specifier, exc)
+            with self._lock:
+                # Can be scheduled again
+                self._futures.pop(key, None)
+
+    def _download(self, link):
+        path = os.path.join(self._download_dir, link.filename)
+        if os.path.exists(path):
+            return path
+        # The same request pip does, so that it is served from, or stored on, pip's HTTP cache
+        response = self._session.get(
+            link.url_without_fragment, headers={"Accept-Encoding": "identity"}, stream=True
+        )
+        reserved = 0
+        try:
+            response.raise_for_status()
+            size = int(response.headers.get("Content-Length") or 0)
+            if size:
+                if not self._reserve(size):
+                    log.debug("Not prefetching %s, over the download budget", link.filename)
+                    with self._lock:
+                        self.stats["skipped"] += 1
+                    return None
+                reserved = size
+            os.makedirs(self._download_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=self._download_dir, prefix=".prefetch-", delete=False
+            ) as wfh:
+                try:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        if self._closed:
+                            raise RuntimeError("The compile is over")
+                        if not size:
+                            if not self._reserve(len(chunk)):
+                                raise RuntimeError("Download budget exceeded")
+                            reserved += len(chunk)
+                        wfh.write(chunk)
+                except BaseException:
+                    wfh.close()
+                    os.unlink(wfh.name)
+                    raise
+            os.replace(wfh.name, path)
+        except BaseException:
+            # Nothing was kept, the budget is only spent on the distributions prefetched
+            self._refund(reserved)
+            raise
+        finally:
+            response.close()
+        downloaded = os.path.getsize(path)
+        with self._lock:
+            self.stats["downloaded"] += 1
+            self.stats["bytes"] += downloaded
+            # Content-Length announced more than what was actually downloaded
+            self._bytes_left += max(reserved - downloaded, 0)
+        log.debug("Prefetched %s", link.filename)
+        return path
+
+
+def get_wheel_requirements(path, extras=()):
+    """
+    Return the requirements declared by the wheel at ``path`` which apply to the impersonated
+    system, with the given ``extras``.
+    """
+    with zipfile.ZipFile(path) as zfh:
+        for filename in zfh.namelist():
+            parts = filename.split("/")
+            if len(parts) == 2 and parts[0].endswith(".dist-info") and parts[1] == "METADATA":
+                metadata = zfh.read(filename).decode("utf-8", "replace")
+                break
+        else:
+            return []
+    requirements = []
+    for line in (
+        email.parser.Parser().parsestr(metadata, headersonly=True).get_all("Requires-Dist", [])
+    ):
+        try:
+            requirement = Requirement(line)
+        except InvalidRequirement:
+            continue
+        if requirement.marker is not None and not any(
+            requirement.marker.evaluate({"extra": extra}) for extra in (("",) + tuple(extras))
+        ):
+            continue
+        requirements.append(requirement)
+    return requirements
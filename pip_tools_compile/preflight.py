@@ -0,0 +1,169 @@
+"""
+pip_tools_compile.preflight
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+``pip-tools-compile preflight``, check the direct requirements of requirements files against a
+matrix of impersonated systems, before compiling any of them.
+
+.. code-block:: console
+
+    pip-tools-compile preflight --target=linux:3.9 --target=windows:3.9 --target=darwin:3.9 \\
+        --include=requirements/base.txt requirements/static/*.in
+
+For each target, the requirements files are parsed the way the compile does, and their direct
+requirements looked up on the index, see :py:mod:`pip_tools_compile.inputcheck`. Nothing is
+resolved, downloaded nor built, and no compiled file is written. The targets are checked
+concurrently, in threads of this process, sharing the connections to the indexes and the index
+pages fetched, see :py:mod:`pip_tools_compile.sessionpool`.
+"""
+import argparse
+import collections
+import concurrent.futures
+import io
+import tempfile
+import time
+
+from pip_tools_compile import inputcheck
+from pip_tools_compile import patching
+from pip_tools_compile import sessionpool
+from pip_tools_compile.__main__ import compile_requirement_file
+from pip_tools_compile.__main__ import get_output_path
+from pip_tools_compile.__main__ import get_parser
+from pip_tools_compile.__main__ import IMPERSONATIONS
+from pip_tools_compile.__main__ import redirect_piptools_output
+from pip_tools_compile.warmup import parse_target
+
+TargetCheck = collections.namedtuple("TargetCheck", ["target", "source", "report", "output"])
+TargetCheck.__doc__ = """
+The outcome of checking the requirements file ``source`` for ``target``.
+
+``report`` is the :py:class:`pip_tools_compile.inputcheck.PreflightReport`, ``report.checked``
+being false when the check could not complete, and ``output`` what the compile printed.
+"""
+
+
+def get_preflight_parser():
+    parser = argparse.ArgumentParser(
+        prog="pip-tools-compile preflight",
+        description=(
+            "Check that the direct requirements can be satisfied on each target, without "
+            "compiling. Any argument not listed here, including the requirements files, is "
+            "passed to each target compile."
+        ),
+    )
+    parser.add_argument(
+        "--target",
+        dest="targets",
+        action="append",
+        type=parse_target,
+        default=[],
+        help=(
+            "The system to check for, as <platform>:<python version>[:<machine>], ie, "
+            "linux:3.9. Can be passed several times. Defaults to the current system."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of targets checked concurrently. Defaults to the number of CPUs.",
+    )
+    return parser
+
+
+def check_target(target, compile_args):
+    """
+    Check the requirements files of ``compile_args`` for ``target``, and return a list of
+    :py:class:`TargetCheck`.
+    """
+    options, unknown_args = get_parser().parse_known_args(compile_args)
+    options.platform, options.py_version, options.machine = target
+    options.preflight = "only"
+    # Nothing to restore nor to write
+    options.result_cache = options.record = None
+    options.trace = options.cost_report = options.lock_graph = False
+    checks = []
+    with tempfile.TemporaryDirectory(prefix="pip-tools-compile-preflight-") as output_dir:
+        options.output_dir = output_dir
+        with IMPERSONATIONS[options.platform](
+            options.py_version, options.platform, options.machine
+        ):
+            for source in options.files:
+                if not source.endswith(".in"):
+                    continue
+                report = inputcheck.PreflightReport()
+                output = io.StringIO()
+                with redirect_piptools_output(output):
+                    compile_requirement_file(
+                        source,
+                        get_output_path(source, options),
+                        options,
+                        unknown_args,
+                        stdout=output,
+                        preflight_report=report,
+                    )
+                checks.append(TargetCheck(target, source, report, output.getvalue()))
+    return checks
+
+
+def check_matrix(targets, compile_args, jobs=None):
+    """
+    Check the requirements files of ``compile_args`` for each of ``targets`` concurrently, and
+    return a list of :py:class:`TargetCheck`, in the order of ``targets``.
+    """
+    with sessionpool.activate(sessionpool.SessionPool()):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            # Each target impersonates its system within a copy of this context
+            futures = [
+                patching.submit(executor, check_target, target, compile_args) for target in targets
+            ]
+            return [check for future in futures for check in future.result()]
+
+
+def _format_target(target):
+    platform, py_version, machine = target
+    return "{} py{}{}".format(platform, py_version, " " + machine if machine else "")
+
+
+def main(argv):
+    parser = get_preflight_parser()
+    options, compile_args = parser.parse_known_args(argv)
+    targets = options.targets
+    if not targets:
+        defaults = get_parser().parse_args([])
+        targets = [(defaults.platform, defaults.py_version, None)]
+
+    start = time.monotonic()
+    checks = check_matrix(targets, compile_args, jobs=options.jobs)
+    exitcode = 0
+    for check in checks:
+        target = _format_target(check.target)
+        if not check.report.checked:
+            exitcode = 1
+            print(
+                "Could not check {} for {}:\n{}".format(check.source, target, check.output.strip())
+            )
+            continue
+        if check.report.problems:
+            exitcode = 1
+            print(
+                "{} for {}: {}".format(
+                    check.source,
+                    target,
+                    inputcheck.InfeasibleRequirements(check.report.problems, check.report.system),
+                )
+            )
+        if check.report.sdist_only:
+            print(
+                "{} for {}: only sdists satisfy {}, building them may fail".format(
+                    check.source,
+                    target,
+                    ", ".join(str(ireq.req) for ireq in check.report.sdist_only),
+                )
+            )
+    print(
+        "Checked {} requirements file(s) for {} target(s) in {:.1f} seconds".format(
+            len({check.source for check in checks}), len(targets), time.monotonic() - start
+        )
+    )
+    return exitcode
@@ -0,0 +1,129 @@
+"""
+pip_tools_compile.resolvertrace
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Opt-in trace of what the pip-tools resolver does while compiling a requirements file.
+
+Every resolver round, every candidate lookup, including which files were rejected and why, and
+every dependency lookup is recorded, with its timing, and written in the Chrome trace event
+format, which ``chrome://tracing``, `Perfetto`_ or `speedscope`_ can load.
+
+.. _Perfetto: https://ui.perfetto.dev
+.. _speedscope: https://www.speedscope.app
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+_CURRENT_TRACE = contextvars.ContextVar("pip_tools_compile_resolver_trace", default=None)
+
+
+def get_current_trace():
+    """
+    Return the :py:class:`ResolverTrace` being recorded, if any.
+    """
+    return _CURRENT_TRACE.get()
+
+
+@contextlib.contextmanager
+def activate(resolver_trace):
+    """
+    Make ``resolver_trace`` the trace being recorded within this context.
+    """
+    token = _CURRENT_TRACE.set(resolver_trace)
+    try:
+        yield resolver_trace
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+class ResolverTrace:
+    """
+    Collects trace events for a single compile.
+
+    :param dict target: Information about the impersonated system, stored in the trace metadata
+    """
+
+    def __init__(self, target=None):
+        self.target = target or {}
+        self.events = []
+        self.rounds = 0
+        self._start = time.perf_counter()
+        self._pid = os.getpid()
+
+    def _timestamp(self):
+        # Chrome traces use microseconds
+        return (time.perf_counter() - self._start) * 1000000
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """
+        Record the time spent within this context.
+
+        The yielded dictionary becomes the event arguments and can be updated while in context.
+        """
+        start = self._timestamp()
+        try:
+            yield args
+        finally:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": self._timestamp() - start,
+                    "pid": self._pid,
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def instant(self, name, category, **args):
+        """
+        Record a point in time event.
+        """
+        self.events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "i",
+                "s": "t",
+                "ts": self._timestamp(),
+                "pid": self._pid,
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+    @contextlib.contextmanager
+    def round(self):
+        """
+        Record a resolver round.
+        """
+        self.rounds += 1
+        with self.span("round {}".format(self.rounds), "round", round=self.rounds) as args:
+            yield args
+
+    def to_dict(self):
+        return {
+            "traceEvents": sorted(self.events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": dict(self.target, rounds=self.rounds),
+        }
+
+    def write(self, path):
+        with open(path, "w") as wfh:
+            json.dump(self.to_dict(), wfh, indent=1, sort_keys=True)
+
+
+def trace_path_for(dest):
+    """
+    Return the path of the trace file for the compiled requirements file ``dest``.
+    """
+    if dest.endswith(".txt"):
+        dest = dest[:-4]
+    return dest + ".trace.json"
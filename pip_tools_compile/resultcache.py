@@ -0,0 +1,381 @@
+"""
+pip_tools_compile.resultcache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Content addressed cache of compiled requirements files.
+
+Every compile is keyed by a fingerprint of everything that can influence its output, the input
+files and whatever they reference, the arguments passed to ``pip-compile``, the impersonated
+system and the tool versions. A cache location can be a local, or shared, directory or a plain
+HTTP server accepting ``GET`` and ``PUT`` requests, which allows a fleet of CI nodes to only
+resolve a given set of inputs once.
+"""
+import hashlib
+import json
+import logging
+import os
+import shlex
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pip
+from pip._internal.configuration import Configuration
+
+from pip_tools_compile import __version__
+
+CACHE_FORMAT = 1
+
+log = logging.getLogger("pip-tools-compile.resultcache")
+
+try:
+    from importlib.metadata import version as _get_version
+except ImportError:  # pragma: no cover
+    try:
+        from importlib_metadata import version as _get_version
+    except ImportError:
+        _get_version = None
+
+
+def _get_piptools_version():
+    if _get_version is None:  # pragma: no cover
+        return "unknown"
+    try:
+        return _get_version("pip-tools")
+    except Exception:  # pylint: disable=broad-except
+        return "unknown"
+
+
+PIPTOOLS_VERSION = _get_piptools_version()
+
+# Arguments which make pip-compile query the index no matter what the inputs are
+UNCACHEABLE_ARGS = ("-U", "--upgrade", "-P", "--upgrade-package", "--rebuild")
+
+# The pip settings, from its configuration files or PIP_* environment variables, selecting where
+# the distributions are looked up
+INDEX_SETTINGS = ("index-url", "extra-index-url", "no-index", "find-links")
+
+
+class ResultCacheError(Exception):
+    """
+    Raised when a cache backend cannot be used.
+    """
+
+
+class ResultCacheBackend:
+    """
+    Base class for the result cache storage backends.
+
+    Backends only need to know how to store and retrieve opaque blobs by key, integrity checking
+    is handled by :py:class:`ResultCache`.
+    """
+
+    def get(self, key):
+        """
+        Return the stored bytes for ``key`` or ``None`` if not found.
+        """
+        raise NotImplementedError
+
+    def put(self, key, data):
+        """
+        Store ``data``, as bytes, under ``key``.
+        """
+        raise NotImplementedError
+
+
+class DirectoryBackend(ResultCacheBackend):
+    """
+    Store cache entries under a local, or network mounted, directory.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.path)
+
+    def _get_path(self, key):
+        # Nest directories to avoid having too many files on a single directory
+        return os.path.join(self.path, key[:2], "{}.json".format(key))
+
+    def get(self, key):
+        try:
+            with open(self._get_path(key), "rb") as rfh:
+                return rfh.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and atomically move it into place so that concurrent
+        # readers never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as wfh:
+                wfh.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class HTTPBackend(ResultCacheBackend):
+    """
+    Store cache entries on an HTTP server which accepts ``GET`` and ``PUT`` requests.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.url)
+
+    def _get_url(self, key):
+        return "{}/{}/{}.json".format(self.url, key[:2], key)
+
+    def get(self, key):
+        try:
+            with urllib.request.urlopen(self._get_url(key), timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return None
+            raise ResultCacheError("Failed to query {}: {}".format(self._get_url(key), exc))
+        except OSError as exc:
+            raise ResultCacheError("Failed to query {}: {}".format(self._get_url(key), exc))
+
+    def put(self, key, data):
+        request = urllib.request.Request(
+            self._get_url(key),
+            data=data,
+            method="PUT",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except OSError as exc:
+            raise ResultCacheError("Failed to store {}: {}".format(self._get_url(key), exc))
+
+
+BACKENDS = {
+    "file": DirectoryBackend,
+    "http": HTTPBackend,
+    "https": HTTPBackend,
+}
+
+
+def get_backend(location):
+    """
+    Return the backend instance to use for the passed ``location``.
+    """
+    scheme = urllib.parse.urlparse(location).scheme
+    if scheme in ("http", "https"):
+        return BACKENDS[scheme](location)
+    if scheme == "file":
+        location = urllib.request.url2pathname(urllib.parse.urlparse(location).path)
+    return BACKENDS["file"](location)
+
+
+def iter_referenced_files(path, seen):
+    """
+    Yield ``path`` and all the requirement files it references through ``-r`` and ``-c``.
+    """
+    path = os.path.abspath(path)
+    if path in seen or not os.path.isfile(path):
+        return
+    seen.add(path)
+    yield path
+    with open(path) as rfh:
+        contents = rfh.read()
+    for line in contents.splitlines():
+        line = line.strip()
+        for flag in ("-r", "-c", "--requirement", "--constraint"):
+            if line.startswith(flag + " ") or line.startswith(flag + "="):
+                ref = line[len(flag) + 1 :].strip()
+                if not os.path.isabs(ref):
+                    # Pip resolves references relative to the including file, while
+                    # pip-tools-compile rewrites them relative to the current directory
+                    candidates = (os.path.join(os.path.dirname(path), ref), ref)
+                else:
+                    candidates = (ref,)
+                for candidate in candidates:
+                    if os.path.isfile(candidate):
+                        yield from iter_referenced_files(candidate, seen)
+                        break
+                break
+
+
+def is_cacheable(pip_compile_args):
+    """
+    Returns ``False`` when the passed ``pip-compile`` arguments make the output depend on the
+    index state instead of just on the inputs.
+    """
+    for arg in pip_compile_args:
+        for uncacheable in UNCACHEABLE_ARGS:
+            if arg == uncacheable or arg.startswith(uncacheable + "="):
+                return False
+    return True
+
+
+def get_index_config():
+    """
+    Return the sorted ``(name, value)`` pairs of the pip settings selecting the indexes, as
+    configured in the pip configuration files and the environment.
+    """
+    configuration = Configuration(isolated=False)
+    configuration.load()
+    return sorted(
+        (name, value)
+        for name, value in configuration.items()
+        if name.partition(".")[-1] in INDEX_SETTINGS
+    )
+
+
+def _normalize_arg(arg, paths):
+    if arg in paths or os.path.isabs(arg):
+        # The same compile from another checkout, or run from another directory
+        return os.path.relpath(os.path.abspath(arg))
+    return arg
+
+
+def fingerprint(pip_compile_args, input_files, dest, profile, extra=None):
+    """
+    Compute the cache key for a compile.
+
+    :param list pip_compile_args: The full ``pip-compile`` command line
+    :param list input_files: The input files passed to ``pip-compile``
+    :param str dest: The output file. Since ``pip-compile`` reuses existing pins, its current
+                     contents are part of the fingerprint
+    :param dict profile: The impersonation profile
+    :param dict extra: Anything else which changes the output
+
+    The paths passed in ``pip_compile_args`` are relative to the current directory, like the
+    input files, and the indexes configured outside of the command line are part of the key.
+    """
+    hasher = hashlib.sha256()
+
+    def _update(label, value):
+        hasher.update("{}\0{}\0".format(label, value).encode("utf-8"))
+
+    _update("format", CACHE_FORMAT)
+    _update("pip-tools-compile", __version__)
+    _update("pip-tools", PIPTOOLS_VERSION)
+    _update("pip", pip.__version__)
+    paths = set(input_files)
+    paths.add(dest)
+    _update(
+        "args",
+        " ".join(shlex.quote(_normalize_arg(arg, paths)) for arg in pip_compile_args),
+    )
+    for name, value in get_index_config():
+        _update("index:{}".format(name), value)
+    for key in sorted(profile):
+        _update("profile:{}".format(key), profile[key])
+    for key in sorted(extra or {}):
+        _update("extra:{}".format(key), extra[key])
+    seen = set()
+    for input_file in input_files:
+        for path in iter_referenced_files(input_file, seen):
+            with open(path, "rb") as rfh:
+                digest = hashlib.sha256(rfh.read()).hexdigest()
+            _update("file:{}".format(os.path.relpath(path)), digest)
+    if os.path.exists(dest):
+        with open(dest, "rb") as rfh:
+            _update("dest", hashlib.sha256(rfh.read()).hexdigest())
+    else:
+        _update("dest", None)
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """
+    Store and restore compiled requirements files, verifying the integrity of every entry.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @classmethod
+    def from_location(cls, location):
+        return cls(get_backend(location))
+
+    def restore(self, key, dest, companions=()):
+        """
+        Write the cached contents for ``key`` to ``dest``, and to the ``companions`` paths, files
+        generated along with ``dest``.
+
+        Returns ``True`` if the entry was found and is valid, ``False`` otherwise.
+        """
+        try:
+            data = self.backend.get(key)
+        except ResultCacheError as exc:
+            log.warning("Result cache lookup failed: %s", exc)
+            return False
+        if data is None:
+            log.info("Result cache miss for %s: %s", dest, key)
+            return False
+        try:
+            entry = json.loads(data.decode("utf-8"))
+            contents = entry["contents"]
+            valid = (
+                entry["__format__"] == CACHE_FORMAT
+                and entry["key"] == key
+                and hashlib.sha256(contents.encode("utf-8")).hexdigest() == entry["sha256"]
+            )
+            companion_contents = []
+            for path in companions:
+                companion = entry.get("companions", {}).get(os.path.basename(path))
+                if companion is None:
+                    log.info("Result cache entry for %s lacks %s: %s", dest, path, key)
+                    return False
+                valid = valid and (
+                    hashlib.sha256(companion["contents"].encode("utf-8")).hexdigest()
+                    == companion["sha256"]
+                )
+                companion_contents.append((path, companion["contents"]))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            valid = False
+        if not valid:
+            log.warning("Ignoring corrupt result cache entry for %s: %s", dest, key)
+            return False
+        with open(dest, "w") as wfh:
+            wfh.write(contents)
+        for path, contents in companion_contents:
+            with open(path, "w") as wfh:
+                wfh.write(contents)
+        log.info("Restored %s from the result cache: %s", dest, key)
+        return True
+
+    def store(self, key, dest, companions=()):
+        """
+        Store the contents of ``dest``, and of the ``companions`` paths, under ``key``.
+        """
+        with open(dest) as rfh:
+            contents = rfh.read()
+        entry = {
+            "__format__": CACHE_FORMAT,
+            "key": key,
+            "sha256": hashlib.sha256(contents.encode("utf-8")).hexdigest(),
+            "contents": contents,
+        }
+        if companions:
+            entry["companions"] = {}
+            for path in companions:
+                with open(path) as rfh:
+                    companion_contents = rfh.read()
+                entry["companions"][os.path.basename(path)] = {
+                    "sha256": hashlib.sha256(companion_contents.encode("utf-8")).hexdigest(),
+                    "contents": companion_contents,
+                }
+        try:
+            self.backend.put(key, json.dumps(entry, sort_keys=True).encode("utf-8"))
+        except (ResultCacheError, OSError) as exc:
+            log.warning("Failed to store %s in the result cache: %s", dest, exc)
+            return False
+        log.info("Stored %s in the result cache: %s", dest, key)
+        return True
@@ -0,0 +1,151 @@
+"""
+pip_tools_compile.seeding
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Warm start compiles from the compiled files of other systems.
+
+pip-compile prefers the pins of the file it is about to overwrite, but a new target, say
+``py3.10/``, or a system compiled after another, starts from scratch, even though the compiled
+file of a sibling target, ``py3.9/`` or another platform, almost always holds the answer.
+
+The pins of the seed files are preferred when looking for the best match of a requirement, after
+the pins of the file being compiled: the seed pin is used when it satisfies the requirement and the
+impersonated system can install that version, otherwise the resolver looks for the best match as
+usual, and the compile diverges from the seed there.
+
+.. code-block:: console
+
+    pip-tools-compile --py-version=3.10 --seed-siblings requirements/static/ci/linux.in
+    pip-tools-compile --platform=windows --seed-from=requirements/static/ci/py3.9/linux.txt \\
+        requirements/static/ci/windows.in
+"""
+import contextlib
+import contextvars
+import glob
+import hashlib
+import logging
+import os
+import re
+
+from pip._vendor.packaging.requirements import InvalidRequirement
+from pip._vendor.packaging.requirements import Requirement
+from pip._vendor.packaging.utils import canonicalize_name
+
+log = logging.getLogger("pip-tools-compile.seeding")
+
+_CURRENT_SEEDS = contextvars.ContextVar("pip_tools_compile_seeding", default=None)
+
+_PY_VERSION_DIR_RE = re.compile(r"^py(\d+)\.(\d+)$")
+
+
+def get_current_seeds():
+    """
+    Return the :py:class:`SeedPins` preferred within this context, if any.
+    """
+    return _CURRENT_SEEDS.get()
+
+
+@contextlib.contextmanager
+def activate(seed_pins):
+    """
+    Prefer the ``seed_pins`` within this context.
+    """
+    token = _CURRENT_SEEDS.set(seed_pins)
+    try:
+        yield seed_pins
+    finally:
+        _CURRENT_SEEDS.reset(token)
+
+
+def read_pins(path):
+    """
+    Return the ``canonical name => version`` pins of the compiled requirements file at ``path``.
+    """
+    pins = {}
+    with open(path) as rfh:
+        for line in rfh:
+            line = line.split("#", 1)[0].rstrip().rstrip("\\").strip()
+            if not line or line.startswith("-"):
+                continue
+            try:
+                req = Requirement(line)
+            except InvalidRequirement:
+                log.debug("Not a pin in %s: %s", path, line)
+                continue
+            specifiers = list(req.specifier)
+            if len(specifiers) == 1 and specifiers[0].operator in ("==", "==="):
+                pins.setdefault(canonicalize_name(req.name), specifiers[0].version)
+    return pins
+
+
+def find_siblings(dest):
+    """
+    Return the compiled files of the other Python versions of ``dest``, which lives in a
+    ``py<version>`` directory, the closest versions first.
+    """
+    dest_dir, filename = os.path.split(os.path.abspath(dest))
+    match = _PY_VERSION_DIR_RE.match(os.path.basename(dest_dir))
+    if match is None:
+        return []
+    version = tuple(int(part) for part in match.groups())
+    siblings = []
+    for path in glob.glob(os.path.join(os.path.dirname(dest_dir), "py*", filename)):
+        sibling_match = _PY_VERSION_DIR_RE.match(os.path.basename(os.path.dirname(path)))
+        if sibling_match is None or os.path.dirname(path) == dest_dir:
+            continue
+        sibling_version = tuple(int(part) for part in sibling_match.groups())
+        distance = (abs(sibling_version[0] - version[0]), abs(sibling_version[1] - version[1]))
+        # The newer one first, when as close
+        siblings.append((distance, tuple(-part for part in sibling_version), path))
+    return [path for _, _, path in sorted(siblings)]
+
+
+class SeedPins:
+    """
+    The pins of the seed files at ``paths``, the first file pinning a project winning.
+
+    :param dict pins: ``name => version`` pins preferred over the ones of the seed files
+    """
+
+    def __init__(self, paths, pins=None):
+        self.paths = []
+        self.pins = {canonicalize_name(name): version for name, version in (pins or {}).items()}
+        self.used = set()
+        self.diverged = set()
+        for path in paths:
+            if not os.path.exists(path):
+                log.warning("Seed file %s does not exist", path)
+                continue
+            self.paths.append(path)
+            for name, version in read_pins(path).items():
+                self.pins.setdefault(name, version)
+
+    def __bool__(self):
+        return bool(self.pins)
+
+    def get(self, project_name):
+        """
+        Return the seed version of ``project_name``, if any.
+        """
+        return self.pins.get(canonicalize_name(project_name))
+
+    def record(self, project_name, used):
+        """
+        Record whether the seed pin of ``project_name`` was ``used`` or diverged from.
+        """
+        name = canonicalize_name(project_name)
+        if used:
+            self.used.add(name)
+            self.diverged.discard(name)
+        elif name not in self.used:
+            self.diverged.add(name)
+
+    def digest(self):
+        """
+        Return a digest of the seed files, which change the compiled files.
+        """
+        hasher = hashlib.sha256()
+        for path in self.paths:
+            with open(path, "rb") as rfh:
+                hasher.update(hashlib.sha256(rfh.read()).digest())
+        return hasher.hexdigest()
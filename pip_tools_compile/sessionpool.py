@@ -0,0 +1,132 @@
+"""
+pip_tools_compile.sessionpool
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Connections and index pages shared by all the compiles of a ``pip-tools-compile`` invocation.
+
+pip-compile builds a new pip session, and so new connection pools, for every requirements file
+compiled, and forgets every index page it fetched. Within a :py:class:`SessionPool`, the pip
+sessions built for compiles which share the same connection settings are given the same
+transport adapters, holding keep-alive connections, and the project pages fetched from the
+indexes are kept in memory, up to a size limit, for the following compiles, whatever system they
+impersonate. The impersonated system only changes how the links of those pages are evaluated.
+"""
+import collections
+import contextlib
+import contextvars
+import logging
+import threading
+
+log = logging.getLogger("pip-tools-compile.sessionpool")
+
+_CURRENT_POOL = contextvars.ContextVar("pip_tools_compile_sessionpool", default=None)
+
+DEFAULT_MAX_PAGES_BYTES = 256 * 1024**2
+
+
+def get_current_pool():
+    """
+    Return the :py:class:`SessionPool` in use, if any.
+    """
+    return _CURRENT_POOL.get()
+
+
+@contextlib.contextmanager
+def activate(pool):
+    """
+    Share connections and index pages through ``pool`` within this context, closing it when
+    leaving it.
+    """
+    token = _CURRENT_POOL.set(pool)
+    try:
+        yield pool
+    finally:
+        _CURRENT_POOL.reset(token)
+        if pool is not None:
+            pool.close()
+
+
+def _get_connection_key(options):
+    # Everything pip uses to set up the transport adapters of a session, and the connections
+    return (
+        options.cache_dir,
+        options.retries,
+        tuple(options.trusted_hosts or ()),
+        options.cert,
+        options.client_cert,
+        options.proxy,
+    )
+
+
+class SessionPool:
+    """
+    Transport adapters and index pages shared between pip sessions.
+
+    :param int max_pages_bytes: The maximum size of the index pages kept in memory
+    """
+
+    def __init__(self, max_pages_bytes=DEFAULT_MAX_PAGES_BYTES):
+        self._max_pages_bytes = max_pages_bytes
+        self._lock = threading.Lock()
+        self._adapters = {}
+        self._pages = collections.OrderedDict()
+        self._pages_bytes = 0
+        self.stats = {"sessions": 0, "reused": 0, "page_hits": 0, "page_misses": 0}
+
+    def attach(self, session, options):
+        """
+        Mount on the pip ``session``, built from the pip ``options``, the transport adapters of
+        the previous sessions built with the same connection settings.
+        """
+        key = _get_connection_key(options)
+        with self._lock:
+            self.stats["sessions"] += 1
+            adapters = self._adapters.get(key)
+            if adapters is None:
+                self._adapters[key] = dict(session.adapters)
+                return
+            self.stats["reused"] += 1
+        for prefix, adapter in list(session.adapters.items()):
+            shared = adapters.get(prefix)
+            if shared is not None and shared is not adapter:
+                session.mount(prefix, shared)
+                adapter.close()
+
+    def get_page(self, url):
+        """
+        Return the index page fetched from ``url`` by a previous compile, if still kept.
+        """
+        with self._lock:
+            page = self._pages.get(url)
+            if page is None:
+                self.stats["page_misses"] += 1
+                return None
+            self._pages.move_to_end(url)
+            self.stats["page_hits"] += 1
+            return page
+
+    def add_page(self, url, page):
+        size = len(page.content)
+        if size > self._max_pages_bytes:
+            return
+        with self._lock:
+            previous = self._pages.pop(url, None)
+            if previous is not None:
+                self._pages_bytes -= len(previous.content)
+            self._pages[url] = page
+            self._pages_bytes += size
+            while self._pages_bytes > self._max_pages_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._pages_bytes -= len(evicted.content)
+
+    def close(self):
+        with self._lock:
+            adapters = [
+                adapter for prefixes in self._adapters.values() for adapter in prefixes.values()
+            ]
+            self._adapters.clear()
+            self._pages.clear()
+            self._pages_bytes = 0
+        for adapter in {id(adapter): adapter for adapter in adapters}.values():
+            adapter.close()
+        log.debug("Session pool statistics: %s", self.stats)
@@ -0,0 +1,168 @@
+"""
+pip_tools_compile.sharding
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Deterministic split of the (requirements file, impersonated system) work items across CI nodes.
+
+Work items are not dealt round-robin, some files take minutes to compile and others seconds.
+Using the durations recorded by previous runs, the longest items are assigned first, each one to
+the shard with the least work so far. Items never seen before are assumed to take the median of
+the known durations. As long as every node reads the same durations file and is given the same
+work items, every node computes the same assignment, without talking to the others.
+
+Each shard only writes the compiled files it owns and records its durations in its own
+``<durations>.shard-<i>-of-<N>.json`` file, next to the durations file, so collecting the
+artifacts of all shards into the same directory never conflicts. Splitting only reads the
+durations file, whatever shard files each node has lying around. Once the artifacts of all
+shards are collected, the shard files are folded into the durations file explicitly:
+
+.. code-block:: console
+
+    pip-tools-compile merge-durations durations.json
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+
+DEFAULT_DURATION = 60.0
+
+
+def parse_shard(value):
+    """
+    Parse a ``<index>/<count>`` shard specification, where ``index`` starts at 1.
+
+    :raises ValueError: when the specification is invalid
+    """
+    index, sep, count = value.partition("/")
+    try:
+        index = int(index)
+        count = int(count)
+    except ValueError:
+        index = count = 0
+    if not sep or count < 1 or not 1 <= index <= count:
+        raise ValueError(
+            "Invalid shard {!r}, expected <index>/<count> with 1 <= index <= count".format(value)
+        )
+    return index, count
+
+
+def get_work_item_key(source, platform, py_version, machine=None):
+    """
+    Return the key identifying the compile of ``source`` for the given impersonated system, the
+    same whatever system actually runs the compile.
+    """
+    source = os.path.normpath(source).replace(os.sep, "/")
+    target = "{}-py{}".format(platform, py_version)
+    if machine:
+        target += "-{}".format(machine)
+    return "{}::{}".format(source, target)
+
+
+def get_shard_durations_path(path, index, count):
+    root, ext = os.path.splitext(path)
+    return "{}.shard-{}-of-{}{}".format(root, index, count, ext or ".json")
+
+
+def read_durations(path):
+    """
+    Return the durations, in seconds, by work item key, recorded in ``path``.
+
+    The shard files next to ``path`` are ignored, see :py:func:`merge_durations`.
+    """
+    try:
+        with open(path) as rfh:
+            return json.load(rfh)
+    except FileNotFoundError:
+        return {}
+
+
+def merge_durations(path):
+    """
+    Fold the shard files next to ``path`` into ``path``, in a stable order, remove them and
+    return their paths.
+    """
+    root, ext = os.path.splitext(path)
+    shard_paths = sorted(glob.glob("{}.shard-*-of-*{}".format(glob.escape(root), ext or ".json")))
+    for shard_path in shard_paths:
+        write_durations(path, read_durations(shard_path))
+        os.unlink(shard_path)
+    return shard_paths
+
+
+def write_durations(path, durations):
+    """
+    Update the durations recorded in ``path`` with ``durations``.
+    """
+    try:
+        with open(path) as rfh:
+            recorded = json.load(rfh)
+    except FileNotFoundError:
+        recorded = {}
+    recorded.update({key: round(duration, 3) for key, duration in durations.items()})
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(path, "w") as wfh:
+        # One item per line, sorted, so that the file diffs and merges nicely
+        json.dump(recorded, wfh, indent=1, sort_keys=True)
+        wfh.write("\n")
+
+
+def _get_default_duration(keys, durations):
+    known = [durations[key] for key in keys if key in durations]
+    return statistics.median(known) if known else DEFAULT_DURATION
+
+
+def assign(keys, count, durations=None):
+    """
+    Return the list of the keys, out of ``keys``, each of the ``count`` shards must handle.
+
+    Keys are assigned longest first to the least loaded shard, the lowest shard winning ties.
+    """
+    durations = durations or {}
+    default = _get_default_duration(keys, durations)
+    shards = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for key in sorted(set(keys), key=lambda key: (-durations.get(key, default), key)):
+        idx = min(range(count), key=lambda idx: (loads[idx], idx))
+        shards[idx].append(key)
+        loads[idx] += durations.get(key, default)
+    return shards
+
+
+def select(keys, index, count, durations=None):
+    """
+    Return the keys, in their original order, handled by the shard ``index`` out of ``count``.
+    """
+    selected = set(assign(keys, count, durations)[index - 1])
+    return [key for key in keys if key in selected]
+
+
+def estimate(keys, durations=None):
+    """
+    Return the estimated number of seconds needed to compile all ``keys``.
+    """
+    durations = durations or {}
+    default = _get_default_duration(keys, durations)
+    return sum(durations.get(key, default) for key in keys)
+
+
+def get_merge_parser():
+    parser = argparse.ArgumentParser(
+        prog="pip-tools-compile merge-durations",
+        description=(
+            "Fold the durations recorded by each shard of a run into the durations file, once "
+            "the artifacts of all the shards are collected next to it."
+        ),
+    )
+    parser.add_argument("durations", help="The file passed as --durations to the shards")
+    return parser
+
+
+def main(argv):
+    options = get_merge_parser().parse_args(argv)
+    for shard_path in merge_durations(options.durations):
+        print("Merged {} into {}".format(shard_path, options.durations))
+    return 0
@@ -0,0 +1,112 @@
+"""
+pip_tools_compile.variants
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compile variants of requirements files on top of a shared base resolution.
+
+The same ``requirements/static/*.in`` files are usually compiled several times, with a different
+``--out-prefix`` and extra ``--include`` files, for each transport or test setup, and each of those
+compiles resolves the large common part from scratch.
+
+With ``--variant``, each requirements file is compiled once, with the common ``--include`` files,
+to its usual output path: the base. Each variant is then compiled, with its extra includes, to the
+output path of its name prefix, appended to the ``--out-prefix`` if any, preferring the pins of the
+base the way :py:mod:`pip_tools_compile.seeding` does. The base pins win over the pins of the
+variant's previously compiled file too, so the variants never drift away from their base. Only the
+projects the extra includes conflict with, and their dependencies, are resolved anew.
+
+.. code-block:: console
+
+    pip-tools-compile --py-version=3.9 --include=requirements/base.txt \\
+        --variant=zeromq=requirements/zeromq.txt,requirements/pytest.txt \\
+        --variant=raet=requirements/raet.txt,requirements/pytest.txt \\
+        requirements/static/linux.in
+"""
+import collections
+import contextlib
+import copy
+import functools
+import logging
+import re
+
+from pip._vendor.packaging.utils import canonicalize_name
+from piptools.repositories import LocalRequirementsRepository
+from piptools.utils import as_tuple
+
+from pip_tools_compile import seeding
+from pip_tools_compile.patching import Substitution
+
+log = logging.getLogger("pip-tools-compile.variants")
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+Variant = collections.namedtuple("Variant", ["name", "includes"])
+Variant.__doc__ = """
+A variant named ``name``, compiled with the extra ``includes`` on top of the base.
+"""
+
+
+def parse_variant(value):
+    """
+    Parse a ``NAME=INCLUDE[,INCLUDE...]`` ``--variant`` value into a :py:class:`Variant`.
+    """
+    name, sep, includes = value.partition("=")
+    name = name.strip()
+    if not sep or not _NAME_RE.match(name):
+        raise ValueError(
+            "Invalid variant {!r}, expected NAME=INCLUDE[,INCLUDE...], NAME being usable as an "
+            "output file prefix".format(value)
+        )
+    return Variant(name, [include.strip() for include in includes.split(",") if include.strip()])
+
+
+def get_work_item_key(work_item_key, variant):
+    """
+    Return the key identifying the compile of ``variant`` of the base ``work_item_key``.
+    """
+    return "{}::{}".format(work_item_key, variant.name)
+
+
+def get_variant_options(options, variant, base_path):
+    """
+    Return a copy of ``options`` to compile ``variant`` on top of the base compiled to
+    ``base_path``.
+    """
+    variant_options = copy.copy(options)
+    if options.out_prefix:
+        variant_options.out_prefix = "{}-{}".format(options.out_prefix, variant.name)
+    else:
+        variant_options.out_prefix = variant.name
+    variant_options.include = list(options.include) + list(variant.includes)
+    # The base pins are preferred over the other seeds
+    variant_options.seed_from = [base_path] + list(options.seed_from)
+    return variant_options
+
+
+@contextlib.contextmanager
+def activate(base_path):
+    """
+    Prefer the pins of the base compiled to ``base_path`` over the pins of the compiled file
+    being overwritten, within this context.
+    """
+    if base_path is None:
+        yield None
+        return
+    base_pins = seeding.read_pins(base_path)
+    with Substitution(
+        "piptools.scripts.compile.LocalRequirementsRepository",
+        functools.partial(_make_local_repository, base_pins),
+    ):
+        yield base_pins
+
+
+def _make_local_repository(base_pins, existing_pins, *args, **kwargs):
+    kept = {}
+    for key, ireq in existing_pins.items():
+        name, version, _ = as_tuple(ireq)
+        base_version = base_pins.get(canonicalize_name(name))
+        if base_version is not None and base_version != version:
+            log.debug("Dropping the pin %s==%s, the base pins %s", name, version, base_version)
+            continue
+        kept[key] = ireq
+    return LocalRequirementsRepository(kept, *args, **kwargs)
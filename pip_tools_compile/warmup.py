@@ -0,0 +1,172 @@
+"""
+pip_tools_compile.warmup
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+``pip-tools-compile prefetch``, fill the caches an ``--offline`` compile reads, for a matrix of
+impersonated systems.
+
+.. code-block:: console
+
+    pip-tools-compile prefetch --target=linux:3.9 --target=windows:3.9 \\
+        --include=requirements/base.txt requirements/static/*.in
+    pip-tools-compile --offline --platform=linux --py-version=3.9 \\
+        --include=requirements/base.txt requirements/static/*.in
+
+Every target is compiled, concurrently, in its own ``pip-tools-compile`` process, with the same
+arguments as the offline compiles, which fills pip's HTTP cache with the index pages, the
+distributions and the hashes, and the pip-tools dependency cache with the metadata of wheels and
+built sdists. The compiled files are written to temporary directories, seeded with the current
+compiled files, so that the pins they hold are looked up like the offline compile will. The
+requirements files of each source directory get their own temporary directory, and process, since
+files of different directories can share a name, ``requirements/static/ci/linux.in`` and
+``requirements/static/pkg/linux.in`` for example.
+"""
+import argparse
+import collections
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pip_tools_compile.__main__ import get_output_path
+from pip_tools_compile.__main__ import get_parser
+from pip_tools_compile.__main__ import IMPERSONATIONS
+
+
+def parse_target(value):
+    """
+    Parse a ``<platform>:<python version>[:<machine>]`` target into ``(platform, py_version,
+    machine)``.
+    """
+    parts = value.split(":")
+    if len(parts) not in (2, 3) or parts[0] not in IMPERSONATIONS or not parts[1]:
+        raise argparse.ArgumentTypeError(
+            "Invalid target {!r}, expected <platform>:<python version>[:<machine>], platform "
+            "being one of {}".format(value, ", ".join(sorted(IMPERSONATIONS)))
+        )
+    if len(parts) == 2:
+        parts.append(None)
+    return tuple(parts)
+
+
+def get_warmup_parser():
+    parser = argparse.ArgumentParser(
+        prog="pip-tools-compile prefetch",
+        description=(
+            "Fill the caches used by 'pip-tools-compile --offline'. Any argument not listed "
+            "here, including the requirements files, is passed to each target compile."
+        ),
+    )
+    parser.add_argument(
+        "--target",
+        dest="targets",
+        action="append",
+        type=parse_target,
+        default=[],
+        help=(
+            "The system to prefetch for, as <platform>:<python version>[:<machine>], ie, "
+            "linux:3.9. Can be passed several times. Defaults to the current system."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of targets compiled concurrently. Defaults to the number of CPUs.",
+    )
+    return parser
+
+
+def _group_sources(compile_args):
+    """
+    Return the arguments of ``compile_args`` which are not requirements files, and the ``.in``
+    requirements files of ``compile_args`` grouped by directory.
+    """
+    options, _ = get_parser().parse_known_args(compile_args)
+    other_args = list(compile_args)
+    groups = collections.OrderedDict()
+    for fpath in options.files:
+        other_args.remove(fpath)
+        if fpath.endswith(".in"):
+            groups.setdefault(os.path.dirname(os.path.abspath(fpath)), []).append(fpath)
+    return other_args, list(groups.values())
+
+
+def _seed_output_dir(compile_args, target, sources, output_dir):
+    # pip-compile keeps the pins found in an existing output file, look those up too
+    options, _ = get_parser().parse_known_args(compile_args)
+    options.platform, options.py_version, options.machine = target
+    for fpath in sources:
+        current_path = get_output_path(fpath, options, makedirs=False)
+        if os.path.exists(current_path):
+            shutil.copyfile(current_path, os.path.join(output_dir, os.path.basename(current_path)))
+
+
+def warm_up(target, compile_args):
+    """
+    Compile for ``target``, discarding the compiled files, and return ``(success, duration,
+    output)``.
+    """
+    platform, py_version, machine = target
+    start = time.monotonic()
+    other_args, groups = _group_sources(compile_args)
+    success = True
+    output = []
+    with tempfile.TemporaryDirectory(prefix="pip-tools-compile-prefetch-") as tmp_dir:
+        for idx, sources in enumerate(groups):
+            output_dir = os.path.join(tmp_dir, str(idx))
+            os.makedirs(output_dir)
+            _seed_output_dir(compile_args, target, sources, output_dir)
+            cmdline = [
+                sys.executable,
+                "-m",
+                "pip_tools_compile",
+                "--platform={}".format(platform),
+                "--py-version={}".format(py_version),
+            ]
+            if machine:
+                cmdline.append("--machine={}".format(machine))
+            cmdline.extend(other_args)
+            # Last one wins. Results restored from the result cache would not fill any cache
+            cmdline.extend(["--output-dir={}".format(output_dir), "--result-cache="])
+            cmdline.extend(sources)
+            proc = subprocess.run(
+                cmdline,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                check=False,
+            )
+            success = success and proc.returncode == 0
+            output.append(proc.stdout)
+    return success, time.monotonic() - start, "".join(output)
+
+
+def main(argv):
+    parser = get_warmup_parser()
+    options, compile_args = parser.parse_known_args(argv)
+    targets = options.targets
+    if not targets:
+        defaults = get_parser().parse_args([])
+        targets = [(defaults.platform, defaults.py_version, None)]
+    if "--offline" in compile_args:
+        parser.error("--offline makes no sense when prefetching")
+    if not _group_sources(compile_args)[1]:
+        parser.error("Please pass at least one requirement file")
+
+    exitcode = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.jobs) as executor:
+        futures = {executor.submit(warm_up, target, compile_args): target for target in targets}
+        for future in concurrent.futures.as_completed(futures):
+            platform, py_version, machine = futures[future]
+            success, duration, output = future.result()
+            target = "{} py{}{}".format(platform, py_version, " " + machine if machine else "")
+            if success:
+                print("Prefetched for {} in {:.1f} seconds".format(target, duration))
+            else:
+                exitcode = 1
+                print("Failed to prefetch for {}:\n{}".format(target, output.strip()))
+    return exitcode
@@ -2,10 +2,15 @@
 conftest
 ~~~~~~~~
 """
+import hashlib
+import http.server
+import io
 import logging
 import os
 import subprocess
 import sys
+import threading
+import zipfile
 from collections import namedtuple
 
 import attr
@@ -92,3 +97,94 @@ class RunCommand:
 @pytest.fixture
 def run_command():
     return RunCommand()
+
+
+@pytest.fixture
+def isolated_run_command(run_command, tmp_path):
+    run_command.environ["XDG_CACHE_HOME"] = str(tmp_path / "cache")
+    for name in ("PIP_INDEX_URL", "PIP_EXTRA_INDEX_URL", "PIP_FIND_LINKS"):
+        run_command.environ.pop(name, None)
+    return run_command
+
+
+def make_wheel(name, requires_dist=(), version="1.0"):
+    buf = io.BytesIO()
+    dist_info = "{}-{}.dist-info".format(name, version)
+    with zipfile.ZipFile(buf, "w") as zfh:
+        metadata = "Metadata-Version: 2.1\nName: {}\nVersion: {}\n".format(name, version)
+        for line in requires_dist:
+            metadata += "Requires-Dist: {}\n".format(line)
+        zfh.writestr("{}/METADATA".format(dist_info), metadata)
+        zfh.writestr(
+            "{}/WHEEL".format(dist_info),
+            "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        )
+        zfh.writestr("{}/RECORD".format(dist_info), "")
+    return buf.getvalue()
+
+
+class IndexRequestHandler(http.server.BaseHTTPRequestHandler):
+    files = {}
+    requested = []
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        if self.path.endswith("/"):
+            self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "max-age=600, public")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def add_project(cls, name, releases):
+        """
+        Serve the ``releases`` of ``name``, a mapping of versions to the requirements of each.
+        """
+        links = []
+        for version, requires_dist in releases.items():
+            filename = "{}-{}-py3-none-any.whl".format(name, version)
+            wheel = make_wheel(name, requires_dist, version=version)
+            cls.files["/files/" + filename] = wheel
+            links.append(
+                '<a href="../../files/{0}#sha256={1}">{0}</a>'.format(
+                    filename, hashlib.sha256(wheel).hexdigest()
+                )
+            )
+        cls.files["/simple/{}/".format(name)] = "<html><body>{}</body></html>".format(
+            "".join(links)
+        ).encode("utf-8")
+
+
+@pytest.fixture
+def index_server():
+    """
+    A local package index serving the ``pkg`` and ``dep`` wheels, ``pkg`` depending on ``dep``.
+
+    The requested paths are collected in ``index_server.RequestHandlerClass.requested``, and
+    ``index_server.pip_args`` are the arguments to use it.
+    """
+    IndexRequestHandler.add_project("pkg", {"1.0": ["dep>=1"]})
+    IndexRequestHandler.add_project("dep", {"1.0": []})
+    server = http.server.HTTPServer(("127.0.0.1", 0), IndexRequestHandler)
+    server.pip_args = (
+        "--index-url=http://127.0.0.1:{}/simple".format(server.server_address[1]),
+        "--trusted-host=127.0.0.1",
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        IndexRequestHandler.files.clear()
+        del IndexRequestHandler.requested[:]
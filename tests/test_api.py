@@ -0,0 +1,123 @@
+"""
+    test_api
+    ~~~~~~~~
+
+    Test the in-process compile API
+"""
+import logging
+import os
+import sys
+import textwrap
+
+from pip_tools_compile import lockgraph
+from pip_tools_compile.api import compile_many
+from pip_tools_compile.api import Job
+
+
+def test_compile_many(caplog, tmp_path):
+    # The logs captured follow the logging configuration of the application
+    caplog.set_level(logging.INFO, logger="pip-tools-compile")
+    jsonschema_in = tmp_path / "jsonschema.in"
+    jsonschema_in.write_text("jsonschema==2.6.0\n")
+    boto3_in = tmp_path / "boto3-py35.in"
+    boto3_in.write_text(
+        textwrap.dedent(
+            """\
+            pep8
+            boto3>=1.17.66
+            """
+        )
+    )
+    argv = sys.argv[:]
+    stdout = sys.stdout
+    stderr = sys.stderr
+
+    results = compile_many(
+        [
+            Job(str(jsonschema_in), platform="linux", py_version="3.7"),
+            Job(str(boto3_in), platform="linux", py_version="3.5"),
+            Job(str(jsonschema_in), platform="windows", py_version="3.7", out_prefix="windows"),
+        ]
+    )
+
+    assert sys.argv == argv
+    assert sys.stdout is stdout
+    assert sys.stderr is stderr
+
+    linux, boto3, windows = results
+    assert linux.success is True
+    assert linux.output_path == str(tmp_path / "py3.7" / "jsonschema.txt")
+    assert "jsonschema==2.6.0" in (tmp_path / "py3.7" / "jsonschema.txt").read_text()
+    assert "Impersonating: linux" in linux.output
+    assert "Compiling requirements to" in linux.logs
+    assert linux.duration > 0
+
+    # There's no boto3>=1.17.66 for Py3.5
+    assert boto3.success is False
+    assert "Could not find a version that matches boto3>=1.17.66" in boto3.output
+
+    assert windows.success is True
+    assert windows.output_path == str(tmp_path / "py3.7" / "windows-jsonschema.txt")
+    assert "Impersonating: windows" in windows.output
+
+
+def test_compile_many_workers(index_server, tmp_path):
+    index_server.RequestHandlerClass.add_project("pkg", {"1.0": []})
+    index_server.RequestHandlerClass.add_project("winpkg", {"1.0": []})
+    source = tmp_path / "markers.in"
+    source.write_text('pkg\nwinpkg ; sys_platform == "win32"\n')
+
+    linux, windows = compile_many(
+        [
+            Job(
+                str(source),
+                platform="linux",
+                py_version="3.8",
+                out_prefix="linux",
+                pip_args=index_server.pip_args,
+            ),
+            Job(
+                str(source),
+                platform="windows",
+                py_version="3.8",
+                out_prefix="windows",
+                pip_args=index_server.pip_args,
+            ),
+        ],
+        workers=2,
+    )
+
+    assert linux.success is True
+    assert windows.success is True
+    assert "winpkg" not in (tmp_path / "py3.8" / "linux-markers.txt").read_text()
+    assert "winpkg==1.0" in (tmp_path / "py3.8" / "windows-markers.txt").read_text()
+    # What each compile printed and logged, without the other one
+    assert "Impersonating: windows" not in linux.output
+    assert "Impersonating: linux" not in windows.output
+    assert "windows-markers.txt" not in linux.logs
+    assert "linux-markers.txt" not in windows.logs
+
+
+def test_compile_many_static_requirements(index_server, monkeypatch, tmp_path):
+    monkeypatch.delenv("USE_STATIC_REQUIREMENTS", raising=False)
+    source = tmp_path / "static.in"
+    source.write_text("pkg\n")
+
+    (result,) = compile_many(
+        [
+            Job(
+                str(source),
+                platform="linux",
+                py_version="3.8",
+                lock_graph=True,
+                static_requirements=True,
+                pip_args=index_server.pip_args,
+            )
+        ]
+    )
+
+    assert result.success is True
+    graph = lockgraph.read_lock_graph(lockgraph.lock_graph_path_for(result.output_path))
+    assert graph["profile"]["static_requirements"] == "1"
+    # Passed to the compile, not through the environment
+    assert "USE_STATIC_REQUIREMENTS" not in os.environ
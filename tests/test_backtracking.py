@@ -0,0 +1,95 @@
+"""
+    test_backtracking
+    ~~~~~~~~~~~~~~~~~
+
+    Test the backtracking resolver engine
+"""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def conflicting_index(index_server):
+    # The latest app needs a lib the other requirement rules out
+    index_server.RequestHandlerClass.add_project("app", {"1.0": ["lib==1.0"], "2.0": ["lib==2.0"]})
+    index_server.RequestHandlerClass.add_project(
+        "other", {version: ["lib==1.0"] for version in ("1.0", "1.1", "1.2")}
+    )
+    index_server.RequestHandlerClass.add_project(
+        "lib", {"1.0": [], "2.0": ['extra-dep; extra == "extra"']}
+    )
+    index_server.RequestHandlerClass.add_project("extra-dep", {"1.0": []})
+    return index_server
+
+
+def _compile(isolated_run_command, index_server, input_requirement, *args):
+    return isolated_run_command(
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        *index_server.pip_args,
+        *args,
+        str(input_requirement)
+    )
+
+
+def test_backtracking_resolves_conflicts(isolated_run_command, conflicting_index, tmp_path):
+    input_requirement = tmp_path / "app.in"
+    input_requirement.write_text("app\nother\n")
+    events_path = tmp_path / "events.ndjson"
+
+    # pip-tools' resolver picks the latest app, then gives up
+    assert _compile(isolated_run_command, conflicting_index, input_requirement) != 0
+    assert "lib==1.0,==2.0" in (tmp_path / "py3.8" / "app.log").read_text()
+
+    assert (
+        _compile(
+            isolated_run_command,
+            conflicting_index,
+            input_requirement,
+            "--resolver=backtracking",
+            "--events={}".format(events_path),
+        )
+        == 0
+    )
+    contents = (tmp_path / "py3.8" / "app.txt").read_text()
+    assert "app==1.0\n    # via -r {}".format(input_requirement) in contents
+    assert "lib==1.0\n    # via\n    #   app\n    #   other\n" in contents
+    with open(str(events_path)) as rfh:
+        events = [json.loads(line) for line in rfh]
+    (resolved,) = [event for event in events if event["event"] == "backtracking"]
+    assert resolved["backtracks"] >= 1
+
+
+def test_backtracking_same_output(isolated_run_command, conflicting_index, tmp_path):
+    input_requirement = tmp_path / "lib.in"
+    input_requirement.write_text("lib[extra]\npkg\n")
+
+    assert _compile(isolated_run_command, conflicting_index, input_requirement) == 0
+    legacy = (tmp_path / "py3.8" / "lib.txt").read_text()
+    assert "lib[extra]==2.0" in legacy
+    (tmp_path / "py3.8" / "lib.txt").unlink()
+
+    assert (
+        _compile(
+            isolated_run_command, conflicting_index, input_requirement, "--resolver=backtracking"
+        )
+        == 0
+    )
+    assert (tmp_path / "py3.8" / "lib.txt").read_text() == legacy
+
+
+def test_backtracking_no_candidate(isolated_run_command, conflicting_index, tmp_path):
+    input_requirement = tmp_path / "missing.in"
+    input_requirement.write_text("lib>=3\n")
+
+    assert (
+        _compile(
+            isolated_run_command, conflicting_index, input_requirement, "--resolver=backtracking"
+        )
+        != 0
+    )
+    log_contents = (tmp_path / "py3.8" / "missing.log").read_text()
+    assert "Could not find a version that matches lib>=3" in log_contents
+    assert "Tried: 1.0, 2.0" in log_contents
@@ -0,0 +1,96 @@
+"""
+    test_checkpoint
+    ~~~~~~~~~~~~~~~
+
+    Test resuming interrupted runs from their checkpoint
+"""
+import json
+import os
+
+from pip._internal.req.constructors import install_req_from_line
+
+from pip_tools_compile import checkpoint
+from pip_tools_compile import sharding
+
+REPO_ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+
+def test_checkpoint_targets(tmp_path):
+    source = tmp_path / "base.in"
+    source.write_text("pkg\n")
+    dest = tmp_path / "base.txt"
+    dest.write_text("pkg==1.0\n")
+    path = str(tmp_path / "checkpoint.json")
+    run_checkpoint = checkpoint.Checkpoint(path)
+
+    with run_checkpoint.target("base", [str(source)]):
+        run_checkpoint.add_pin(install_req_from_line("Pkg==1.0"))
+        run_checkpoint.end_round()
+    resumed = checkpoint.Checkpoint.load(path)
+    with resumed.target("base", [str(source)]):
+        assert resumed.get_pins() == {"pkg": "1.0"}
+    source.write_text("pkg<1\n")
+    with resumed.target("base", [str(source)]):
+        # Found from other inputs
+        assert resumed.get_pins() == {}
+
+    resumed.complete("base", [str(source)], str(dest))
+    resumed = checkpoint.Checkpoint.load(path)
+    assert resumed.is_completed("base", [str(source)], str(dest))
+    dest.write_text("pkg==0.9\n")
+    assert not resumed.is_completed("base", [str(source)], str(dest))
+
+
+def test_compile_resume(isolated_run_command, index_server, tmp_path):
+    compiled = tmp_path / "compiled.in"
+    compiled.write_text("pkg\n")
+    interrupted = tmp_path / "interrupted.in"
+    interrupted.write_text("dep\nlate\n")
+    events_path = tmp_path / "events.ndjson"
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--events={}".format(events_path),
+        *index_server.pip_args,
+        str(compiled),
+        str(interrupted),
+    )
+    checkpoints_dir = tmp_path / "cache" / "pip-tools" / "checkpoints"
+
+    assert isolated_run_command(*cmd) != 0
+    # Not checkpointed
+    assert not checkpoints_dir.exists()
+    assert isolated_run_command(*cmd, "--checkpoint") != 0
+    # The run went through all its targets, the failed one is compiled again next time
+    assert list(checkpoints_dir.glob("*.json")) == []
+
+    # As if the run was interrupted after pinning dep, before the next version was released
+    checkpoint_path = checkpoints_dir / os.path.basename(
+        checkpoint.get_checkpoint_path(cmd[1:], cwd=REPO_ROOT)
+    )
+    run_checkpoint = checkpoint.Checkpoint(str(checkpoint_path))
+    run_checkpoint.complete(
+        sharding.get_work_item_key(str(compiled), "windows", "3.8", None),
+        [str(compiled)],
+        str(tmp_path / "py3.8" / "compiled.txt"),
+    )
+    with run_checkpoint.target(
+        sharding.get_work_item_key(str(interrupted), "windows", "3.8", None), [str(interrupted)]
+    ):
+        run_checkpoint.add_pin(install_req_from_line("dep==1.0"))
+        run_checkpoint.end_round()
+    index_server.RequestHandlerClass.add_project("dep", {"1.0": [], "2.0": []})
+    index_server.RequestHandlerClass.add_project("late", {"1.0": []})
+
+    assert isolated_run_command(*cmd, "--resume") == 0
+    with open(str(events_path)) as rfh:
+        events = [json.loads(line) for line in rfh]
+    assert [event["dest"] for event in events if event["event"] == "target_resumed"] == [
+        str(tmp_path / "py3.8" / "compiled.txt")
+    ]
+    contents = (tmp_path / "py3.8" / "interrupted.txt").read_text()
+    assert "dep==1.0" in contents
+    assert "late==1.0" in contents
+    # The run is over
+    assert not checkpoint_path.exists()
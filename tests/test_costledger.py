@@ -0,0 +1,79 @@
+"""
+    test_costledger
+    ~~~~~~~~~~~~~~~
+
+    Test the per project cost report
+"""
+import json
+
+from pip_tools_compile import costledger
+
+
+def _compile(isolated_run_command, index_server, input_requirement):
+    return isolated_run_command(
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--cost-report",
+        *index_server.pip_args,
+        str(input_requirement)
+    )
+
+
+def test_cost_report(isolated_run_command, index_server, tmp_path):
+    index_server.RequestHandlerClass.add_project("solo", {"1.0": []})
+    input_requirement = tmp_path / "costs.in"
+    input_requirement.write_text("pkg\nsolo\n")
+
+    assert _compile(isolated_run_command, index_server, input_requirement) == 0
+    with open(str(tmp_path / "py3.8" / "costs.costs.json")) as rfh:
+        report = json.load(rfh)
+
+    projects = {entry["name"]: entry for entry in report["projects"]}
+    assert set(projects) == {"pkg", "dep", "solo"}
+    dep = projects["dep"]
+    assert dep["pinned"] is True
+    assert dep["via"] == ["pkg"]
+    assert dep["pulled_in_by"] == ["pkg"]
+    assert dep["index_requests"] == 1
+    assert dep["downloads"] == 1
+    assert dep["bytes"] == sum(
+        len(index_server.RequestHandlerClass.files[path])
+        for path in ("/simple/dep/", "/files/dep-1.0-py3-none-any.whl")
+    )
+    assert dep["builds"] == 0
+    assert projects["pkg"]["pulled_in_by"] == ["pkg"]
+    seconds = [entry["seconds"] for entry in report["projects"]]
+    assert seconds == sorted(seconds, reverse=True)
+
+    requirements = {entry["name"]: entry for entry in report["requirements"]}
+    assert requirements["pkg"]["exclusive_projects"] == ["dep", "pkg"]
+    assert requirements["pkg"]["bytes"] == projects["pkg"]["bytes"] + dep["bytes"]
+    assert requirements["solo"]["exclusive_projects"] == ["solo"]
+    assert report["totals"]["index_requests"] == 3
+
+
+def test_cost_report_failed_compile(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "missing.in"
+    input_requirement.write_text("pkg\nmissing\n")
+
+    assert _compile(isolated_run_command, index_server, input_requirement) != 0
+    assert (tmp_path / "py3.8" / "missing.log").exists()
+    with open(str(tmp_path / "py3.8" / "missing.costs.json")) as rfh:
+        report = json.load(rfh)
+    projects = {entry["name"]: entry for entry in report["projects"]}
+    # Nothing was pinned, the costs are still there. The page is asked again by the negative
+    # cache, for its validators.
+    assert projects["missing"]["index_requests"] >= 1
+    assert projects["missing"]["pinned"] is False
+    assert report["requirements"] == []
+
+
+def test_pulled_in_by():
+    ledger = costledger.CostLedger()
+    ledger.via = {"a": [], "b": [], "c": ["a", "b"], "d": ["c"], "e": ["e-parent"]}
+    ledger.top_level = {"a": ["-r base.in"], "b": ["-r extra.in"]}
+
+    assert ledger.get_pulled_in_by("d") == ["a", "b"]
+    assert ledger.get_pulled_in_by("a") == ["a"]
+    assert ledger.get_pulled_in_by("e") == []
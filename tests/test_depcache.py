@@ -0,0 +1,83 @@
+"""
+    test_depcache
+    ~~~~~~~~~~~~~
+
+    Test the naming and migration of the pip-tools dependency cache files
+"""
+import json
+import os
+
+from piptools.scripts import compile as piptools_compile
+
+from pip_tools_compile.__main__ import DEPCACHE_SCHEMA
+from pip_tools_compile.__main__ import ImpersonateLinux
+from pip_tools_compile.__main__ import ImpersonateWindows
+
+
+def _write_depcache(path, dependencies, mtime):
+    path.write_text(json.dumps({"__format__": 1, "dependencies": dependencies}))
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_depcache_name(tmp_path, monkeypatch):
+    monkeypatch.delenv("USE_STATIC_REQUIREMENTS", raising=False)
+    monkeypatch.setenv("PIP_TOOLS_COMPILE_CLEAN_CACHE", "0")
+    with ImpersonateLinux("3.8", "linux"):
+        depcache = piptools_compile.DependencyCache(str(tmp_path))
+    with ImpersonateLinux("3.8", "linux", "arm64"):
+        arm64_depcache = piptools_compile.DependencyCache(str(tmp_path))
+
+    # Nothing from the host or the installed pip-tools-compile
+    assert os.path.basename(depcache._cache_file) == (
+        "depcache-v{}-linux-x86_64-mocked-py3.8.json".format(DEPCACHE_SCHEMA)
+    )
+    assert os.path.basename(arm64_depcache._cache_file) == (
+        "depcache-v{}-linux-arm64-mocked-py3.8.json".format(DEPCACHE_SCHEMA)
+    )
+
+
+def test_depcache_legacy_migration(tmp_path, monkeypatch):
+    monkeypatch.delenv("USE_STATIC_REQUIREMENTS", raising=False)
+    monkeypatch.setenv("PIP_TOOLS_COMPILE_CLEAN_CACHE", "0")
+    older = tmp_path / "depcache-linux-ptc1.0-py3.9-mocked-py3.8.json"
+    newer = tmp_path / "depcache-linux-ptc1.1-py3.11-mocked-py3.8.json"
+    corrupt = tmp_path / "depcache-linux-ptc0.9-py3.6-mocked-py3.8.json"
+    other_target = tmp_path / "depcache-linux-ptc1.1-py3.11-mocked-py3.7.json"
+    _write_depcache(older, {"pkg": {"1.0": ["dep>=1"], "0.9": []}}, 1000)
+    _write_depcache(newer, {"pkg": {"1.0": ["dep>=2"]}, "dep": {"2.0": []}}, 2000)
+    corrupt.write_text("{")
+    _write_depcache(other_target, {"other": {"1.0": []}}, 2000)
+
+    with ImpersonateLinux("3.8", "linux", "arm64"):
+        # Legacy files did not tell the machine apart, they are only reused for the default one
+        assert piptools_compile.DependencyCache(str(tmp_path)).cache == {}
+    with ImpersonateLinux("3.8", "linux"):
+        depcache = piptools_compile.DependencyCache(str(tmp_path))
+
+    assert depcache.cache == {
+        "pkg": {"1.0": ["dep>=2"], "0.9": []},
+        "dep": {"2.0": []},
+    }
+    assert not older.exists()
+    assert not newer.exists()
+    assert corrupt.exists()
+    assert other_target.exists()
+
+
+def test_depcache_machine_spelling(tmp_path):
+    legacy = tmp_path / "depcache-win32-ptc1.1-py3.11-mocked-py3.8.json"
+    _write_depcache(legacy, {"pkg": {"1.0": []}}, 1000)
+
+    with ImpersonateWindows("3.8", "windows", "amd64") as impersonation:
+        depcache = piptools_compile.DependencyCache(str(tmp_path))
+    with ImpersonateWindows("3.8", "windows", "AMD64"):
+        other_depcache = piptools_compile.DependencyCache(str(tmp_path))
+
+    # The default machine of the system, however it is spelled
+    assert impersonation.platform_machine == "AMD64"
+    assert os.path.basename(depcache._cache_file) == (
+        "depcache-v{}-win32-AMD64-mocked-py3.8.json".format(DEPCACHE_SCHEMA)
+    )
+    assert other_depcache._cache_file == depcache._cache_file
+    assert depcache.cache == {"pkg": {"1.0": []}}
+    assert not legacy.exists()
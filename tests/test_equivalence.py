@@ -0,0 +1,188 @@
+"""
+    test_equivalence
+    ~~~~~~~~~~~~~~~~
+
+    Test sharing compiled results between systems which resolve the same
+"""
+import json
+
+from pip._internal.index.package_finder import LinkEvaluator
+from pip._internal.models.link import Link
+from pip._internal.req.constructors import install_req_from_line
+from pip._vendor.packaging.markers import Marker
+
+from pip_tools_compile import equivalence
+from pip_tools_compile.__main__ import ImpersonateLinux
+from pip_tools_compile.__main__ import ImpersonateWindows
+from pip_tools_compile.__main__ import TargetPython
+from pip_tools_compile.api import compile_many
+from pip_tools_compile.api import Job
+
+
+def _get_target_python(impersonation):
+    # pylint: disable=protected-access
+    return TargetPython(impersonation._python_version_info, impersonation._platform)
+    # pylint: enable=protected-access
+
+
+def test_get_template_fields():
+    assert equivalence.get_template_fields("requirements/static/{platform}.in") == ["platform"]
+    assert equivalence.get_template_fields("a{py_version}", "{platform}", "b") == [
+        "platform",
+        "py_version",
+    ]
+    assert equivalence.get_template_fields("requirements/static/linux.in") == []
+
+
+def test_rewrite_header():
+    contents = (
+        "#\n"
+        "# This file is autogenerated by pip-compile\n"
+        "#\n"
+        "#    pip-compile --output-file=py3.8/base.txt base.in\n"
+        "#\n"
+        "six==1.16.0\n"
+        "    # via -r py3.8/base.in\n"
+    )
+    assert equivalence.strip_header(contents) == "six==1.16.0\n    # via -r py3.8/base.in\n"
+    rewritten = equivalence.rewrite_header(contents, "py3.8/base.txt", "py3.9/base.txt")
+    assert "--output-file=py3.9/base.txt" in rewritten
+    # Only the header is rewritten
+    assert rewritten.endswith("# via -r py3.8/base.in\n")
+
+
+def test_marker_differences():
+    recorder = equivalence.DecisionRecorder((3, 8, 0))
+    with ImpersonateWindows("3.8", "windows"):
+        with equivalence.activate(recorder):
+            assert Marker('sys_platform == "win32"').evaluate() is True
+            assert (
+                Marker('python_version < "3.8" and extra == "format"').evaluate({"extra": "format"})
+                is False
+            )
+        # Not recorded outside of the context
+        Marker('os_name == "nt"').evaluate()
+    assert len(recorder.markers) == 2
+
+    with ImpersonateWindows("3.9", "windows") as impersonation:
+        assert recorder.get_differences(_get_target_python(impersonation)) == []
+    with ImpersonateWindows("3.7", "windows") as impersonation:
+        differences = recorder.get_differences(_get_target_python(impersonation))
+    assert differences == [
+        "marker 'python_version < \"3.8\" and extra == \"format\"' {'extra': 'format'}"
+    ]
+    with ImpersonateLinux("3.8", "linux") as impersonation:
+        differences = recorder.get_differences(_get_target_python(impersonation))
+    assert differences == ["marker 'sys_platform == \"win32\"' {}"]
+
+
+def test_link_differences_only_matter_for_versions_which_may_be_picked():
+    links = [
+        Link("https://example.com/foo-1.0.tar.gz", requires_python=">=3.6"),
+        Link("https://example.com/foo-2.0.tar.gz", requires_python=">=3.10"),
+    ]
+
+    def record(specifier):
+        recorder = equivalence.DecisionRecorder((3, 9, 0))
+        with ImpersonateWindows("3.9", "windows") as impersonation:
+            link_evaluator = LinkEvaluator(
+                project_name="foo",
+                canonical_name="foo",
+                formats=frozenset(["binary", "source"]),
+                target_python=_get_target_python(impersonation),
+                allow_yanked=True,
+            )
+            with equivalence.activate(recorder):
+                for link in links:
+                    link_evaluator.evaluate_link(link)
+        recorder.add_best_match(
+            install_req_from_line("foo{}".format(specifier)),
+            None,
+            install_req_from_line("foo==1.0"),
+            False,
+        )
+        return recorder
+
+    with ImpersonateWindows("3.10", "windows") as impersonation:
+        target_python = _get_target_python(impersonation)
+        # foo 2.0 is only usable on 3.10, where it would be picked
+        assert record("").get_differences(target_python) == ["usable file foo-2.0.tar.gz"]
+        # Unless it could not be picked anyway
+        assert record("<2").get_differences(target_python) == []
+        # Every usable file counts when hashes are generated
+        assert record("<2").get_differences(target_python, hashes=True) == [
+            "usable file foo-2.0.tar.gz"
+        ]
+
+
+def test_compile_many_share_equivalent(tmp_path):
+    jsonschema_in = tmp_path / "jsonschema.in"
+    jsonschema_in.write_text("jsonschema==2.6.0\n")
+    jobs = [
+        Job(str(jsonschema_in), platform="windows", py_version="3.8"),
+        Job(str(jsonschema_in), platform="windows", py_version="3.9"),
+    ]
+    # Both systems have compiled the file, and know its dependencies, before
+    for result in compile_many(jobs):
+        assert result.success is True
+
+    first, second = compile_many(jobs, share_equivalent=True)
+
+    assert first.success is True
+    assert "Impersonating: windows" in first.output
+    assert second.success is True
+    assert "resolves exactly like" in second.output
+    contents = (tmp_path / "py3.9" / "jsonschema.txt").read_text()
+    assert "jsonschema==2.6.0" in contents
+    assert str(tmp_path / "py3.9" / "jsonschema.txt") in contents
+    assert str(tmp_path / "py3.8" / "jsonschema.txt") not in contents
+
+
+def test_compile_many_share_equivalent_templated(tmp_path, monkeypatch):
+    # Templated constraints are relative to the current directory
+    monkeypatch.chdir(tmp_path)
+    requirements_in = tmp_path / "requirements.in"
+    requirements_in.write_text("jsonschema\n-c {py_version}.txt\n")
+    for py_version in ("3.8", "3.9"):
+        (tmp_path / "{}.txt".format(py_version)).write_text("jsonschema==2.6.0\n")
+    jobs = [
+        Job(str(requirements_in), platform="windows", py_version="3.8"),
+        Job(str(requirements_in), platform="windows", py_version="3.9"),
+    ]
+
+    results = compile_many(jobs, share_equivalent=True)
+
+    # The constraints depend on the Python version, both are compiled
+    for result in results:
+        assert result.success is True
+        assert "Impersonating: windows" in result.output
+
+
+def test_compile_many_share_equivalent_static_requirements(index_server, tmp_path):
+    source = tmp_path / "static.in"
+    source.write_text("pkg\n")
+    cache_dir = tmp_path / "cache"
+    jobs = [
+        Job(
+            str(source),
+            platform="windows",
+            py_version=py_version,
+            static_requirements=True,
+            pip_args=[*index_server.pip_args, "--cache-dir={}".format(cache_dir)],
+        )
+        for py_version in ("3.8", "3.9")
+    ]
+    for result in compile_many(jobs):
+        assert result.success is True
+    (static_depcache,) = cache_dir.glob("depcache-*-static-*-py3.9.json")
+    doc = json.loads(static_depcache.read_text())
+    # The static dependency cache of the second system disagrees, the other one agrees
+    cache_dir.joinpath(static_depcache.name.replace("-static", "")).write_text(json.dumps(doc))
+    doc["dependencies"]["pkg"]["1.0"].append("extra")
+    static_depcache.write_text(json.dumps(doc))
+
+    first, second = compile_many(jobs, share_equivalent=True)
+
+    assert first.success is True
+    assert "resolves exactly like" not in second.output
+    assert "Impersonating: windows" in second.output
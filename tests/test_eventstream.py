@@ -0,0 +1,85 @@
+"""
+    test_eventstream
+    ~~~~~~~~~~~~~~~~
+
+    Test the live progress events of compile runs
+"""
+import io
+import json
+import threading
+
+from pip._vendor import requests
+
+from pip_tools_compile import eventstream
+
+
+def _read_events(path):
+    with open(path) as rfh:
+        return [json.loads(line) for line in rfh]
+
+
+def test_fetches_are_tagged_with_their_target_from_any_thread(index_server):
+    stream = io.StringIO()
+    url = "http://127.0.0.1:{}/simple/pkg/".format(index_server.server_address[1])
+    with eventstream.activate(eventstream.EventStream(stream)):
+        with eventstream.target("pkg.in::linux-py3.8") as result:
+            session = requests.Session()
+            eventstream.get_current_stream().install(session)
+            thread = threading.Thread(target=session.get, args=(url,))
+            thread.start()
+            thread.join()
+            result["success"] = True
+        # Left open, not owned by the event stream
+        assert not stream.closed
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    assert [event["event"] for event in events] == [
+        "target_started",
+        "fetch_started",
+        "fetch_finished",
+        "target_finished",
+    ]
+    assert all(event["target"] == "pkg.in::linux-py3.8" for event in events)
+    fetch_finished = events[2]
+    assert fetch_finished["url"] == url
+    assert fetch_finished["status"] == 200
+    assert fetch_finished["bytes"] > 0
+    assert events[-1]["success"] is True
+
+
+def test_compile_events(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "events.in"
+    input_requirement.write_text("pkg\n")
+    events_path = tmp_path / "events.ndjson"
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--events={}".format(events_path),
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+    assert isolated_run_command(*cmd) == 0
+
+    events = _read_events(str(events_path))
+    names = [event["event"] for event in events]
+    assert names[0] == "run_started"
+    assert names[1] == "target_started"
+    assert names[-2:] == ["target_finished", "run_finished"]
+    assert "round_started" in names
+    target = events[1]["target"]
+    assert target.endswith("events.in::windows-py3.8")
+    assert all(event["target"] == target for event in events[1:-1])
+    fetched = [event["url"] for event in events if event["event"] == "fetch_finished"]
+    assert any(url.endswith("/simple/pkg/") for url in fetched)
+    assert events[-3] == dict(
+        events[-3], event="output", path=str(tmp_path / "py3.8" / "events.txt"), changed=True
+    )
+    assert events[-2]["success"] is True
+    assert events[-2]["rounds"] >= 1
+    assert events[-1]["exitcode"] == 0
+
+    # Nothing changes the second time
+    assert isolated_run_command(*cmd) == 0
+    events = _read_events(str(events_path))
+    assert [event for event in events if event["event"] == "output"][0]["changed"] is False
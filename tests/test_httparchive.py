@@ -0,0 +1,100 @@
+"""
+    test_httparchive
+    ~~~~~~~~~~~~~~~~
+
+    Test recording the HTTP traffic of compiles and replaying it
+"""
+import zipfile
+
+import pytest
+from pip._vendor import requests
+
+from pip_tools_compile import httparchive
+
+
+def test_record_and_replay_session(index_server, tmp_path):
+    archive = str(tmp_path / "traffic.zip")
+    url = "http://127.0.0.1:{}/simple/pkg/".format(index_server.server_address[1])
+    for _ in range(2):
+        with httparchive.ArchiveRecorder(archive) as recorder:
+            session = requests.Session()
+            recorder.install(session)
+            contents = session.get(url).content
+            assert session.get(url + "missing/").status_code == 404
+
+    with zipfile.ZipFile(archive) as zfh:
+        names = zfh.namelist()
+    # Each body is stored once, each recording adds an index
+    assert len([name for name in names if name.startswith("blobs/")]) == 2
+    assert len([name for name in names if name.startswith("index/")]) == 2
+
+    index_server.shutdown()
+    with httparchive.ArchiveReplayer(archive) as replayer:
+        session = requests.Session()
+        replayer.install(session)
+        response = session.get(url)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "text/html"
+        assert response.content == contents
+        assert session.get(url + "missing/").status_code == 404
+        with pytest.raises(httparchive.NotRecorded):
+            session.get(url.replace("pkg", "dep"))
+    assert replayer.misses == [url.replace("pkg", "dep")]
+
+
+def test_record_and_replay_compile(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "archive.in"
+    input_requirement.write_text("pkg\n")
+    archive = tmp_path / "traffic.zip"
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--clean-cache",
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+    assert isolated_run_command(*cmd, "--record={}".format(archive)) == 0
+    recorded = (tmp_path / "py3.8" / "archive.txt").read_text()
+    assert "dep==1.0" in recorded
+    assert "/files/pkg-1.0-py3-none-any.whl" in index_server.RequestHandlerClass.requested
+
+    index_server.shutdown()
+    (tmp_path / "py3.8" / "archive.txt").unlink()
+    isolated_run_command.environ["XDG_CACHE_HOME"] = str(tmp_path / "other-cache")
+    assert isolated_run_command(*cmd, "--replay={}".format(archive)) == 0
+    assert (tmp_path / "py3.8" / "archive.txt").read_text() == recorded
+
+
+def test_replay_lists_requests_not_recorded(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "archive.in"
+    input_requirement.write_text("pkg\n")
+    archive = tmp_path / "traffic.zip"
+    with zipfile.ZipFile(str(archive), "w"):
+        pass
+    cmd = (
+        "pip-tools-compile",
+        "-v",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--replay={}".format(archive),
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+    assert isolated_run_command(*cmd) != 0
+    assert index_server.RequestHandlerClass.requested == []
+    error_log = (tmp_path / "py3.8" / "archive.log").read_text()
+    assert "these requests were not recorded" in error_log
+    assert "http://127.0.0.1:{}/simple/pkg/".format(index_server.server_address[1]) in error_log
+
+
+def test_record_needs_network(run_command, tmp_path):
+    input_requirement = tmp_path / "archive.in"
+    input_requirement.write_text("pkg\n")
+    cmd = (
+        "pip-tools-compile",
+        "--offline",
+        "--record={}".format(tmp_path / "traffic.zip"),
+        str(input_requirement),
+    )
+    assert run_command(*cmd) == 2
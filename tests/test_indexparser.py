@@ -0,0 +1,94 @@
+"""
+    test_indexparser
+    ~~~~~~~~~~~~~~~~
+
+    Test the streaming parser of index project pages
+"""
+import pytest
+from pip._internal.index.collector import HTMLPage
+from pip._internal.index.collector import parse_links
+from pip._internal.index.package_finder import LinkEvaluator
+
+from pip_tools_compile import indexparser
+from pip_tools_compile.__main__ import TargetPython
+
+PAGE_URL = "https://pypi.org/simple/pkg/"
+
+ANCHORS = (
+    '<a href="https://files/pkg-1.0.tar.gz#sha256=abc">pkg-1.0.tar.gz</a>',
+    '<a href="https://files/pkg-1.0-py2.py3-none-any.whl">pkg-1.0-py2.py3-none-any.whl</a>',
+    '<a href="https://files/pkg-1.0-cp37-cp37m-win_amd64.whl">pkg-1.0-cp37-cp37m-win_amd64.whl</a>',
+    '<a href="https://files/pkg-1.0-cp37-cp37m-manylinux1_x86_64.whl">manylinux1</a>',
+    '<a href="https://files/pkg-2.0.tar.gz" data-requires-python="&gt;=3.8">pkg-2.0.tar.gz</a>',
+    '<a href="https://files/pkg-2.0-py3-none-any.whl" data-requires-python="&amp;gt;=3.6">2.0</a>',
+    '<a href="../../files/pkg-3.0.tar.gz" data-yanked>pkg-3.0.tar.gz</a>',
+    '<a href="https://files/pkg-3.1.tar.gz" data-yanked="Broken &amp; bad">pkg-3.1.tar.gz</a>',
+    '<a href="https://files/pkg-4.0.tar.gz" data-requires-python="not a specifier">4.0</a>',
+    "<a>No href</a>",
+)
+
+
+def _page(anchors=ANCHORS, head=""):
+    content = "<!DOCTYPE html><html><head>{}</head><body>\n{}\n</body></html>".format(
+        head, "<br/>\n".join(anchors)
+    )
+    return HTMLPage(content.encode("utf-8"), "utf-8", PAGE_URL, cache_link_parsing=False)
+
+
+@pytest.fixture
+def link_evaluator():
+    return LinkEvaluator(
+        project_name="pkg",
+        canonical_name="pkg",
+        formats=frozenset(["binary", "source"]),
+        target_python=TargetPython((3, 7, 0), "linux_x86_64"),
+        allow_yanked=True,
+    )
+
+
+def _link_attributes(link):
+    return link.url, link.comes_from, link.requires_python, link.yanked_reason
+
+
+def test_same_candidates_as_pip(link_evaluator):
+    page = _page()
+    expected = [
+        _link_attributes(link)
+        for link in parse_links(page)
+        if link_evaluator.evaluate_link(link)[0] is True
+    ]
+    link_filter = indexparser.LinkFilter(link_evaluator)
+    links = list(indexparser.iter_links(page, link_filter, chunk_size=64))
+    assert [_link_attributes(link) for link in links] == expected
+    # The windows and manylinux wheels and the python 3.8+ release are dropped while parsing
+    assert link_filter.rejected == 3
+    assert len(links) == 6
+    yanked = {link.filename: link.yanked_reason for link in links if link.is_yanked}
+    assert yanked == {"pkg-3.0.tar.gz": "", "pkg-3.1.tar.gz": "Broken & bad"}
+
+
+def test_rejection_reasons(link_evaluator):
+    rejected = []
+    link_filter = indexparser.LinkFilter(
+        link_evaluator, on_reject=lambda filename, reason: rejected.append((filename, reason))
+    )
+    list(indexparser.iter_links(_page(), link_filter))
+    assert rejected == [
+        (
+            "pkg-1.0-cp37-cp37m-win_amd64.whl",
+            "none of the wheel's tags match: cp37-cp37m-win_amd64",
+        ),
+        (
+            "pkg-1.0-cp37-cp37m-manylinux1_x86_64.whl",
+            "none of the wheel's tags match: cp37-cp37m-manylinux1_x86_64",
+        ),
+        ("pkg-2.0.tar.gz", "requires-python >=3.8 does not match Python 3.7"),
+    ]
+
+
+def test_pages_with_base_tag_are_left_to_pip(link_evaluator):
+    page = _page(head='<base href="https://mirror/simple/pkg/">')
+    link_filter = indexparser.LinkFilter(link_evaluator)
+    links = list(indexparser.iter_links(page, link_filter))
+    assert [link.url for link in links] == [link.url for link in parse_links(page)]
+    assert link_filter.rejected == 0
@@ -0,0 +1,85 @@
+"""
+    test_inputcheck
+    ~~~~~~~~~~~~~~~
+
+    Test checking the direct requirements before resolving them
+"""
+import pytest
+from pip._internal.req.constructors import install_req_from_line
+from pip._vendor.packaging.specifiers import SpecifierSet
+
+from pip_tools_compile import inputcheck
+
+
+@pytest.mark.parametrize(
+    "specifiers,satisfiable",
+    (
+        ("==1.9.121,>=1.9.123", False),
+        (">=1.9.123", True),
+        ("==1.0,!=1.0", False),
+        (">2,<2.0.1", True),
+        (">=2,<2", False),
+        ("~=1.4.5,!=1.4.*", False),
+        (">=1.9,!=1.9.*", True),
+        ("==1.*,<1", False),
+        # Left to the resolver
+        (">1.0.dev0,<1.0.dev5", True),
+        ("===foo", True),
+    ),
+)
+def test_is_satisfiable(specifiers, satisfiable):
+    assert inputcheck.is_satisfiable(SpecifierSet(specifiers)) is satisfiable
+
+
+def test_find_conflicts():
+    ireqs = [
+        install_req_from_line("Boto3==1.9.121", comes_from="-r base.txt (line 1)"),
+        install_req_from_line("boto3>=1.9.123", comes_from="-r extra.txt (line 3)"),
+        install_req_from_line("six>=2", comes_from="-r extra.txt (line 4)"),
+        install_req_from_line("six<2", comes_from="-c constraints.txt (line 1)", constraint=True),
+        # Only constraints, which only apply once required
+        install_req_from_line("idna<2", comes_from="-c constraints.txt (line 2)", constraint=True),
+        install_req_from_line("idna>2", comes_from="-c constraints.txt (line 3)", constraint=True),
+    ]
+
+    conflicts = inputcheck.find_conflicts(ireqs)
+    assert [(name, len(group)) for name, group in conflicts] == [("boto3", 2), ("six", 2)]
+    message = str(inputcheck.ConflictingInputs(conflicts))
+    assert "No version of boto3 satisfies all these requirements:" in message
+    assert "  boto3>=1.9.123 (from -r extra.txt (line 3))" in message
+    assert "  six<2 (from -c constraints.txt (line 1))" in message
+
+
+def test_deduplicate():
+    ireqs = [
+        install_req_from_line("pkg>=1", comes_from="-r base.txt (line 1)"),
+        install_req_from_line("pkg>=1", comes_from="-r base.txt (line 1)"),
+        install_req_from_line("pkg>=1", comes_from="-r other.txt (line 1)"),
+    ]
+    assert inputcheck.deduplicate(ireqs) == [ireqs[0], ireqs[2]]
+
+
+def test_compile_conflicting_inputs(isolated_run_command, index_server, tmp_path):
+    include = tmp_path / "base.txt"
+    include.write_text("pkg==1.0\n")
+    input_requirement = tmp_path / "conflict.in"
+    input_requirement.write_text('pkg>=2\npkg>=3 ; sys_platform == "linux"\n')
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--include={}".format(include),
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+
+    assert isolated_run_command(*cmd, "--platform=windows") != 0
+    log_contents = (tmp_path / "py3.8" / "conflict.log").read_text()
+    assert "No version of pkg satisfies all these requirements:" in log_contents
+    assert "  pkg==1.0 (from -r {} (line 1))".format(include) in log_contents
+    # Failed before asking the index, and without the requirement for another platform
+    assert index_server.RequestHandlerClass.requested == []
+    assert "pkg>=3" not in log_contents
+
+    input_requirement.write_text('pkg\npkg<1 ; sys_platform == "linux"\n')
+    assert isolated_run_command(*cmd, "--platform=windows") == 0
+    assert "pkg==1.0" in (tmp_path / "py3.8" / "conflict.txt").read_text()
@@ -0,0 +1,146 @@
+"""
+    test_localproxy
+    ~~~~~~~~~~~~~~~
+
+    Test the local caching proxy shared by concurrent compiles
+"""
+import json
+import os
+import signal
+import threading
+import time
+
+import pytest
+from pip._internal.network.session import PipSession
+
+from pip_tools_compile import localproxy
+
+
+@pytest.fixture
+def proxy_server(tmp_path):
+    server = localproxy.ProxyServer(str(tmp_path / "proxy"), connections=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _make_session(proxy_server, tmp_path, name="session"):
+    session = PipSession(cache=str(tmp_path / name))
+    localproxy.install(session, proxy_server.url)
+    return session
+
+
+def test_proxy_coalesces_requests(proxy_server, index_server, tmp_path):
+    path = "/files/pkg-1.0-py3-none-any.whl"
+    url = "http://127.0.0.1:{}{}".format(index_server.server_address[1], path)
+    responses = []
+
+    def fetch(number):
+        session = _make_session(proxy_server, tmp_path, "session-{}".format(number))
+        responses.append(session.get(url))
+
+    # Hold the connections to the index until every request is in flight
+    for _ in range(2):
+        proxy_server.upstream_slots.acquire()
+    threads = [threading.Thread(target=fetch, args=(number,)) for number in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    while proxy_server.stats["coalesced"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    for _ in range(2):
+        proxy_server.upstream_slots.release()
+    for thread in threads:
+        thread.join()
+
+    assert index_server.RequestHandlerClass.requested.count(path) == 1
+    wheel = index_server.RequestHandlerClass.files[path]
+    assert [response.content for response in responses] == [wheel] * 5
+    assert {response.url for response in responses} == {url}
+    assert proxy_server.stats["miss"] == 1
+    assert proxy_server.stats["coalesced"] == 4
+
+
+def test_proxy_caches_responses(proxy_server, index_server, tmp_path):
+    index_url = "http://127.0.0.1:{}/simple".format(index_server.server_address[1])
+    session = _make_session(proxy_server, tmp_path)
+
+    response = session.get(index_url + "/pkg/", headers={"Cache-Control": "max-age=0"})
+    assert response.status_code == 200
+    assert response.headers[localproxy.SOURCE_HEADER] == "miss"
+    assert b"pkg-1.0-py3-none-any.whl" in response.content
+
+    # Another process, without pip's HTTP cache, asking for a revalidated page
+    other_session = _make_session(proxy_server, tmp_path, "other-session")
+    response = other_session.get(index_url + "/pkg/", headers={"Cache-Control": "max-age=0"})
+    assert response.headers[localproxy.SOURCE_HEADER] == "hit"
+    assert index_server.RequestHandlerClass.requested.count("/simple/pkg/") == 1
+
+    # Without a lifetime, the response is asked for again
+    assert other_session.get(index_url + "/missing/").status_code == 404
+    assert session.get(index_url + "/missing/").headers[localproxy.SOURCE_HEADER] == "miss"
+    assert index_server.RequestHandlerClass.requested.count("/simple/missing/") == 2
+
+
+def test_proxy_keys_on_the_verification(proxy_server, index_server, tmp_path):
+    url = "http://127.0.0.1:{}/simple/pkg/".format(index_server.server_address[1])
+    ca_bundle = tmp_path / "ca.pem"
+    ca_bundle.write_text("")
+    ca_bundle = str(ca_bundle)
+    client_cert = tmp_path / "client.pem"
+    client_cert.write_text("")
+
+    def fetch(**kwargs):
+        download, source = proxy_server.get("GET", url, {}, **kwargs)
+        download.wait_meta()
+        return source
+
+    assert fetch(verify=False) == "miss"
+    # Fetched without verifying the index, not shared with the sessions which verify it
+    assert fetch() == "miss"
+    assert fetch(verify=ca_bundle) == "miss"
+    assert fetch(verify=ca_bundle, cert=str(client_cert)) == "miss"
+    assert fetch(verify=False) == "hit"
+    assert fetch(verify=ca_bundle) == "hit"
+    assert index_server.RequestHandlerClass.requested.count("/simple/pkg/") == 4
+
+
+def test_proxy_upstream_failure(proxy_server, tmp_path):
+    session = _make_session(proxy_server, tmp_path)
+    # Nothing listens there
+    response = session.get("http://127.0.0.1:1/simple/pkg/")
+    assert response.status_code == 502
+
+
+def test_compile_through_local_proxy(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "proxied.in"
+    input_requirement.write_text("pkg\n")
+    proxy_dir = tmp_path / "cache" / "pip-tools" / "proxy"
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--local-proxy",
+        "--local-proxy-idle-timeout=30",
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+    try:
+        assert isolated_run_command(*cmd, "--platform=windows") == 0
+        assert "dep==1.0" in (tmp_path / "py3.8" / "proxied.txt").read_text()
+        with open(str(proxy_dir / "proxy.json")) as rfh:
+            state = json.load(rfh)
+
+        # pip revalidates the index pages, the proxy answers from its cache
+        assert isolated_run_command(*cmd, "--platform=linux", "--clean-cache") == 0
+        with open(str(proxy_dir / "proxy.json")) as rfh:
+            assert json.load(rfh) == state
+        assert index_server.RequestHandlerClass.requested.count("/simple/pkg/") == 1
+        assert index_server.RequestHandlerClass.requested.count("/simple/dep/") == 1
+    finally:
+        if (proxy_dir / "proxy.json").exists():
+            with open(str(proxy_dir / "proxy.json")) as rfh:
+                os.kill(json.load(rfh)["pid"], signal.SIGTERM)
@@ -0,0 +1,119 @@
+"""
+    test_lockgraph
+    ~~~~~~~~~~~~~~
+
+    Test the machine readable lock graph
+"""
+import json
+
+from pip_tools_compile import lockgraph
+
+
+def _package(name, version="1.0", required_by=(), excluded=False):
+    return {
+        "name": name,
+        "version": version,
+        "required_by": list(required_by),
+        "excluded": excluded,
+    }
+
+
+def test_lock_graph_path_for():
+    assert lockgraph.lock_graph_path_for("py3.7/linux.txt") == "py3.7/linux.lock.json"
+
+
+def test_install_order():
+    packages = {
+        "boto3": _package("boto3", required_by=["-r base.in"]),
+        "botocore": _package("botocore", required_by=["boto3", "s3transfer"]),
+        "s3transfer": _package("s3transfer", required_by=["boto3"]),
+        "jmespath": _package("jmespath", required_by=["boto3", "botocore"]),
+    }
+    edges = [
+        ["boto3", "botocore"],
+        ["boto3", "jmespath"],
+        ["boto3", "s3transfer"],
+        ["botocore", "jmespath"],
+        ["s3transfer", "botocore"],
+    ]
+    assert lockgraph.get_install_order(packages, edges) == [
+        ["jmespath"],
+        ["botocore"],
+        ["s3transfer"],
+        ["boto3"],
+    ]
+    packages["botocore"]["excluded"] = True
+    assert lockgraph.get_install_order(packages, edges) == [["jmespath", "s3transfer"], ["boto3"]]
+
+
+def test_install_order_with_cycles():
+    packages = {
+        "a": _package("a"),
+        "b": _package("b"),
+        "c": _package("c"),
+        "d": _package("d"),
+    }
+    edges = [["a", "b"], ["b", "a"], ["c", "a"]]
+    assert lockgraph.get_install_order(packages, edges) == [["d"], ["a", "b", "c"]]
+
+
+def test_sync_excluded(tmp_path):
+    compiled = tmp_path / "base.txt"
+    compiled.write_text(
+        "boto3==1.9.121\n"
+        "    # via -r base.in\n"
+        "# Next line explicitly commented out by __main__.py because of the following regex: '^Jmes'\n"
+        "# jmespath==0.10.0\n"
+        "#   via boto3\n"
+        "Python_Dateutil==2.8.1\n"
+    )
+    assert lockgraph.get_pinned_names(str(compiled)) == {"boto3", "python-dateutil"}
+    recorder = lockgraph.LockGraphRecorder()
+    recorder.packages = {
+        "boto3": _package("boto3", required_by=["-r base.in"]),
+        "jmespath": _package("jmespath", required_by=["boto3"]),
+        "python-dateutil": _package("python-dateutil", required_by=["boto3"]),
+    }
+    graph = lockgraph.build_lock_graph(recorder, "base.in", {"platform": "linux"})
+    assert graph["edges"] == [["boto3", "jmespath"], ["boto3", "python-dateutil"]]
+    graph_path = tmp_path / "base.lock.json"
+    lockgraph.write_lock_graph(graph, str(graph_path))
+    lockgraph.sync_excluded(str(graph_path), str(compiled))
+    graph = json.loads(graph_path.read_text())
+    assert graph["packages"]["jmespath"]["excluded"] is True
+    assert graph["packages"]["python-dateutil"]["excluded"] is False
+    assert graph["install_order"] == [["python-dateutil"], ["boto3"]]
+
+
+def test_compile_with_lock_graph(run_command, tmp_path):
+    input_requirement = tmp_path / "lock-graph.in"
+    input_requirement.write_text('jsonschema==3.2.0\npywin32 ; sys_platform == "win32"\n')
+    lock_graph_path = tmp_path / "py3.7" / "lock-graph.lock.json"
+    cache_dir = tmp_path / "cache"
+    cmd = (
+        "pip-tools-compile",
+        "-v",
+        "--py-version=3.7",
+        "--platform=linux",
+        "--lock-graph",
+        "--result-cache={}".format(cache_dir),
+        "--remove-line=^six==",
+        str(input_requirement),
+    )
+    assert run_command(*cmd) == 0
+    graph = json.loads(lock_graph_path.read_text())
+    assert graph["profile"]["platform"] == "linux"
+    assert graph["profile"]["py_version"] == "3.7"
+    jsonschema = graph["packages"]["jsonschema"]
+    assert jsonschema["version"] == "3.2.0"
+    assert jsonschema["required_by"] == ["-r {}".format(input_requirement)]
+    assert ["jsonschema", "pyrsistent"] in graph["edges"]
+    assert graph["packages"]["six"]["excluded"] is True
+    assert graph["install_order"][-1] == ["jsonschema"]
+    # Markers of the input requirements are kept, even when they do not apply
+    assert "pywin32" not in graph["packages"]
+
+    # The lock graph is restored along with the compiled requirements
+    lock_graph_path.unlink()
+    assert run_command(*cmd) == 0
+    assert json.loads(lock_graph_path.read_text()) == graph
@@ -0,0 +1,105 @@
+"""
+    test_multiindex
+    ~~~~~~~~~~~~~~~
+
+    Test querying several indexes concurrently, remembering which ones lack a project
+"""
+import http.server
+import json
+import threading
+
+import pytest
+
+from pip_tools_compile import multiindex
+
+
+class _EmptyIndexRequestHandler(http.server.BaseHTTPRequestHandler):
+    requested = []
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def empty_index_server():
+    server = http.server.HTTPServer(("127.0.0.1", 0), _EmptyIndexRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        del _EmptyIndexRequestHandler.requested[:]
+
+
+def test_absence_cache(tmp_path):
+    cache_file = str(tmp_path / "index-absences.json")
+    cache = multiindex.AbsenceCache(cache_file)
+    cache.add("https://example.com/simple", "Foo_Bar")
+    assert cache.is_absent("https://example.com/simple", "foo-bar") is True
+    assert cache.is_absent("https://pypi.org/simple", "foo-bar") is False
+    cache.write_cache()
+
+    # Merged with what another process wrote in the meantime
+    other = multiindex.AbsenceCache(cache_file)
+    other.add("https://pypi.org/simple", "baz")
+    other.write_cache()
+    with open(cache_file) as rfh:
+        entries = json.load(rfh)["entries"]
+    assert sorted(entries) == ["https://example.com/simple", "https://pypi.org/simple"]
+    # Written to a temporary file, moved into place
+    assert [path.name for path in tmp_path.iterdir()] == ["index-absences.json"]
+
+    # Expired entries are ignored, and dropped
+    entries["https://example.com/simple"]["foo-bar"] = 1
+    with open(cache_file, "w") as wfh:
+        json.dump({"__format__": multiindex.CACHE_FORMAT, "entries": entries}, wfh)
+    cache = multiindex.AbsenceCache(cache_file)
+    assert cache.is_absent("https://example.com/simple", "foo-bar") is False
+    cache.add("https://pypi.org/simple", "qux")
+    cache.write_cache()
+    with open(cache_file) as rfh:
+        entries = json.load(rfh)["entries"]
+    assert entries["https://example.com/simple"] == {}
+
+    # Nothing is remembered without a TTL
+    cache = multiindex.AbsenceCache(cache_file, ttl=0)
+    cache.add("https://example.com/simple", "foo-bar")
+    assert cache.is_absent("https://example.com/simple", "foo-bar") is False
+
+
+def test_compile_skips_indexes_lacking_a_project(
+    isolated_run_command, index_server, empty_index_server, tmp_path
+):
+    input_requirement = tmp_path / "multiindex.in"
+    input_requirement.write_text("pkg\n")
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        *index_server.pip_args,
+        "--extra-index-url=http://127.0.0.1:{}/simple".format(empty_index_server.server_address[1]),
+        str(input_requirement),
+    )
+    requested = empty_index_server.RequestHandlerClass.requested
+    assert isolated_run_command(*cmd) == 0
+    assert "dep==1.0" in (tmp_path / "py3.8" / "multiindex.txt").read_text()
+    assert sorted(set(requested)) == ["/simple/dep/", "/simple/pkg/"]
+    assert (tmp_path / "cache" / "pip-tools" / "index-absences.json").exists()
+
+    # Without pins to keep, the project pages are needed again
+    (tmp_path / "py3.8" / "multiindex.txt").unlink()
+    del requested[:]
+    del index_server.RequestHandlerClass.requested[:]
+    assert isolated_run_command(*cmd) == 0
+    assert requested == []
+    assert "/simple/pkg/" in index_server.RequestHandlerClass.requested
+
+    (tmp_path / "py3.8" / "multiindex.txt").unlink()
+    assert isolated_run_command(*cmd, "--index-absence-ttl=0") == 0
+    assert "/simple/pkg/" in requested
@@ -0,0 +1,161 @@
+"""
+    test_negativecache
+    ~~~~~~~~~~~~~~~~~~
+
+    Test the cache of candidate lookups which found nothing compatible
+"""
+import types
+
+import pytest
+from pip._internal.req.constructors import install_req_from_line
+from pip._vendor.packaging.version import parse as parse_version
+
+from pip_tools_compile import negativecache
+from pip_tools_compile.__main__ import PyPIRepository
+
+
+class _FakeResponse:
+    def __init__(self, status_code, headers=None, content=b""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+
+class _FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+        self.hooks = {"response": []}
+
+    def get(self, url, headers=None):
+        self.requested.append(url)
+        response = self.responses[url]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return negativecache.NegativeCache(str(tmp_path / "negcache" / "negcache-linux-py3.5.json"))
+
+
+@pytest.mark.parametrize(
+    "response,expected",
+    (
+        (_FakeResponse(404), "missing"),
+        (_FakeResponse(200, {"X-PyPI-Last-Serial": "123", "ETag": '"abc"'}), "serial:123"),
+        (_FakeResponse(200, {"ETag": '"abc"'}), 'etag:"abc"'),
+        (
+            _FakeResponse(200, content=b"page"),
+            "sha256:3660315a9af3df255d8f19ab077e4797822b41488a0e2a04bc6af71213c23274",
+        ),
+    ),
+)
+def test_get_index_validators(response, expected):
+    url = "https://pypi.org/simple/pywin32/"
+    session = _FakeSession({url: response})
+    validators = negativecache.get_index_validators(session, ["https://pypi.org/simple"], "PyWin32")
+    assert session.requested == [url]
+    assert validators == [[url, expected]]
+
+
+@pytest.mark.parametrize("response", (_FakeResponse(503), OSError("Connection refused")))
+def test_get_index_validators_unknown_state(response):
+    session = _FakeSession({"https://pypi.org/simple/pywin32/": response})
+    assert (
+        negativecache.get_index_validators(session, ["https://pypi.org/simple"], "pywin32") is None
+    )
+
+
+def test_add_and_get(cache):
+    validators = [["https://pypi.org/simple/pywin32/", "serial:1"]]
+    assert cache.get("pywin32", ">=300", validators) is None
+    tried = [
+        negativecache.CachedCandidate(parse_version("300")),
+        negativecache.CachedCandidate(parse_version("300")),
+        negativecache.CachedCandidate(parse_version("301")),
+    ]
+    cache.add("PyWin32", ">=300", validators, tried)
+
+    # A fresh instance reads what was persisted
+    cache = negativecache.NegativeCache(cache._cache_file)
+    assert cache.lookup("pywin32", ">=300")["tried"] == ["300", "301"]
+    candidates = cache.get("pywin32", ">=300", validators)
+    assert [candidate.version for candidate in candidates] == [
+        parse_version("300"),
+        parse_version("301"),
+    ]
+    assert cache.get("pywin32", ">=301", validators) is None
+
+
+def test_stale_entries_are_discarded(cache):
+    cache.add("pywin32", ">=300", [["https://pypi.org/simple/pywin32/", "serial:1"]], [])
+    assert cache.get("pywin32", ">=300", [["https://pypi.org/simple/pywin32/", "serial:2"]]) is None
+    assert cache.lookup("pywin32", ">=300") is None
+    assert negativecache.NegativeCache(cache._cache_file).lookup("pywin32", ">=300") is None
+
+
+def test_corrupt_cache_file_is_ignored(cache):
+    cache.add("pywin32", ">=300", [], [])
+    with open(cache._cache_file, "w") as wfh:
+        wfh.write("not json")
+    cache = negativecache.NegativeCache(cache._cache_file)
+    assert cache.lookup("pywin32", ">=300") is None
+    cache.clear()
+
+
+def test_recorded_validators_are_not_fetched_again():
+    url = "https://pypi.org/simple/pywin32/"
+    session = _FakeSession({})
+    recorder = negativecache.ValidatorRecorder(["https://pypi.org/simple"])
+    recorder.install(session)
+    # As the finder fetches the page
+    response = _FakeResponse(200, {"X-PyPI-Last-Serial": "123"})
+    response.history = []
+    response.request = types.SimpleNamespace(method="GET", url=url)
+    for hook in session.hooks["response"]:
+        hook(response)
+
+    assert recorder.get_index_validators(session, "PyWin32") == [[url, "serial:123"]]
+    assert session.requested == []
+
+
+def test_concurrent_writers_are_merged(cache):
+    other = negativecache.NegativeCache(cache._cache_file)
+    # Both read the cache before the other one wrote it
+    assert other.lookup("pyobjc", "==6.2") is None
+    cache.add("pywin32", ">=300", [], [])
+    other.add("pyobjc", "==6.2", [], [])
+
+    merged = negativecache.NegativeCache(cache._cache_file)
+    assert merged.lookup("pywin32", ">=300") is not None
+    assert merged.lookup("pyobjc", "==6.2") is not None
+
+
+def test_key_depends_on_the_finder_settings(tmp_path):
+    ireq = install_req_from_line("pywin32>=300")
+    keys = set()
+    for pip_args in ([], ["--only-binary=:all:"], ["--no-binary=pywin32"], ["--prefer-binary"]):
+        repository = PyPIRepository((3, 8), "linux", pip_args, str(tmp_path))
+        keys.add(repository._get_negative_cache_key(ireq, False))
+    assert len(keys) == 4
+
+
+def test_compile_miss_fetches_the_page_once(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "miss.in"
+    input_requirement.write_text("pkg>=2\n")
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=linux",
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+
+    assert isolated_run_command(*cmd) != 0
+    assert index_server.RequestHandlerClass.requested.count("/simple/pkg/") == 1
+    del index_server.RequestHandlerClass.requested[:]
+    # Only the validator of the page, served from the negative cache
+    assert isolated_run_command(*cmd) != 0
+    assert index_server.RequestHandlerClass.requested.count("/simple/pkg/") == 1
@@ -0,0 +1,112 @@
+"""
+    test_offline
+    ~~~~~~~~~~~~
+
+    Test compiling offline from the caches filled by ``pip-tools-compile prefetch``
+"""
+import argparse
+
+import pytest
+from pip._vendor import requests
+from pip._vendor.cachecontrol.adapter import CacheControlAdapter
+from pip._vendor.cachecontrol.cache import DictCache
+
+from pip_tools_compile import offline
+from pip_tools_compile import warmup
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (("linux:3.9", ("linux", "3.9", None)), ("darwin:3.10:arm64", ("darwin", "3.10", "arm64"))),
+)
+def test_parse_target(value, expected):
+    assert warmup.parse_target(value) == expected
+
+
+@pytest.mark.parametrize("value", ("linux", "beos:3.9", "linux:", "linux:3.9:arm64:1"))
+def test_parse_invalid_target(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        warmup.parse_target(value)
+
+
+def test_offline_adapter(index_server):
+    url = "http://127.0.0.1:{}/simple/pkg/".format(index_server.server_address[1])
+    session = requests.Session()
+    session.mount("http://", CacheControlAdapter(cache=DictCache()))
+    contents = session.get(url).content
+    misses = offline.CacheMisses()
+    offline.install(session, misses)
+    index_server.shutdown()
+    # Served from the cache, even when asked to revalidate, like pip does for index pages
+    response = session.get(url, headers={"Cache-Control": "max-age=0"})
+    assert response.status_code == 200
+    assert response.content == contents
+    with pytest.raises(offline.CacheMiss):
+        session.get(url.replace("pkg", "dep"))
+    assert list(misses) == [url.replace("pkg", "dep")]
+
+
+def test_prefetch(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "prefetch.in"
+    input_requirement.write_text("pkg\n")
+    cmd = (
+        "pip-tools-compile",
+        "prefetch",
+        "--target=linux:3.7",
+        "--target=windows:3.8",
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+    assert isolated_run_command(*cmd) == 0
+    # The compiled files are thrown away
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["cache", "prefetch.in"]
+    assert "/files/dep-1.0-py3-none-any.whl" in index_server.RequestHandlerClass.requested
+    depcaches = sorted(path.name for path in (tmp_path / "cache" / "pip-tools").glob("depcache-*"))
+    assert len(depcaches) == 2
+    assert "-mocked-py3.7.json" in depcaches[0]
+    assert "-mocked-py3.8.json" in depcaches[1]
+
+
+def test_prefetch_same_file_names(isolated_run_command, index_server, tmp_path):
+    index_server.RequestHandlerClass.add_project("dep", {"1.0": [], "2.0": []})
+    sources = []
+    for name in ("ci", "pkg"):
+        (tmp_path / name).mkdir()
+        sources.append(tmp_path / name / "linux.in")
+        sources[-1].write_text("dep\n")
+    # Only the first one was compiled before, when dep 1.0 was the latest
+    (tmp_path / "ci" / "py3.8").mkdir()
+    (tmp_path / "ci" / "py3.8" / "linux.txt").write_text("dep==1.0\n")
+    cmd = (
+        "pip-tools-compile",
+        "prefetch",
+        "--target=linux:3.8",
+        *index_server.pip_args,
+        *(str(source) for source in sources),
+    )
+    assert isolated_run_command(*cmd) == 0
+    # Each file was resolved from its own pins
+    requested = index_server.RequestHandlerClass.requested
+    assert "/files/dep-1.0-py3-none-any.whl" in requested
+    assert "/files/dep-2.0-py3-none-any.whl" in requested
+    assert not (tmp_path / "pkg" / "py3.8").exists()
+
+
+def test_offline_compile_lists_cache_misses(isolated_run_command, index_server, tmp_path):
+    input_requirement = tmp_path / "offline.in"
+    input_requirement.write_text("pkg\n")
+    cmd = (
+        "pip-tools-compile",
+        "-v",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--offline",
+        *index_server.pip_args,
+        str(input_requirement),
+    )
+    assert isolated_run_command(*cmd) != 0
+    # pip never caches plain HTTP responses
+    assert index_server.RequestHandlerClass.requested == []
+    error_log = (tmp_path / "py3.8" / "offline.log").read_text()
+    assert "these were not found in the caches" in error_log
+    assert "http://127.0.0.1:{}/simple/pkg/".format(index_server.server_address[1]) in error_log
@@ -0,0 +1,76 @@
+"""
+    test_patching
+    ~~~~~~~~~~~~~
+
+    Test the attribute substitutions used to impersonate a system
+"""
+import threading
+
+import pytest
+from pip._vendor.packaging import markers
+from pip._vendor.packaging import tags
+
+from pip_tools_compile.__main__ import ImpersonateLinux
+from pip_tools_compile.__main__ import ImpersonateWindows
+from pip_tools_compile.patching import constant
+from pip_tools_compile.patching import Substitution
+
+
+def test_substitution_restores_original():
+    original = tags._platform_tags
+    with Substitution("pip._vendor.packaging.tags._platform_tags", constant(["win_amd64"])):
+        assert tags._platform_tags() == ["win_amd64"]
+        assert tags._platform_tags("ignored", key="ignored") == ["win_amd64"]
+    assert tags._platform_tags is original
+
+
+def test_substitution_of_missing_attribute():
+    substitution = Substitution("pip._vendor.packaging.tags._no_such_attribute", None)
+    with pytest.raises(AttributeError):
+        substitution.start()
+    # Nothing to restore
+    substitution.stop()
+
+
+def test_substitution_cannot_start_twice():
+    substitution = Substitution("pip._vendor.packaging.tags._platform_tags", constant([]))
+    with substitution:
+        with pytest.raises(RuntimeError):
+            substitution.start()
+
+
+def test_impersonation_markers():
+    marker = markers.Marker('sys_platform == "win32" and os_name == "nt"')
+    original = markers.default_environment
+    with ImpersonateWindows("3.7", "windows"):
+        assert marker.evaluate()
+        # Marker.evaluate() updates the environment, which must not leak to other evaluations
+        assert marker.evaluate({"os_name": "posix"}) is False
+        assert markers.default_environment()["os_name"] == "nt"
+    assert markers.default_environment is original
+
+
+def test_impersonations_in_threads():
+    marker = markers.Marker('sys_platform == "win32"')
+    original = markers.default_environment
+    barrier = threading.Barrier(2, timeout=10)
+    results = {}
+
+    def evaluate(name, impersonation):
+        with impersonation:
+            # Both impersonations are active at once
+            barrier.wait()
+            results[name] = marker.evaluate()
+            barrier.wait()
+
+    threads = [
+        threading.Thread(target=evaluate, args=("windows", ImpersonateWindows("3.7", "windows"))),
+        threading.Thread(target=evaluate, args=("linux", ImpersonateLinux("3.7", "linux"))),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {"windows": True, "linux": False}
+    assert markers.default_environment is original
@@ -0,0 +1,193 @@
+"""
+    test_prefetch
+    ~~~~~~~~~~~~~
+
+    Test the speculative download of distributions
+"""
+import zipfile
+from collections import namedtuple
+
+import pytest
+
+from pip_tools_compile import prefetch
+from pip_tools_compile.__main__ import ImpersonateLinux
+
+_Link = namedtuple("_Link", ["filename", "url_without_fragment"])
+_Candidate = namedtuple("_Candidate", ["link"])
+_BestCandidateResult = namedtuple("_BestCandidateResult", ["best_candidate"])
+
+
+class _FakeResponse:
+    def __init__(self, content):
+        self.headers = {"Content-Length": str(len(content))}
+        self._content = content
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for idx in range(0, len(self._content), chunk_size):
+            yield self._content[idx : idx + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _FakeIndex:
+    """
+    Acts as both the pip session and the pip finder
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.requested = []
+
+    def find_best_candidate(self, name, specifier):
+        filename = self.files.get(name)
+        if filename is None:
+            return _BestCandidateResult(None)
+        return _BestCandidateResult(_Candidate(_Link(filename, "https://files/" + filename)))
+
+    def get(self, url, headers=None, stream=False):
+        self.requested.append(url)
+        return _FakeResponse(self.contents(url.rsplit("/", 1)[-1]))
+
+    def contents(self, filename):
+        return b"x" * 1000 if filename.endswith(".tar.gz") else self.wheels[filename]
+
+
+class _Pinned:
+    def __init__(self, name, specifier):
+        self.name = name
+        self.specifier = specifier
+        self.req = name
+
+
+def _make_wheel(path, name, requires_dist=()):
+    with zipfile.ZipFile(str(path), "w") as zfh:
+        metadata = "Metadata-Version: 2.1\nName: {}\nVersion: 1.0\n".format(name)
+        for line in requires_dist:
+            metadata += "Requires-Dist: {}\n".format(line)
+        zfh.writestr("{}-1.0.dist-info/METADATA".format(name), metadata)
+    return path.read_bytes()
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (("1024", 1024), ("512K", 512 * 1024), ("100M", 100 * 1024**2), ("1.5GB", 1536 * 1024**2)),
+)
+def test_parse_size(value, expected):
+    assert prefetch.parse_size(value) == expected
+
+
+def test_get_wheel_requirements(tmp_path):
+    path = tmp_path / "pkg-1.0-py3-none-any.whl"
+    _make_wheel(
+        path,
+        "pkg",
+        [
+            "requests (>=2)",
+            'pywin32 ; sys_platform == "win32"',
+            'pytest ; extra == "tests"',
+            'distro ; sys_platform == "linux"',
+        ],
+    )
+    with ImpersonateLinux("3.7", "linux"):
+        assert [str(req) for req in prefetch.get_wheel_requirements(str(path))] == [
+            "requests>=2",
+            'distro; sys_platform == "linux"',
+        ]
+        names = [req.name for req in prefetch.get_wheel_requirements(str(path), ["tests"])]
+        assert names == ["requests", "pytest", "distro"]
+
+
+def test_prefetch_follows_wheel_requirements(tmp_path):
+    index = _FakeIndex({"pkg": "pkg-1.0-py3-none-any.whl", "dep": "dep-1.0.tar.gz"})
+    index.wheels = {
+        "pkg-1.0-py3-none-any.whl": _make_wheel(tmp_path / "pkg.whl", "pkg", ["dep>=1"]),
+    }
+    download_dir = tmp_path / "pkgs"
+    settings = prefetch.PrefetchSettings(workers=2)
+    with prefetch.activate(settings):
+        prefetcher = settings.create_prefetcher(index, index, str(download_dir))
+        prefetcher.schedule("pkg", "==1.0")
+        prefetcher.schedule("pkg", "==1.0")
+        prefetcher.wait(_Pinned("pkg", "==1.0"))
+        prefetcher.wait(_Pinned("dep", ">=1"))
+    assert sorted(path.name for path in download_dir.iterdir()) == [
+        "dep-1.0.tar.gz",
+        "pkg-1.0-py3-none-any.whl",
+    ]
+    assert len(index.requested) == 2
+    assert prefetcher.stats["downloaded"] == 2
+
+
+def test_prefetch_budget(tmp_path):
+    index = _FakeIndex({"big": "big-1.0.tar.gz", "small": "small-1.0.tar.gz"})
+    download_dir = tmp_path / "pkgs"
+    settings = prefetch.PrefetchSettings(workers=1, max_bytes=1500)
+    with prefetch.activate(settings):
+        prefetcher = settings.create_prefetcher(index, index, str(download_dir))
+        prefetcher.schedule("big", "")
+        prefetcher.wait(_Pinned("big", ""))
+        prefetcher.schedule("small", "")
+        prefetcher.wait(_Pinned("small", ""))
+    # The first download consumed most of the budget, the second one does not fit
+    assert [path.name for path in download_dir.iterdir()] == ["big-1.0.tar.gz"]
+    assert prefetcher.bytes_left == 500
+    assert prefetcher.stats["skipped"] == 1
+
+
+class _FlakyIndex(_FakeIndex):
+    """
+    Fails the first download of every file halfway through
+    """
+
+    def get(self, url, headers=None, stream=False):
+        response = super().get(url, headers=headers, stream=stream)
+        if self.requested.count(url) == 1:
+            content = response._content
+            response.iter_content = lambda chunk_size: self._fail(content[: len(content) // 2])
+        return response
+
+    @staticmethod
+    def _fail(chunk):
+        yield chunk
+        raise ConnectionError("Connection reset")
+
+
+def test_prefetch_failure_refunds_the_budget(tmp_path):
+    index = _FlakyIndex({"big": "big-1.0.tar.gz"})
+    download_dir = tmp_path / "pkgs"
+    settings = prefetch.PrefetchSettings(workers=1, max_bytes=1500)
+    with prefetch.activate(settings):
+        prefetcher = settings.create_prefetcher(index, index, str(download_dir))
+        prefetcher.schedule("big", "")
+        prefetcher.wait(_Pinned("big", ""))
+        assert prefetcher.bytes_left == 1500
+        assert list(download_dir.iterdir()) == []
+        # The failed download can be scheduled again
+        prefetcher.schedule("big", "")
+        prefetcher.wait(_Pinned("big", ""))
+    assert [path.name for path in download_dir.iterdir()] == ["big-1.0.tar.gz"]
+    assert len(index.requested) == 2
+    assert prefetcher.bytes_left == 500
+
+
+def test_compile_with_prefetch(run_command, tmp_path):
+    input_requirement = tmp_path / "prefetch.in"
+    input_requirement.write_text("jsonschema==3.2.0\n")
+    compiled_requirements = tmp_path / "py3.7" / "prefetch.txt"
+    cmd = (
+        "pip-tools-compile",
+        "-v",
+        "--py-version=3.7",
+        "--platform=linux",
+        "--prefetch-workers=2",
+        "--clean-cache",
+        str(input_requirement),
+    )
+    assert run_command(*cmd) == 0
+    compiled_contents = compiled_requirements.read_text()
+    assert "jsonschema==3.2.0" in compiled_contents
+    assert "pyrsistent==" in compiled_contents
@@ -0,0 +1,73 @@
+"""
+    test_preflight
+    ~~~~~~~~~~~~~~
+
+    Test checking the direct requirements against a matrix of systems before compiling
+"""
+from pip_tools_compile import preflight
+
+
+def _add_links(index_server, name, links):
+    anchors = "".join(
+        '<a href="../../files/{0}"{1}>{0}</a>'.format(filename, attributes)
+        for filename, attributes in links
+    )
+    page = "<html><body>{}</body></html>".format(anchors)
+    index_server.RequestHandlerClass.files["/simple/{}/".format(name)] = page.encode("utf-8")
+
+
+def test_check_matrix(index_server, tmp_path):
+    _add_links(index_server, "winonly", [("winonly-1.0-py3-none-win32.whl", "")])
+    _add_links(
+        index_server,
+        "newpy",
+        [("newpy-1.0-py3-none-any.whl", ' data-requires-python="&gt;=3.10"')],
+    )
+    _add_links(index_server, "sdistonly", [("sdistonly-1.0.tar.gz", "")])
+    source = tmp_path / "matrix.in"
+    source.write_text("pkg>=2\nwinonly\nnewpy\nsdistonly\n")
+
+    linux, windows = preflight.check_matrix(
+        [("linux", "3.8", None), ("windows", "3.8", None)],
+        [*index_server.pip_args, str(source)],
+    )
+
+    assert linux.report.checked
+    assert [(ireq.name, reason) for ireq, reason in linux.report.problems] == [
+        ("pkg", "none of the 1 version(s) for this system matches, the latest being 1.0"),
+        ("winonly", "no distribution for this system"),
+        ("newpy", "no distribution for this system"),
+    ]
+    assert [ireq.name for ireq in linux.report.sdist_only] == ["sdistonly"]
+    assert windows.report.checked
+    assert [ireq.name for ireq, _ in windows.report.problems] == ["pkg", "newpy"]
+    # Only the index pages were read, and nothing was compiled
+    assert all(path.startswith("/simple/") for path in index_server.RequestHandlerClass.requested)
+    assert not (tmp_path / "py3.8").exists()
+
+
+def test_compile_preflight(isolated_run_command, index_server, tmp_path):
+    _add_links(index_server, "winonly", [("winonly-1.0-py3-none-win32.whl", "")])
+    source = tmp_path / "preflight.in"
+    source.write_text("pkg\nwinonly\n")
+
+    assert (
+        isolated_run_command(
+            "pip-tools-compile",
+            "--py-version=3.8",
+            "--platform=linux",
+            "--preflight",
+            *index_server.pip_args,
+            str(source),
+        )
+        != 0
+    )
+    log_contents = (tmp_path / "py3.8" / "preflight.log").read_text()
+    assert "These requirements can't be satisfied on" in log_contents
+    assert "winonly (from -r {} (line 2)): no distribution for this system".format(source) in (
+        log_contents
+    )
+    # Failed before looking up the dependencies of pkg
+    assert not any(
+        path.startswith("/files/") for path in index_server.RequestHandlerClass.requested
+    )
@@ -0,0 +1,66 @@
+"""
+    test_resolvertrace
+    ~~~~~~~~~~~~~~~~~~
+
+    Test the resolver trace export
+"""
+import json
+import textwrap
+
+from pip_tools_compile import resolvertrace
+
+
+def test_trace_events(tmp_path):
+    resolver_trace = resolvertrace.ResolverTrace(target={"platform": "linux"})
+    assert resolvertrace.get_current_trace() is None
+    with resolvertrace.activate(resolver_trace):
+        assert resolvertrace.get_current_trace() is resolver_trace
+        with resolver_trace.round():
+            with resolver_trace.span("find_best_match pep8", "candidates") as args:
+                args["best_match"] = "pep8==1.7.1"
+        with resolver_trace.round():
+            resolver_trace.instant("stable", "round")
+    assert resolvertrace.get_current_trace() is None
+
+    trace_path = resolvertrace.trace_path_for(str(tmp_path / "pep8.txt"))
+    assert trace_path == str(tmp_path / "pep8.trace.json")
+    resolver_trace.write(trace_path)
+    with open(trace_path) as rfh:
+        data = json.load(rfh)
+    assert data["otherData"] == {"platform": "linux", "rounds": 2}
+    names = [event["name"] for event in data["traceEvents"]]
+    assert names == ["round 1", "find_best_match pep8", "round 2", "stable"]
+    round_1, find_best_match = data["traceEvents"][:2]
+    assert find_best_match["args"] == {"best_match": "pep8==1.7.1"}
+    assert round_1["ts"] <= find_best_match["ts"]
+    assert round_1["dur"] >= find_best_match["dur"]
+
+
+def test_compile_trace(run_command, tmp_path):
+    input_requirement = tmp_path / "trace.in"
+    input_requirement.write_text(
+        textwrap.dedent(
+            """\
+            pep8
+            pywin32==300; sys.platform == 'win32'
+            """
+        )
+    )
+    retcode = run_command(
+        "pip-tools-compile",
+        "-v",
+        "--clean-cache",
+        "--trace",
+        "--platform=windows",
+        "--py-version=3.8",
+        str(input_requirement),
+    )
+    assert retcode == 0
+    with open(str(tmp_path / "py3.8" / "trace.trace.json")) as rfh:
+        data = json.load(rfh)
+    assert data["otherData"]["platform"] == "windows"
+    assert data["otherData"]["rounds"] >= 1
+    events = {event["name"]: event for event in data["traceEvents"]}
+    assert "round 1" in events
+    assert events["find_best_match pep8"]["args"]["best_match"].startswith("pep8==")
+    assert "get_dependencies pywin32" in events
@@ -0,0 +1,214 @@
+"""
+    test_resultcache
+    ~~~~~~~~~~~~~~~~
+
+    Test the compiled requirements result cache
+"""
+import http.server
+import json
+import os
+import threading
+
+import pytest
+
+from pip_tools_compile import resultcache
+
+
+class _CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    store = {}
+
+    def do_GET(self):
+        data = self.store.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        self.store[self.path] = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_cache_url():
+    server = http.server.HTTPServer(("127.0.0.1", 0), _CacheRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/cache".format(server.server_address[1])
+    finally:
+        server.shutdown()
+        _CacheRequestHandler.store.clear()
+
+
+@pytest.fixture(params=["directory", "http"])
+def cache_location(request, tmp_path):
+    if request.param == "directory":
+        return str(tmp_path / "cache")
+    return request.getfixturevalue("http_cache_url")
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    constraints = tmp_path / "constraints.txt"
+    constraints.write_text("boto3==1.9.121\n")
+    source = tmp_path / "source.in"
+    source.write_text("boto3\n-c constraints.txt\n")
+    return str(source), str(constraints), str(tmp_path / "source.txt")
+
+
+def _fingerprint(source, dest, **profile):
+    profile.setdefault("platform", "linux")
+    return resultcache.fingerprint(["pip-compile", "-o", dest, source], [source], dest, profile)
+
+
+def test_get_backend(tmp_path):
+    assert isinstance(resultcache.get_backend(str(tmp_path)), resultcache.DirectoryBackend)
+    backend = resultcache.get_backend(tmp_path.as_uri())
+    assert isinstance(backend, resultcache.DirectoryBackend)
+    assert backend.path == str(tmp_path)
+    assert isinstance(resultcache.get_backend("http://cache:8080"), resultcache.HTTPBackend)
+
+
+def test_fingerprint_follows_constraints(inputs):
+    source, constraints, dest = inputs
+    key = _fingerprint(source, dest)
+    assert key == _fingerprint(source, dest)
+    with open(constraints, "w") as wfh:
+        wfh.write("boto3==1.9.122\n")
+    assert key != _fingerprint(source, dest)
+
+
+def test_fingerprint_profile_and_dest(inputs):
+    source, _, dest = inputs
+    key = _fingerprint(source, dest)
+    assert key != _fingerprint(source, dest, platform="windows")
+    with open(dest, "w") as wfh:
+        wfh.write("boto3==1.9.121\n")
+    assert key != _fingerprint(source, dest)
+
+
+def test_fingerprint_is_relative_to_the_checkout(monkeypatch, tmp_path):
+    keys = []
+    for checkout in ("one", "two"):
+        root = tmp_path / checkout
+        root.mkdir()
+        (root / "source.in").write_text("boto3\n")
+        monkeypatch.chdir(root)
+        # pip-tools-compile passes absolute paths to pip-compile
+        keys.append(_fingerprint(str(root / "source.in"), str(root / "source.txt")))
+    assert keys[0] == keys[1]
+
+
+def test_fingerprint_follows_the_index_config(inputs, monkeypatch, tmp_path):
+    monkeypatch.delenv("PIP_INDEX_URL", raising=False)
+    monkeypatch.delenv("PIP_EXTRA_INDEX_URL", raising=False)
+    monkeypatch.setenv("PIP_CONFIG_FILE", os.devnull)
+    source, _, dest = inputs
+    key = _fingerprint(source, dest)
+    monkeypatch.setenv("PIP_EXTRA_INDEX_URL", "https://mirror.example.com/simple")
+    assert key != _fingerprint(source, dest)
+    monkeypatch.delenv("PIP_EXTRA_INDEX_URL")
+    pip_conf = tmp_path / "pip.conf"
+    pip_conf.write_text("[global]\nindex-url = https://mirror.example.com/simple\n")
+    monkeypatch.setenv("PIP_CONFIG_FILE", str(pip_conf))
+    assert key != _fingerprint(source, dest)
+    # Settings which don't select the indexes don't change the key
+    pip_conf.write_text("[global]\ntimeout = 60\n")
+    assert key == _fingerprint(source, dest)
+
+
+@pytest.mark.parametrize(
+    "args,expected",
+    (
+        (["pip-compile", "-o", "out.txt", "in.in"], True),
+        (["pip-compile", "-U", "-o", "out.txt", "in.in"], False),
+        (["pip-compile", "--upgrade-package=boto3", "-o", "out.txt", "in.in"], False),
+        (["pip-compile", "--rebuild", "-o", "out.txt", "in.in"], False),
+    ),
+)
+def test_is_cacheable(args, expected):
+    assert resultcache.is_cacheable(args) is expected
+
+
+def test_store_and_restore(cache_location, inputs):
+    source, _, dest = inputs
+    cache = resultcache.ResultCache.from_location(cache_location)
+    key = _fingerprint(source, dest)
+    assert cache.restore(key, dest) is False
+    with open(dest, "w") as wfh:
+        wfh.write("boto3==1.9.121\n")
+    assert cache.store(key, dest) is True
+    os.unlink(dest)
+    assert cache.restore(key, dest) is True
+    with open(dest) as rfh:
+        assert rfh.read() == "boto3==1.9.121\n"
+
+
+def test_store_and_restore_companions(tmp_path, inputs):
+    source, _, dest = inputs
+    companion = str(tmp_path / "source.lock.json")
+    cache = resultcache.ResultCache.from_location(str(tmp_path / "cache"))
+    key = _fingerprint(source, dest)
+    with open(dest, "w") as wfh:
+        wfh.write("boto3==1.9.121\n")
+    with open(companion, "w") as wfh:
+        wfh.write("{}\n")
+    assert cache.store(key, dest, companions=[companion]) is True
+    os.unlink(dest)
+    os.unlink(companion)
+    assert cache.restore(key, dest, companions=[companion]) is True
+    with open(companion) as rfh:
+        assert rfh.read() == "{}\n"
+    # An entry stored without the companion file can't satisfy a compile which needs it
+    assert cache.store(key, dest) is True
+    assert cache.restore(key, dest, companions=[companion]) is False
+
+
+def test_restore_rejects_corrupt_entries(tmp_path, inputs):
+    source, _, dest = inputs
+    backend = resultcache.DirectoryBackend(str(tmp_path / "cache"))
+    cache = resultcache.ResultCache(backend)
+    key = _fingerprint(source, dest)
+    with open(dest, "w") as wfh:
+        wfh.write("boto3==1.9.121\n")
+    cache.store(key, dest)
+    entry = json.loads(backend.get(key).decode("utf-8"))
+    entry["contents"] = "boto3==1.9.122\n"
+    backend.put(key, json.dumps(entry).encode("utf-8"))
+    os.unlink(dest)
+    assert cache.restore(key, dest) is False
+    assert not os.path.exists(dest)
+    backend.put(key, b"not json")
+    assert cache.restore(key, dest) is False
+
+
+def test_compile_restored_from_result_cache(run_command, tmp_path):
+    input_requirement = tmp_path / "result-cache.in"
+    input_requirement.write_text("jsonschema==2.6.0\n")
+    compiled_requirements = tmp_path / "py3.7" / "result-cache.txt"
+    cache_dir = tmp_path / "cache"
+    cmd = (
+        "pip-tools-compile",
+        "-v",
+        "--py-version=3.7",
+        "--platform=linux",
+        "--result-cache={}".format(cache_dir),
+        str(input_requirement),
+    )
+    assert run_command(*cmd) == 0
+    compiled_contents = compiled_requirements.read_text()
+    assert "jsonschema==2.6.0" in compiled_contents
+    assert len(list(cache_dir.glob("*/*.json"))) == 1
+
+    compiled_requirements.unlink()
+    assert run_command(*cmd) == 0
+    assert compiled_requirements.read_text() == compiled_contents
+    assert len(list(cache_dir.glob("*/*.json"))) == 1
@@ -0,0 +1,80 @@
+"""
+    test_seeding
+    ~~~~~~~~~~~~
+
+    Test warm starting compiles from the compiled files of other targets
+"""
+import textwrap
+
+import pytest
+
+from pip_tools_compile import seeding
+
+
+@pytest.fixture
+def lib_index(index_server):
+    index_server.RequestHandlerClass.add_project("lib", {"1.0": [], "2.0": []})
+    index_server.RequestHandlerClass.add_project("other", {"1.0": [], "2.0": []})
+    return index_server
+
+
+def test_read_pins(tmp_path):
+    compiled = tmp_path / "compiled.txt"
+    compiled.write_text(
+        textwrap.dedent(
+            """\
+            #
+            # This file is autogenerated by pip-compile
+            #
+            --index-url https://example.com/simple
+            Foo_Bar[extra]==1.2.3 ; sys_platform == "linux" \\
+                --hash=sha256:0000
+                # via -r base.in
+            -e file:///src/project
+            ranged>=1.0
+            six==1.16.0  # via foo-bar
+            """
+        )
+    )
+    assert seeding.read_pins(str(compiled)) == {"foo-bar": "1.2.3", "six": "1.16.0"}
+
+
+def test_find_siblings(tmp_path):
+    for py_version in ("3.6", "3.7", "3.9", "3.10"):
+        (tmp_path / "py{}".format(py_version)).mkdir()
+        (tmp_path / "py{}".format(py_version) / "linux.txt").write_text("")
+    (tmp_path / "py3.8").mkdir()
+
+    assert seeding.find_siblings(str(tmp_path / "py3.8" / "linux.txt")) == [
+        str(tmp_path / "py3.9" / "linux.txt"),
+        str(tmp_path / "py3.7" / "linux.txt"),
+        str(tmp_path / "py3.10" / "linux.txt"),
+        str(tmp_path / "py3.6" / "linux.txt"),
+    ]
+    assert seeding.find_siblings(str(tmp_path / "linux.txt")) == []
+
+
+@pytest.mark.parametrize("resolver", ("legacy", "backtracking"))
+def test_compile_seeded_from_siblings(isolated_run_command, lib_index, tmp_path, resolver):
+    input_requirement = tmp_path / "seeded.in"
+    input_requirement.write_text("lib\nother\n")
+    (tmp_path / "py3.7").mkdir()
+    # other==9.0 does not exist, the compile diverges there
+    (tmp_path / "py3.7" / "seeded.txt").write_text("lib==1.0\nother==9.0\n")
+    cmd = (
+        "pip-tools-compile",
+        "--py-version=3.8",
+        "--platform=windows",
+        "--resolver={}".format(resolver),
+        *lib_index.pip_args,
+        str(input_requirement),
+    )
+
+    assert isolated_run_command(*cmd, "--seed-siblings") == 0
+    contents = (tmp_path / "py3.8" / "seeded.txt").read_text()
+    assert "lib==1.0" in contents
+    assert "other==2.0" in contents
+
+    (tmp_path / "py3.8" / "seeded.txt").unlink()
+    assert isolated_run_command(*cmd) == 0
+    assert "lib==2.0" in (tmp_path / "py3.8" / "seeded.txt").read_text()
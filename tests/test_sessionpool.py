@@ -0,0 +1,74 @@
+"""
+    test_sessionpool
+    ~~~~~~~~~~~~~~~~
+
+    Test sharing connections and index pages between the compiles of an invocation
+"""
+import types
+
+from pip._internal.network.session import PipSession
+
+from pip_tools_compile import sessionpool
+
+
+def _get_options(**kwargs):
+    options = dict(
+        cache_dir=None, retries=0, trusted_hosts=[], cert=None, client_cert=None, proxy=None
+    )
+    options.update(kwargs)
+    return types.SimpleNamespace(**options)
+
+
+def test_attach_shares_adapters_with_the_same_settings():
+    pool = sessionpool.SessionPool()
+    first, second, other = PipSession(), PipSession(), PipSession()
+    pool.attach(first, _get_options())
+    pool.attach(second, _get_options())
+    pool.attach(other, _get_options(retries=3))
+
+    assert second.adapters["https://"] is first.adapters["https://"]
+    assert second.adapters["http://"] is first.adapters["http://"]
+    assert other.adapters["https://"] is not first.adapters["https://"]
+    assert pool.stats["sessions"] == 3
+    assert pool.stats["reused"] == 1
+    pool.close()
+
+
+def test_pages_are_evicted_by_size():
+    pool = sessionpool.SessionPool(max_pages_bytes=10)
+    for name in ("a", "b", "c"):
+        pool.add_page(name, types.SimpleNamespace(content=b"x" * 4))
+    assert pool.get_page("a") is None
+    assert pool.get_page("b") is not None
+    # "b" was used last, "c" goes first
+    pool.add_page("d", types.SimpleNamespace(content=b"x" * 4))
+    assert pool.get_page("c") is None
+    assert pool.get_page("b") is not None
+    # Too big to be kept at all
+    pool.add_page("e", types.SimpleNamespace(content=b"x" * 11))
+    assert pool.get_page("e") is None
+    assert pool.get_page("d") is not None
+
+
+def test_compiles_share_index_pages(isolated_run_command, index_server, tmp_path):
+    inputs = []
+    for name in ("one", "two"):
+        input_requirement = tmp_path / "{}.in".format(name)
+        input_requirement.write_text("pkg\n")
+        inputs.append(str(input_requirement))
+    requested = index_server.RequestHandlerClass.requested
+
+    assert (
+        isolated_run_command(
+            "pip-tools-compile",
+            "--py-version=3.8",
+            "--platform=windows",
+            *index_server.pip_args,
+            *inputs
+        )
+        == 0
+    )
+    for name in ("one", "two"):
+        assert "dep==1.0" in (tmp_path / "py3.8" / "{}.txt".format(name)).read_text()
+    assert requested.count("/simple/pkg/") == 1
+    assert requested.count("/simple/dep/") == 1
@@ -0,0 +1,149 @@
+"""
+    test_sharding
+    ~~~~~~~~~~~~~
+
+    Test the split of the compile work items across CI nodes
+"""
+import json
+
+import pytest
+
+from pip_tools_compile import sharding
+from pip_tools_compile.api import Job
+from pip_tools_compile.api import select_shard
+
+
+@pytest.mark.parametrize("value,expected", (("1/1", (1, 1)), ("2/4", (2, 4))))
+def test_parse_shard(value, expected):
+    assert sharding.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ("0/2", "3/2", "1", "1/0", "a/b", "1/2/3"))
+def test_parse_invalid_shard(value):
+    with pytest.raises(ValueError):
+        sharding.parse_shard(value)
+
+
+def test_get_work_item_key():
+    assert (
+        sharding.get_work_item_key("requirements/./static/linux.in", "linux", "3.7")
+        == "requirements/static/linux.in::linux-py3.7"
+    )
+    assert (
+        sharding.get_work_item_key("darwin.in", "darwin", "3.9", "arm64")
+        == "darwin.in::darwin-py3.9-arm64"
+    )
+
+
+def test_longest_first():
+    durations = {"a": 100, "b": 60, "c": 50, "d": 40, "e": 10}
+    assert sharding.assign(list(durations), 2, durations) == [["a", "d"], ["b", "c", "e"]]
+    # The assignment does not depend on the order work items are given in
+    assert sharding.assign(sorted(durations, reverse=True), 2, durations) == [
+        ["a", "d"],
+        ["b", "c", "e"],
+    ]
+    assert sharding.select(["e", "d", "c", "b", "a"], 1, 2, durations) == ["d", "a"]
+
+
+def test_unknown_durations_use_the_median():
+    durations = {"a": 30, "b": 10, "c": 20}
+    shards = sharding.assign(["a", "b", "c", "new"], 2, durations)
+    assert shards == [["a", "b"], ["c", "new"]]
+    assert sharding.estimate(["c", "new"], durations) == 40
+    # Without any recorded durations, items are spread evenly
+    assert sharding.assign(["a", "b", "c", "d"], 3) == [["a", "d"], ["b"], ["c"]]
+
+
+def test_shard_durations_are_merged(tmp_path):
+    durations_path = tmp_path / "durations.json"
+    sharding.write_durations(str(durations_path), {"a": 10.0, "b": 20.0})
+    sharding.write_durations(
+        sharding.get_shard_durations_path(str(durations_path), 1, 2), {"a": 15.12345}
+    )
+    sharding.write_durations(
+        sharding.get_shard_durations_path(str(durations_path), 2, 2), {"c": 5.0}
+    )
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "durations.json",
+        "durations.shard-1-of-2.json",
+        "durations.shard-2-of-2.json",
+    ]
+    # Only merged explicitly
+    assert sharding.read_durations(str(durations_path)) == {"a": 10.0, "b": 20.0}
+    assert sharding.merge_durations(str(durations_path)) == [
+        sharding.get_shard_durations_path(str(durations_path), 1, 2),
+        sharding.get_shard_durations_path(str(durations_path), 2, 2),
+    ]
+    assert sharding.read_durations(str(durations_path)) == {"a": 15.123, "b": 20.0, "c": 5.0}
+    assert [path.name for path in tmp_path.iterdir()] == ["durations.json"]
+    assert sharding.read_durations(str(tmp_path / "missing.json")) == {}
+
+
+def test_stale_shard_durations_do_not_change_the_split(tmp_path):
+    durations_path = tmp_path / "durations.json"
+    sharding.write_durations(str(durations_path), {"a": 10.0, "b": 20.0, "c": 30.0})
+    keys = ["a", "b", "c", "d"]
+    split = sharding.select(keys, 1, 2, sharding.read_durations(str(durations_path)))
+    # Left over by a previous run with 3 shards, on this node only
+    sharding.write_durations(
+        sharding.get_shard_durations_path(str(durations_path), 1, 3), {"a": 500.0, "d": 1.0}
+    )
+    assert sharding.select(keys, 1, 2, sharding.read_durations(str(durations_path))) == split
+
+
+def test_merge_durations_command(tmp_path, capsys):
+    durations_path = tmp_path / "durations.json"
+    sharding.write_durations(
+        sharding.get_shard_durations_path(str(durations_path), 2, 2), {"c": 5.0}
+    )
+    assert sharding.main([str(durations_path)]) == 0
+    assert "Merged" in capsys.readouterr().out
+    assert sharding.read_durations(str(durations_path)) == {"c": 5.0}
+
+
+def test_select_shard_jobs():
+    jobs = [
+        Job("linux.in", platform="linux", py_version="3.7"),
+        Job("linux.in", platform="linux", py_version="3.9"),
+        Job("windows.in", platform="windows", py_version="3.9"),
+    ]
+    durations = {
+        "linux.in::linux-py3.7": 100,
+        "linux.in::linux-py3.9": 60,
+        "windows.in::windows-py3.9": 50,
+    }
+    assert select_shard(jobs, 1, 2, durations) == jobs[:1]
+    assert select_shard(jobs, 2, 2, durations) == jobs[1:]
+
+
+def test_compile_shard(run_command, tmp_path):
+    heavy_requirement = tmp_path / "heavy.in"
+    heavy_requirement.write_text("boto3==1.9.121\n")
+    light_requirement = tmp_path / "light.in"
+    light_requirement.write_text("jsonschema==2.6.0\n")
+    durations_path = tmp_path / "durations.json"
+    durations_path.write_text(
+        json.dumps(
+            {
+                sharding.get_work_item_key(str(heavy_requirement), "linux", "3.7"): 100,
+                sharding.get_work_item_key(str(light_requirement), "linux", "3.7"): 5,
+            }
+        )
+    )
+    cmd = (
+        "pip-tools-compile",
+        "-v",
+        "--py-version=3.7",
+        "--platform=linux",
+        "--shard=2/2",
+        "--durations={}".format(durations_path),
+        str(heavy_requirement),
+        str(light_requirement),
+    )
+    assert run_command(*cmd) == 0
+    assert sorted(path.name for path in (tmp_path / "py3.7").iterdir()) == ["light.txt"]
+    shard_durations = json.loads((tmp_path / "durations.shard-2-of-2.json").read_text())
+    assert list(shard_durations) == [
+        sharding.get_work_item_key(str(light_requirement), "linux", "3.7")
+    ]
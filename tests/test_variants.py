@@ -0,0 +1,79 @@
+"""
+    test_variants
+    ~~~~~~~~~~~~~
+
+    Test compiling variants on top of a shared base resolution
+"""
+import pytest
+
+from pip_tools_compile import variants
+from pip_tools_compile.__main__ import get_output_path
+from pip_tools_compile.__main__ import get_parser
+
+
+def test_parse_variant():
+    assert variants.parse_variant("zeromq=requirements/zeromq.txt, requirements/pytest.txt") == (
+        variants.Variant("zeromq", ["requirements/zeromq.txt", "requirements/pytest.txt"])
+    )
+    with pytest.raises(ValueError):
+        variants.parse_variant("requirements/zeromq.txt")
+    with pytest.raises(ValueError):
+        variants.parse_variant("../zeromq=requirements/zeromq.txt")
+
+
+def test_get_variant_options(tmp_path):
+    variant = variants.Variant("zeromq", ["requirements/zeromq.txt"])
+    options = get_parser().parse_args(["--output-dir={}".format(tmp_path), "linux.in"])
+    assert variants.get_variant_options(options, variant, "linux.txt").out_prefix == "zeromq"
+
+    options.out_prefix = "py3"
+    variant_options = variants.get_variant_options(options, variant, "py3-linux.txt")
+    assert variant_options.out_prefix == "py3-zeromq"
+    assert variant_options.include == ["requirements/zeromq.txt"]
+    assert variant_options.seed_from == ["py3-linux.txt"]
+    assert get_output_path("linux.in", variant_options) == str(tmp_path / "py3-zeromq-linux.txt")
+    # The base options are left alone
+    assert options.out_prefix == "py3"
+    assert options.include == []
+
+
+def test_compile_variants(isolated_run_command, index_server, tmp_path):
+    index_server.RequestHandlerClass.add_project("dep", {"1.0": [], "2.0": []})
+    index_server.RequestHandlerClass.add_project("six", {"1.0": [], "2.0": []})
+    index_server.RequestHandlerClass.add_project("zmq", {"1.0": ["dep<2"]})
+    index_server.RequestHandlerClass.add_project("pytest", {"1.0": []})
+    source = tmp_path / "base.in"
+    source.write_text("pkg\nsix\n")
+    zeromq = tmp_path / "zeromq.txt"
+    zeromq.write_text("zmq\n")
+    pytest_include = tmp_path / "pytest.txt"
+    pytest_include.write_text("pytest\n")
+    # Compiled before the base moved on
+    (tmp_path / "py3.8").mkdir()
+    (tmp_path / "py3.8" / "zeromq-base.txt").write_text("six==1.0\n")
+
+    assert (
+        isolated_run_command(
+            "pip-tools-compile",
+            "--py-version=3.8",
+            "--platform=linux",
+            "--variant=zeromq={},{}".format(zeromq, pytest_include),
+            "--variant=pytest={}".format(pytest_include),
+            *index_server.pip_args,
+            str(source),
+        )
+        == 0
+    )
+
+    base = (tmp_path / "py3.8" / "base.txt").read_text()
+    assert "dep==2.0" in base
+    assert "zmq" not in base
+    variant = (tmp_path / "py3.8" / "zeromq-base.txt").read_text()
+    # Only what conflicts with the extra includes diverges from the base
+    assert "dep==1.0" in variant
+    assert "six==2.0" in variant
+    assert "zmq==1.0" in variant
+    assert "pytest==1.0" in variant
+    variant = (tmp_path / "py3.8" / "pytest-base.txt").read_text()
+    assert "dep==2.0" in variant
+    assert "pytest==1.0" in variant